@@ -1,14 +1,23 @@
 import streamlit as st
 import pandas as pd
 import re
+import os
+import json
 from datetime import datetime
+from pathlib import Path
 import plotly.express as px
 
-from utils import fetch_categories_and_tests
+from utils import live_data, LIVE_REFRESH_INTERVAL
 
 st.set_page_config(layout="wide")
 
 conn = st.connection("postgresql", type="sql")
+duck_conn = st.session_state["duck_conn"]
+
+# written by src/utils/snapshot_export.py
+SNAPSHOT_DIR = Path(
+    os.getenv("SNAPSHOT_DIR", Path(__file__).resolve().parents[2] / "snapshots")
+)
 
 if "dashboard_title_extra" not in st.session_state:
     st.session_state.dashboard_title_extra = None
@@ -56,101 +65,232 @@ if dash_period == "Yearly":
     )
 
 
-def end_of_month(year: int, month: int) -> pd.Timestamp:
+def period_bounds(dash_period, dash_year, dash_month):
     """
-    Calculate the final moment of a given month.
-
-    Given a specific year and month, this function returns a pandas Timestamp
-    representing the **last day of that month at 23:59:59**. It correctly accounts
-    for varying month lengths and leap years.
+    Translates the dashboard period filters into a [start, end) range of days
+    for the rollup queries.
 
-    Args:
-        year (int): The target year (e.g., 2025).
-        month (int): The target month (1–12).
+    "This week" is the last 7 days, today included.
 
     Returns:
-        pandas.Timestamp: A timestamp set to the final second of the last day of
-        the specified month. Example:
-            end_of_month(2024, 2) → Timestamp('2024-02-29 23:59:59')
+        tuple: (start, end) as pandas Timestamps at midnight; either may be None
+        when the period is open on that side.
+    """
+    now = pd.Timestamp.now()
+
+    if dash_period == "This week":
+        return now.normalize() - pd.Timedelta(days=6), None
+
+    elif dash_period == "This Month":
+        start = pd.Timestamp(year=now.year, month=now.month, day=1)
+        return start, start + pd.offsets.MonthBegin(1)
+
+    elif dash_period == "Yearly":
+        if dash_month:
+            start = pd.Timestamp(
+                year=dash_year, month=months.index(dash_month) + 1, day=1
+            )
+            return start, start + pd.offsets.MonthBegin(1)
+        return pd.Timestamp(year=dash_year, month=1, day=1), pd.Timestamp(
+            year=dash_year + 1, month=1, day=1
+        )
+
+    return None, None
+
+
+def period_title(dash_period, dash_year, dash_month):
+    """
+    Returns the caption shown under the dashboard title for the selected period.
     """
-    ts = pd.Timestamp(year=year, month=month, day=1)
-    very_end_of_month = ts + pd.offsets.MonthEnd(1)
-    very_end_of_month.replace(hour=23, minute=59, second=59)
-    return very_end_of_month
+    if dash_period == "This week":
+        return "This Week"
+    elif dash_period == "This Month":
+        return "This Month"
+    elif dash_period == "Yearly":
+        return f"{dash_month} {dash_year}" if dash_month else f"{dash_year}"
+    return "All Time"
+
+
+def snapshot_taken_at():
+    """
+    Returns when the dashboard snapshot was last exported, as a pandas Timestamp,
+    or None if it hasn't been exported yet.
+    """
+    state_file = SNAPSHOT_DIR / "state.json"
+    if not state_file.exists():
+        return None
+    return pd.Timestamp(json.loads(state_file.read_text())["watermark"])
 
 
 def load_data(dash_period, dash_year, dash_month):
     """
-    Fetches the main datasets from the database for the application.
+    Fetches the dashboard metrics for the selected period.
+
+    Request metrics are aggregated by DuckDB over the Parquet snapshot written
+    by `src/utils/snapshot_export.py`, so the dashboard's scans never touch the
+    live database. The snapshot is partitioned by month and only the months in
+    the period are read. It keeps archived months, like the rollups behind the
+    live status metrics, so both cover the same history. Test and category popularity count each test on a
+    request once, with names and categories from the snapshot's test catalog.
+    Users are few, so they are counted in Postgres.
 
     Returns:
-        tuple:
-            - users (DataFrame): All non-deleted users from the `users` table.
-            - requests (DataFrame): All lab requests from the `requests` table.
-            - tests (DataFrame): All test categories and available tests from the `tests` table.
+        dict of DataFrames:
+            - requests_overtime: `created_date`, `count`, one row per day with requests.
+            - category_popularity: `category`, `count`, the 5 most requested categories.
+            - test_popularity: `Test`, `Count`, the 10 most requested tests.
+            - users: `user_type`, `tg_active`, `count` for users registered by the
+              end of the period.
+
+    Notes:
+        - If no snapshot has been exported yet, the page shows an error and stops.
+    """
+    requests_glob = SNAPSHOT_DIR / "requests" / "*" / "*.parquet"
+    tests_file = SNAPSHOT_DIR / "tests" / "data.parquet"
+    if not tests_file.exists():
+        st.error(
+            "No dashboard snapshot found. Run `src/utils/snapshot_export.py` or contact the system admin."
+        )
+        st.stop()
+
+    start, end = period_bounds(dash_period, dash_year, dash_month)
+    conditions = ["true"]
+    params = {}
+    # month= is the snapshot's hive partition key, filtering on it skips whole files
+    if start is not None:
+        conditions.append("r.month >= $start_month AND r.created_at >= $start")
+        params["start_month"] = start.strftime("%Y-%m")
+        params["start"] = start.to_pydatetime()
+    if end is not None:
+        conditions.append("r.month < $end_month AND r.created_at < $end")
+        params["end_month"] = end.strftime("%Y-%m")
+        params["end"] = end.to_pydatetime()
+
+    period_requests = f"""
+        WITH period_requests AS (
+            SELECT r.* FROM read_parquet(
+                '{requests_glob}', hive_partitioning = true, hive_types = {{'month': VARCHAR}}
+            ) r
+            WHERE {" AND ".join(conditions)}
+        ),
+        requested_tests AS (
+            SELECT t.*
+            FROM (SELECT unnest(test_codes) AS code FROM period_requests) p
+            JOIN read_parquet('{tests_file}') t ON t.code = p.code
+        )
     """
-    users = conn.query(
-        "SELECT user_type, created_at, (telegram_chat_id IS NOT NULL) AS tg_active FROM users WHERE is_deleted = false",
-        ttl=0,
-    )
-    requests = conn.query("SELECT * FROM requests", ttl=0)
-    tests = conn.query("SELECT * FROM tests", ttl=0)
-
-    if dash_period == "This week":
-        # weekly_users = users[users['created_at'] >= pd.Timestamp.now() - pd.Timedelta(days=7)]
-        weekly_requests = requests[
-            requests["created_at"] >= pd.Timestamp.now() - pd.Timedelta(days=7)
-        ]
-        weekly_tests = tests[
-            tests["created_at"] >= pd.Timestamp.now() - pd.Timedelta(days=7)
-        ]
 
-        st.session_state.dashboard_title_extra = "This Week"
-        return users, weekly_requests, weekly_tests
+    # read_parquet fails on a glob matching nothing, i.e. before the first request
+    has_requests = any(SNAPSHOT_DIR.glob("requests/*/*.parquet"))
 
-    elif dash_period == "This Month":
-        month = pd.Timestamp.now().month
-        # end_of_month = end_of_month(pd.Timestamp.now().year, month)
+    def duck_query(query: str, columns: list[str]) -> pd.DataFrame:
+        if not has_requests:
+            return pd.DataFrame(columns=columns)
+        return duck_conn.execute(period_requests + query, params).df()
 
-        monthly_users = users[users["created_at"].dt.month <= month]
-        monthly_requests = requests[requests["created_at"].dt.month == month]
-        monthly_tests = tests[tests["created_at"].dt.month == month]
+    requests_overtime = duck_query(
+        """
+        SELECT created_at::DATE AS created_date, count(*) AS count
+        FROM period_requests
+        GROUP BY created_date
+        ORDER BY created_date
+        """,
+        ["created_date", "count"],
+    )
 
-        st.session_state.dashboard_title_extra = "This Month"
+    category_popularity = duck_query(
+        """
+        SELECT category, count(*) AS count
+        FROM requested_tests
+        GROUP BY category
+        ORDER BY count DESC, category
+        LIMIT 5
+        """,
+        ["category", "count"],
+    )
 
-        return monthly_users, monthly_requests, monthly_tests
+    test_popularity = duck_query(
+        """
+        SELECT name AS "Test", count(*) AS "Count"
+        FROM requested_tests
+        GROUP BY code, name
+        ORDER BY "Count" DESC, name
+        LIMIT 10
+        """,
+        ["Test", "Count"],
+    )
 
-    elif dash_period == "Yearly":
-        yearly_users = users[users["created_at"].dt.year <= dash_year]
-        yearly_requests = requests[requests["created_at"].dt.year == dash_year]
-        yearly_tests = tests[tests["created_at"].dt.year == dash_year]
+    # users are counted cumulatively: everyone registered by the end of the period
+    users = conn.query(
+        f"""
+        SELECT
+            initcap(user_type) AS user_type,
+            CASE WHEN telegram_chat_id IS NOT NULL THEN 'Active' ELSE 'Not Active' END AS tg_active,
+            count(*) AS count
+        FROM users
+        WHERE is_deleted = false AND {"created_at < :end" if end is not None else "true"}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """,
+        params={"end": params["end"]} if end is not None else {},
+        ttl=0,
+    )
 
-        st.session_state.dashboard_title_extra = f"{dash_year}"
+    return {
+        "requests_overtime": requests_overtime,
+        "category_popularity": category_popularity,
+        "test_popularity": test_popularity,
+        "users": users,
+    }
 
-        if dash_month:
-            dash_month_int = months.index(dash_month) + 1
-            yearly_users = yearly_users[
-                yearly_users["created_at"].dt.month <= dash_month_int
-            ]
-            yearly_requests = yearly_requests[
-                yearly_requests["created_at"].dt.month == dash_month_int
-            ]
-            yearly_tests = yearly_tests[
-                yearly_tests["created_at"].dt.month == dash_month_int
-            ]
 
-            st.session_state.dashboard_title_extra = f"{dash_month} {dash_year}"
+@st.fragment(run_every=LIVE_REFRESH_INTERVAL)
+def status_metrics(start, end):
+    """
+    Shows the period's request counts by status, live.
 
-            return yearly_users, yearly_requests, yearly_tests
+    The counts come from the `request_daily_status` rollup, which the database
+    keeps current in the writing transaction, rather than from the snapshot,
+    so a status change made from the bot shows up within LIVE_REFRESH_INTERVAL
+    seconds. The fragment only re-queries after a request change event (see
+    `live_data`); the snapshot charts below are left alone.
+    """
+    params = {"start": start, "end": end}
+
+    def fetch_counts():
+        try:
+            return conn.query(
+                f"""
+                SELECT request_status, sum(count)::INTEGER AS count
+                FROM request_daily_status
+                WHERE {"day >= :start" if start is not None else "true"}
+                  AND {"day < :end" if end is not None else "true"}
+                GROUP BY request_status
+                """,
+                params=params,
+                ttl=0,
+            )
+        except Exception as e:
+            print(e)
+            st.error("Error fetching request counts. Please try again or contact the admin")
+            st.stop()
 
-        return yearly_users, yearly_requests, yearly_tests
+    status_counts = live_data(
+        conn, "dashboard_status_counts", (start, end), fetch_counts
+    ).set_index("request_status")["count"]
 
-    else:
-        st.session_state.dashboard_title_extra = f"All Time"
-        return users, requests, tests
+    with st.container(border=False, horizontal=True, horizontal_alignment="distribute"):
+        st.metric("Total Requests", int(status_counts.sum()), border=True)
+        st.metric("Pending", int(status_counts.get("pending", 0)), border=True)
+    with st.container(border=False, horizontal=True, horizontal_alignment="distribute"):
+        st.metric("In Progress", int(status_counts.get("in-progress", 0)), border=True)
+        st.metric("Completed", int(status_counts.get("completed", 0)), border=True)
 
 
-users, requests, tests = load_data(dash_period, dash_year, dash_month)
+metrics = load_data(dash_period, dash_year, dash_month)
+st.session_state.dashboard_title_extra = period_title(
+    dash_period, dash_year, dash_month
+)
 
 with st.container(border=False, horizontal=False, horizontal_alignment="left"):
     st.markdown(
@@ -162,29 +302,15 @@ with st.container(border=False, horizontal=False, horizontal_alignment="left"):
         """,
         unsafe_allow_html=True,
     )
+    taken_at = snapshot_taken_at()
+    if taken_at is not None:
+        st.caption(f"Requests as of {taken_at.strftime('%b %d, %Y • %I:%M %p')}")
     st.space("small")
 
 with st.container(border=False, horizontal=True, horizontal_alignment="distribute"):
     # col1, col2, col3, col4 = st.columns(4)
 
-    with st.container(border=False, horizontal=True, horizontal_alignment="distribute"):
-        st.metric("Total Requests", len(requests), border=True)
-        st.metric(
-            "Pending",
-            len(requests[requests["request_status"] == "pending"]),
-            border=True,
-        )
-    with st.container(border=False, horizontal=True, horizontal_alignment="distribute"):
-        st.metric(
-            "In Progress",
-            len(requests[requests["request_status"] == "in-progress"]),
-            border=True,
-        )
-        st.metric(
-            "Completed",
-            len(requests[requests["request_status"] == "completed"]),
-            border=True,
-        )
+    status_metrics(*period_bounds(dash_period, dash_year, dash_month))
 
 # st.markdown("---")
 
@@ -192,10 +318,7 @@ with st.container(border=False, horizontal=True, horizontal_alignment="distribut
 col5, col6 = st.columns(2, gap="medium", border=True)
 with col5:
     # st.write(":gray[Requests Over Time]")
-    requests["created_date"] = pd.to_datetime(requests["created_at"]).dt.date
-    requests_overtime = (
-        requests.groupby("created_date").size().reset_index(name="count")
-    )
+    requests_overtime = metrics["requests_overtime"]
     if requests_overtime.empty:
         st.write("**Requests Over Time**")
         st.info("No data for this period")
@@ -219,23 +342,13 @@ with col5:
 
 
 with col6:
-    requests_exploded = requests.explode("selected_tests")
-    test_category_map = fetch_categories_and_tests(conn)
-    requests_exploded["category"] = requests_exploded["selected_tests"].apply(
-        lambda x: test_category_map.get(x, "Uncategorized")
-    )
-    category_popularity = (
-        requests_exploded.groupby("category")
-        .size()
-        .reset_index(name="count")
-        .sort_values("count", ascending=True)
-    )
+    category_popularity = metrics["category_popularity"]
     if category_popularity.empty:
         st.write("**Top 5 Requested Categories**")
         st.info("**No lab requests data for this period**")
     else:
         fig_category_popularity = px.bar(
-            category_popularity.head(5).sort_values("count", ascending=True),
+            category_popularity.sort_values("count", ascending=True),
             x="count",
             y="category",
             orientation="h",
@@ -261,25 +374,13 @@ with col6:
 
 
 with st.container(border=True):
-    tests_exploded = requests.explode("selected_tests")
-
-    test_popularity = (
-        tests_exploded.groupby("selected_tests")
-        .size()
-        .reset_index(name="Count")
-        .sort_values("Count", ascending=False)
-    )
+    test_popularity = metrics["test_popularity"]
     if test_popularity.empty:
         st.write("**User Count**")
         st.info("No tests data for this period")
     else:
-        test_popularity.columns = ["Test", "Count"]
-        test_popularity["Test"] = test_popularity["Test"].str.replace(
-            r"\s*\[.*?\]$", "", regex=True
-        )
-
         fig_test_popularity = px.bar(
-            test_popularity.head(10).sort_values("Count", ascending=True),
+            test_popularity.sort_values("Count", ascending=True),
             x="Count",
             y="Test",
             orientation="h",
@@ -305,11 +406,10 @@ with st.container(border=True):
 
 
 with st.container(border=False, horizontal=True):
-    users["user_type"] = users["user_type"].str.title()
-    users["tg_active"] = users["tg_active"].map({True: "Active", False: "Not Active"})
+    users = metrics["users"]
 
     with st.container(border=True, horizontal=False, width=500):
-        users_type = users["user_type"].value_counts().reset_index()
+        users_type = users.groupby("user_type")["count"].sum().reset_index()
         if users_type.empty:
             st.write("**User Count**")
             st.info("No user data for this period")
@@ -332,9 +432,7 @@ with st.container(border=False, horizontal=True):
             st.plotly_chart(fig_user_type)
 
     with st.container(border=True, horizontal=False):
-        tg_active_users = (
-            users.groupby(["user_type", "tg_active"]).size().reset_index(name="count")
-        )
+        tg_active_users = users
 
         if tg_active_users.empty:
             st.write("**# Users Active on Telegram**")
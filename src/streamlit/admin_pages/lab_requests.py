@@ -8,7 +8,10 @@ from utils import (
     fetch_phlebotomists,
     fetch_doctors,
     search_tests,
-    prepare_tests_df
+    prepare_tests_df,
+    live_data,
+    live_rerun,
+    ARCHIVED_UNTIL,
 )
 
 st.set_page_config(page_title="RPWC|Lab Requests", layout="wide")
@@ -26,35 +29,149 @@ if "request_to_edit" not in st.session_state:
 if "edited_request" not in st.session_state:
     st.session_state.edited_request = {}
 
+# dialogs live inside card fragments, so a full run means none is open; one
+# closed with its X clears the flag through `close_dialog`
+st.session_state.lr_dialog_open = False
 
-def fetch_requests():
+
+def close_dialog():
+    """Resumes the live board once a dialog is dismissed."""
+    st.session_state.lr_dialog_open = False
+
+
+# board period -> months of history to show (None = everything, "custom" = date range)
+REQUEST_PERIODS = {
+    "Last 3 months": 3,
+    "Last 12 months": 12,
+    "All time": None,
+    "Custom range": "custom",
+}
+REQUEST_STATUSES = ["pending", "in-progress", "completed", "cancelled"]
+PAGE_SIZES = [12, 24, 48]
+# searches return the best matches only, ranked, instead of pages
+SEARCH_LIMIT = 50
+
+# same expression as the trigram index in migrations/0008_request_search.sql
+PATIENT_NAME = "request_patient_name(r.first_name, r.middle_name, r.surname)"
+
+
+def request_filters(start, end, status, assign_to, search) -> tuple[str, dict]:
+    """
+    Builds the WHERE clause and parameters shared by the board's page query
+    and its count.
+
+    The search matches, case-insensitively, a substring or a fuzzy
+    (trigram word similarity) match of the patient's name with underscores
+    decoded to spaces, a substring of the phone number or location, or the
+    request id exactly. Every branch is served by an index, see
+    migrations/0008_request_search.sql.
+
+    Args:
+        start (date, optional): Earliest creation day to include.
+        end (date, optional): Day after the latest creation day to include.
+        status (str, optional): Only requests with this status.
+        assign_to (str, optional): Only requests assigned to this dkl_code.
+        search (str, optional): Patient name, phone, location or request id.
+
+    Returns:
+        tuple: (SQL conditions joined with AND, query parameters)
+    """
+    conditions = ["true"]
+    params = {}
+    if start is not None:
+        conditions.append("r.created_at >= :start")
+        params["start"] = start
+    if end is not None:
+        conditions.append("r.created_at < :end")
+        params["end"] = end
+    if status:
+        conditions.append("r.request_status = :status")
+        params["status"] = status
+    if assign_to:
+        conditions.append("r.assign_to = :assign_to")
+        params["assign_to"] = assign_to
+    if search:
+        search = " ".join(search.lower().replace("_", " ").split())
+        conditions.append(
+            f"""(
+                {PATIENT_NAME} LIKE :search_like
+                OR :search <% {PATIENT_NAME}
+                OR r.phone LIKE :search_like
+                OR lower(r.location) LIKE :search_like
+                OR r.id = :search_id
+            )"""
+        )
+        params["search"] = search
+        params["search_like"] = "%{}%".format(
+            search.replace("\\", "\\\\").replace("%", "\\%")
+        )
+        # ids are INTEGER; a longer number can only be a phone
+        params["search_id"] = (
+            int(search) if search.isdigit() and len(search) < 10 else None
+        )
+    return " AND ".join(conditions), params
+
+
+def fetch_requests(filters: tuple[str, dict], cursor=None, page_size: int = 12):
     """
-    Fetches all patient requests along with doctor and phlebotomist details,
+    Fetches one page of patient requests along with phlebotomist details,
     returning the result as a pandas DataFrame.
 
     This function performs a SQL query that:
-        - Joins the `requests` table with:
-            * `doctors` (users with user_type='doctor')
-            * `phlebotomists` (users with user_type='phlebotomist')
+        - Joins the `requests` table with `phlebotomists`
+          (users with user_type='phlebotomist').
         - Combines patient name fields into a single "patient" column.
         - Includes key request fields such as demographics, tests,
           collection schedule, assigned staff, status, and timestamps.
-        - Orders the results by most recently created requests.
+        - Resolves the request's test codes to display labels through the
+          test catalog (`resolve_tests`), for the page's rows only.
+        - Applies the board's filters (see `request_filters`) in SQL, so only
+          the month partitions in the date range are read.
+        - Pages with a keyset on (created_at, id), newest first: the next page
+          starts after the last row of the current one, so every page costs
+          the same however deep it is, unlike OFFSET.
+        - When searching, ranks the matches instead (exact id first, then the
+          best name, phone or location similarity) and returns the top
+          SEARCH_LIMIT of them as a single page.
+
+    Args:
+        filters (tuple): (conditions, params) from `request_filters`.
+        cursor (tuple, optional): (created_at, id) of the last row of the
+            previous page. Defaults to None (first page).
+        page_size (int): Rows per page.
+
     Returns:
-        pd.DataFrame:
-            A DataFrame with one column: "phlebotomist".
+        tuple:
+            - pd.DataFrame: The page's requests.
+            - bool: Whether there are more rows after this page.
 
     Raises:
         On query failure, shows a Streamlit error message and stops execution
         to prevent downstream errors.
     """
+    conditions, params = filters
+    searching = "search" in params
+    if searching:
+        order_by = f"""
+            (r.id IS NOT DISTINCT FROM :search_id) DESC,
+            GREATEST(
+                word_similarity(:search, {PATIENT_NAME}),
+                similarity(:search, COALESCE(r.phone, '')),
+                word_similarity(:search, lower(COALESCE(r.location, '')))
+            ) DESC,
+            r.created_at DESC, r.id DESC"""
+        params = {**params, "limit": SEARCH_LIMIT}
+    else:
+        order_by = "r.created_at DESC, r.id DESC"
+        params = {**params, "limit": page_size + 1}
+        if cursor is not None:
+            conditions += " AND (r.created_at, r.id) < (:cursor_created_at, :cursor_id)"
+            params["cursor_created_at"], params["cursor_id"] = cursor
+
     try:
         requests = conn.query(
-            """
-            WITH doctors as (
-                select dkl_code, name from users where user_type='doctor'
-            ),
-            phlebotomists as (
+            f"""
+            WITH phlebotomists as (
                 select dkl_code, name from users where user_type='phlebotomist'
             )
 
@@ -62,24 +179,73 @@ def fetch_requests():
                 id,
                 CONCAT(r.first_name,' ',r.middle_name, ' ',r.surname)  AS patient, 
                 r.dob, r.gender, r.phone, r.email, r.location,
-                r.selected_tests, r.collection_date, r.collection_time,priority,
-                -- d.name as doctor,
+                r.test_codes,
+                ARRAY(SELECT label FROM resolve_tests(r.test_codes)) AS selected_tests,
+                r.collection_date, r.collection_time,priority,
                 p.name as phlebotomist,
                 r.request_status, r.created_at, r.updated_at          
             FROM requests r
-            -- LEFT JOIN doctors d on d.dkl_code = r.doctor_dkl_code
             LEFT JOIN phlebotomists p on p.dkl_code = r.assign_to
-            ORDER BY created_at DESC;	
+            WHERE {conditions}
+            ORDER BY {order_by}
+            LIMIT :limit;
             """,
+            params=params,
             ttl=0,
         )
-        return requests
     except Exception as e:
+        print(e)
         st.error("Error fetching lab requests. Please try again or contact the admin")
         st.stop()
 
+    if searching:
+        return requests, False
+    return requests.head(page_size), len(requests) > page_size
+
+
+def count_requests(start, end, status, assign_to):
+    """
+    Counts the requests matching the board's filters without scanning them.
+
+    Status, phlebotomist and date filters are all answered by the daily
+    rollup `request_daily_assignees` (one row per day, phlebotomist and
+    status), which reads O(days) rows. The rollup keeps counting months that
+    partitions.py archived, so days before the end of the newest archived
+    month (`ARCHIVED_UNTIL`) are left out. Months without a partition, whose
+    requests wait in `requests_default`, are still attached and counted. Only
+    requests backdated into an archived month after it was archived are
+    reachable but not counted.
 
-@st.dialog(":green[Request Details]")
+    Returns:
+        int: The number of matching requests, or None if the count failed.
+    """
+    _, params = request_filters(start, end, status, assign_to, None)
+    conditions = [f"d.day >= COALESCE(({ARCHIVED_UNTIL}), '-infinity')"]
+    if start is not None:
+        conditions.append("d.day >= :start")
+    if end is not None:
+        conditions.append("d.day < :end")
+    if status:
+        conditions.append("d.request_status = :status")
+    if assign_to:
+        conditions.append("d.assign_to = :assign_to")
+    try:
+        total = conn.query(
+            f"""
+            SELECT COALESCE(sum(d.count), 0) AS total
+            FROM request_daily_assignees d
+            WHERE {" AND ".join(conditions)}
+            """,
+            params=params,
+            ttl=0,
+        )
+        return int(total.iloc[0]["total"])
+    except Exception as e:
+        print(e)
+        return None
+
+
+@st.dialog(":green[Request Details]", on_dismiss=close_dialog)
 def request_details(request):
     """
     Displays a modal dialog showing full details for a single request.
@@ -129,8 +295,8 @@ def request_details(request):
         st.markdown(f":orange[**Tests**]:\n {' '.join(tests_badges)}")
 
 
-@st.dialog("Delete Lab Request")
-def delete_lab_request(request_id):
+@st.dialog("Delete Lab Request", on_dismiss=close_dialog)
+def delete_lab_request(request_id, created_at):
     """
     Displays a confirmation dialog to delete a lab request by ID.
 
@@ -143,6 +309,8 @@ def delete_lab_request(request_id):
 
     Args:
         request_id (int): The ID of the lab request to delete.
+        created_at (datetime): When the request was created; pins the
+            request's month partition.
 
     Note:
         This function performs database modification and updates the UI.
@@ -155,11 +323,17 @@ def delete_lab_request(request_id):
         confirm_delete = st.button("Confirm", type="primary")
 
         if confirm_delete:
-            delete_query = text("DELETE FROM requests WHERE id=:id")
+            delete_query = text(
+                "DELETE FROM requests WHERE id=:id AND created_at=:created_at"
+            )
             with conn.session as session:
                 try:
-                    session.execute(delete_query, {"id": request_id})
+                    session.execute(
+                        delete_query, {"id": request_id, "created_at": created_at}
+                    )
                     session.commit()
+                    # don't wait for the change event to redraw the board
+                    st.session_state.pop("lr_page", None)
                     st.rerun()
                 except Exception as e:
                     session.rollback()
@@ -169,12 +343,165 @@ def delete_lab_request(request_id):
                     st.rerun()
 
 
+def requests_board(filters, q, start, end, status, assign_to, page_size):
+    """
+    Renders the current page of the Lab Requests board: the row count, the
+    Previous/Next buttons and a card per request.
+
+    The page is only re-queried when its filters changed or a request change
+    event arrived since its last query (see `live_data`); `live_rerun` at the
+    bottom of the page reruns it on such events, so status updates made from
+    the bot show up without the admin rerunning the page.
+
+    Args:
+        filters (tuple): (conditions, params) from `request_filters`.
+        q (str): The search text, if any.
+        start, end, status, assign_to: The filters `filters` was built from,
+            for the count.
+        page_size (int): Rows per page.
+    """
+    cursor = st.session_state.lr_cursors[-1]
+
+    def fetch_page():
+        requests_df, has_more = fetch_requests(filters, cursor, page_size)
+        total = None if q else count_requests(start, end, status, assign_to)
+        return requests_df.to_dict(orient="records"), has_more, total
+
+    requests, has_more, total_requests = live_data(
+        conn, "lr_page", (st.session_state.lr_filter_key, cursor), fetch_page
+    )
+
+    page = len(st.session_state.lr_cursors)
+    first_row = (page - 1) * page_size + 1 if requests else 0
+    last_row = (page - 1) * page_size + len(requests)
+    with st.container(
+        border=False,
+        horizontal=True,
+        horizontal_alignment="distribute",
+        vertical_alignment="center",
+    ):
+        if q:
+            st.caption(
+                f"{len(requests)} best match{'es' if len(requests) != 1 else ''}"
+                if len(requests) >= SEARCH_LIMIT
+                else f"{len(requests)} match{'es' if len(requests) != 1 else ''}"
+            )
+        else:
+            if total_requests is None:
+                st.caption(f"Showing {first_row}-{last_row}")
+            else:
+                st.caption(f"Showing {first_row}-{last_row} of {total_requests}")
+
+        with st.container(border=False, horizontal=True, horizontal_alignment="right"):
+            if st.button(
+                "Previous", icon=":material/chevron_left:", disabled=page == 1
+            ):
+                st.session_state.lr_cursors.pop()
+                st.rerun()
+            if st.button(
+                "Next", icon=":material/chevron_right:", disabled=not has_more
+            ):
+                last = requests[-1]
+                st.session_state.lr_cursors.append(
+                    (last["created_at"].to_pydatetime(), last["id"])
+                )
+                st.rerun()
+
+    with st.container(
+        border=False, horizontal=True, horizontal_alignment="left", height=450
+    ):
+        for request in requests:
+            request_card(request)
+
+
+@st.fragment
+def request_card(request):
+    """
+    Renders one request's card: patient (opens the details dialog), status
+    badge, phlebotomist, collection date/time, and the Edit and Delete
+    buttons.
+
+    Runs as its own fragment, so opening the details or delete dialog reruns
+    only this card. Edit still reruns the page, which it replaces with the
+    edit form, and a confirmed delete reruns it to drop the card and update
+    the counts.
+
+    Args:
+        request (dict): One row of `fetch_requests`.
+    """
+    with st.container(border=True, width=500):
+        with st.container(
+            border=False,
+            horizontal=True,
+            horizontal_alignment="distribute",
+            vertical_alignment="center",
+        ):
+            with st.container(
+                border=False, horizontal=False, horizontal_alignment="left"
+            ):
+                req_details_btn = st.button(
+                    f":blue[**{request['patient'].strip().replace('_', ' ')}**]",
+                    type="tertiary",
+                    key=f"{request['id']}",
+                )
+                if req_details_btn:
+                    st.session_state.lr_dialog_open = True
+                    request_details(request)
+
+            with st.container(
+                border=False,
+                horizontal=True,
+                horizontal_alignment="right",
+                width=110,
+            ):
+                status_color = {
+                    "pending": "orange",
+                    "in-progress": "blue",
+                    "completed": "green",
+                    "cancelled": "red",
+                }
+                req_status = request["request_status"]
+                st.badge(req_status.title(), color=status_color[req_status])
+
+        # st.write(f"**👨‍⚕️ Doctor:** {request['doctor']}")
+        st.write(f"**🧪 Phlebotomist:** {request['phlebotomist']}")
+        st.write(
+            f"📅 **Date:** {request['collection_date']}  "
+            f"⏰ **Time:** {request['collection_time'].strftime('%H:%M %p')}"
+        )
+
+        # st.write("")
+        with st.container(border=False, horizontal=True):
+            req_edit_btn = st.button(
+                ":blue[Edit]",
+                icon=":material/edit:",
+                type="secondary",
+                key=f"edit{request['id']}",
+            )
+            if req_edit_btn:
+                st.session_state.lr_mode = "edit"
+                st.session_state.request_to_edit = request
+                st.rerun()
+
+            req_del_btn = st.button(
+                ":red[Delete]",
+                icon=":material/delete:",
+                type="secondary",
+                key=f"del{request['id']}",
+            )
+            if req_del_btn:
+                st.session_state.lr_dialog_open = True
+                delete_lab_request(
+                    request["id"], request["created_at"].to_pydatetime()
+                )
+
+
 # st.write(requests)
 if st.session_state.lr_mode == "edit" and st.session_state.get("request_to_edit"):
     with st.container(border=False, horizontal=False, horizontal_alignment="left"):
         request_to_edit = st.session_state.request_to_edit
         st.session_state.selected_tests = set(
-            st.session_state.request_to_edit["selected_tests"]
+            st.session_state.request_to_edit["test_codes"]
         )
 
         @st.fragment
@@ -369,13 +696,14 @@ if st.session_state.lr_mode == "edit" and st.session_state.get("request_to_edit"
                         "gender": gender.strip(),
                         "phone": phone.strip(),
                         "location": location.strip(),
-                        "selected_tests": list(selected_tests),
+                        "test_codes": [int(code) for code in selected_tests],
                         "assign_to": phlebotomist.split("-")[1].strip(),
                         "priority": priority,
                         "collection_date": collection_date,
                         "collection_time": collection_time,
                         "request_status": request_status,
-                        "request_id": request_to_edit["id"]
+                        "request_id": request_to_edit["id"],
+                        "created_at": pd.Timestamp(request_to_edit["created_at"]).to_pydatetime(),
                     }
 
                     with conn.session as session:
@@ -386,9 +714,9 @@ if st.session_state.lr_mode == "edit" and st.session_state.get("request_to_edit"
                                 SET 
                                     first_name=:first_name, surname=:surname, dob=:dob, 
                                     gender=:gender, phone=:phone,location=:location, request_status=:request_status,
-                                    selected_tests=:selected_tests, assign_to=:assign_to, priority=:priority, 
-                                    collection_date=:collection_date, collection_time=:collection_time, updated_at=now()
-                                WHERE id=:request_id
+                                    test_codes=:test_codes, selected_tests=NULL, assign_to=:assign_to, priority=:priority, 
+                                    collection_date=:collection_date, collection_time=:collection_time
+                                WHERE id=:request_id AND created_at=:created_at
                                 """
                             )
                             session.execute(insert_query, form_data)
@@ -396,6 +724,7 @@ if st.session_state.lr_mode == "edit" and st.session_state.get("request_to_edit"
 
                             st.session_state.lr_mode = "view"
                             st.session_state.selected_tests = set()
+                            st.session_state.pop("lr_page", None)
                             st.rerun()
                         except Exception as e:
                             print(e)
@@ -663,8 +992,6 @@ if st.session_state.lr_mode == "edit" and st.session_state.get("request_to_edit"
 
 
 else:
-    requests_df = fetch_requests()
-
     with st.container(
         border=False,
         horizontal=True,
@@ -672,14 +999,64 @@ else:
         vertical_alignment="bottom",
     ):
         q = st.text_input("Search", placeholder="Search", label_visibility="collapsed")
-        if q:
-            requests = [
-                request
-                for request in requests_df.to_dict(orient="records")
-                if q.lower() in request["patient"].lower()
-            ]
-        else:
-            requests = requests_df.to_dict(orient="records")
+        period = st.selectbox(
+            "Period",
+            options=list(REQUEST_PERIODS),
+            index=1,
+            label_visibility="collapsed",
+            width=160,
+        )
+        status = st.selectbox(
+            "Status",
+            options=REQUEST_STATUSES,
+            index=None,
+            placeholder="All statuses",
+            format_func=lambda x: x.title(),
+            label_visibility="collapsed",
+            width=150,
+        )
+        phlebotomist = st.selectbox(
+            "Phlebotomist",
+            options=fetch_phlebotomists(conn)["phlebotomist"].to_list(),
+            index=None,
+            placeholder="All phlebotomists",
+            label_visibility="collapsed",
+            width=220,
+        )
+        page_size = st.selectbox(
+            "Page size",
+            options=PAGE_SIZES,
+            index=0,
+            format_func=lambda x: f"{x} per page",
+            label_visibility="collapsed",
+            width=130,
+        )
+
+        months = REQUEST_PERIODS[period]
+        today = pd.Timestamp.today().normalize()
+        start = end = None
+        if months == "custom":
+            date_range = st.date_input(
+                "Created between",
+                value=(today - pd.DateOffset(months=1), today),
+                format="DD/MM/YYYY",
+                label_visibility="collapsed",
+                width=220,
+            )
+            if len(date_range) == 2:
+                start = date_range[0]
+                end = date_range[1] + pd.Timedelta(days=1)
+        elif months is not None:
+            start = (today.replace(day=1) - pd.DateOffset(months=months)).date()
+
+        assign_to = phlebotomist.split("-")[1].strip() if phlebotomist else None
+        filters = request_filters(start, end, status, assign_to, q)
+
+        # back to the first page whenever a filter changes
+        filter_key = (q, period, start, end, status, assign_to, page_size)
+        if st.session_state.get("lr_filter_key") != filter_key:
+            st.session_state.lr_filter_key = filter_key
+            st.session_state.lr_cursors = [None]
 
         new_req_btn = st.button("+ Request", icon=":material/add:")
         if new_req_btn:
@@ -687,72 +1064,7 @@ else:
             st.session_state.selected_tests = set()
             st.switch_page("admin_pages/new_request.py")
 
-    total_requests = len(requests_df)
-    showing_requests = len(requests)
-    st.caption(f"Showing {showing_requests}/{total_requests}")
+    requests_board(filters, q, start, end, status, assign_to, page_size)
 
-    with st.container(
-        border=False, horizontal=True, horizontal_alignment="left", height=450
-    ):
-        for request in requests:
-            with st.container(border=True, width=500):
-                with st.container(
-                    border=False,
-                    horizontal=True,
-                    horizontal_alignment="distribute",
-                    vertical_alignment="center",
-                ):
-                    with st.container(
-                        border=False, horizontal=False, horizontal_alignment="left"
-                    ):
-                        req_details_btn = st.button(
-                            f":blue[**{request['patient'].strip().replace('_', ' ')}**]",
-                            type="tertiary",
-                            key=f"{request['id']}",
-                        )
-                        if req_details_btn:
-                            request_details(request)
-
-                    with st.container(
-                        border=False,
-                        horizontal=True,
-                        horizontal_alignment="right",
-                        width=110,
-                    ):
-                        status_color = {
-                            "pending": "orange",
-                            "in-progress": "blue",
-                            "completed": "green",
-                            "cancelled": "red",
-                        }
-                        req_status = request["request_status"]
-                        st.badge(req_status.title(), color=status_color[req_status])
-
-                # st.write(f"**👨‍⚕️ Doctor:** {request['doctor']}")
-                st.write(f"**🧪 Phlebotomist:** {request['phlebotomist']}")
-                st.write(
-                    f"📅 **Date:** {request['collection_date']}  "
-                    f"⏰ **Time:** {request['collection_time'].strftime('%H:%M %p')}"
-                )
-
-                # st.write("")
-                with st.container(border=False, horizontal=True):
-                    req_edit_btn = st.button(
-                        ":blue[Edit]",
-                        icon=":material/edit:",
-                        type="secondary",
-                        key=f"edit{request['id']}",
-                    )
-                    if req_edit_btn:
-                        st.session_state.lr_mode = "edit"
-                        st.session_state.request_to_edit = request
-                        st.rerun()
-
-                    req_del_btn = st.button(
-                        ":red[Delete]",
-                        icon=":material/delete:",
-                        type="secondary",
-                        key=f"del{request['id']}",
-                    )
-                    if req_del_btn:
-                        delete_lab_request(request["id"])
+    # a dialog opened from a card would be closed by the live rerun
+    live_rerun(conn, "lab_requests", pause_key="lr_dialog_open")
@@ -75,9 +75,9 @@ def create_request(form_data):
             insert_query = text(
                 """
                 INSERT INTO requests (first_name, surname, dob, gender, phone, location, 
-                selected_tests, assign_to, priority, collection_date, collection_time)
+                test_codes, assign_to, priority, collection_date, collection_time)
                 VALUES(:first_name, :surname,:dob, :gender, :phone, :location, 
-                :selected_tests, :assign_to, :priority, :collection_date, :collection_time)
+                :test_codes, :assign_to, :priority, :collection_date, :collection_time)
                 """
             )
             session.execute(insert_query, form_data)
@@ -223,7 +223,7 @@ with lab_req_formm_ctn:
                     "gender": gender.strip(),
                     "phone": phone.strip(),
                     "location": location.strip(),
-                    "selected_tests": list(selected_tests),
+                    "test_codes": [int(code) for code in selected_tests],
                     "assign_to": phlebotomist.split("-")[1].strip(),
                     "priority": priority,
                     "collection_date": collection_date,
@@ -1,7 +1,9 @@
+import re
+
 import streamlit as st
 from sqlalchemy import text, exc
 
-from utils import load_tests_from_db, fetch_tests
+from utils import fetch_tests, refresh_catalog_version
 
 st.set_page_config(page_title="RPWC | Tests", layout="wide")
 
@@ -22,6 +24,27 @@ with header_container:
 
 # -------------------- SUBHEADER ---------------------------------------
 
+# "PSA (Total) [4304]"; the same format parse_test_label() reads in
+# migrations/0002_test_catalog.sql, which refuses anything else
+TEST_LABEL = re.compile(r"^\s*(.*?)\s*\[(\d+)\]\s*$")
+
+
+def parse_tests(available_tests: str) -> list[str]:
+    """
+    Splits the comma separated tests of the category forms. Stops with a
+    warning if a test lacks its code, e.g. "PSA (Total) [4304]": the test
+    would never reach the catalog and couldn't be ordered.
+    """
+    tests = [test.strip() for test in available_tests.split(",") if test.strip()]
+    missing_code = [test for test in tests if not TEST_LABEL.match(test)]
+    if missing_code:
+        st.warning(
+            "Add the test code in brackets, e.g. **PSA (Total) [4304]**, to: "
+            + ", ".join(f"**{test}**" for test in missing_code)
+        )
+        st.stop()
+    return tests
+
 
 @st.dialog("New Test Category")
 def new_test_category():
@@ -30,7 +53,8 @@ def new_test_category():
 
     Workflow:
         - Collects category name, description, and a comma-separated list of tests.
-        - Validates that required fields (name and tests) are provided.
+        - Validates that required fields (name and tests) are provided and
+          that every test ends with its code, e.g. "PSA (Total) [4304]".
         - Inserts the new category into the `tests` table.
         - Clears cached test data and reruns the app on success.
         - Handles unique constraint violations and general database errors with messages.
@@ -53,6 +77,7 @@ def new_test_category():
             if not category_name or not available_tests:
                 st.warning("Please provide both category name and available tests")
                 st.stop()
+            tests = parse_tests(available_tests)
 
             insert_query = text(
                 """
@@ -67,13 +92,11 @@ def new_test_category():
                         {
                             "category_name": category_name,
                             "category_description": category_description,
-                            "available_tests": [
-                                test.strip() for test in available_tests.split(",")
-                            ],
+                            "available_tests": tests,
                         },
                     )
                     session.commit()
-                    load_tests_from_db.clear()
+                    refresh_catalog_version(conn)
                     st.rerun()
                 except exc.IntegrityError:
                     st.error("Category already exists!")
@@ -93,7 +116,8 @@ def update_category(category_id: int):
     Workflow:
         - Fetches current category details (name, description, available tests) from the database.
         - Populates a Streamlit form with current values for editing.
-        - Validates that the category name and tests are provided.
+        - Validates that the category name and tests are provided and that
+          every test ends with its code.
         - Updates the category in the `tests` table with new values.
         - Clears cached test data and reruns the app on success.
         - Handles unique constraint violations (duplicate category name) and general database errors with feedback.
@@ -135,6 +159,7 @@ def update_category(category_id: int):
                     "Please provide both **category name** and **available tests**"
                 )
                 st.stop()
+            tests = parse_tests(available_tests)
 
             query = text(
                 """
@@ -151,13 +176,11 @@ def update_category(category_id: int):
                             "id": category_id,
                             "category_name": category_name,
                             "category_description": category_description,
-                            "available_tests": [
-                                test.strip() for test in available_tests.split(",")
-                            ],
+                            "available_tests": tests,
                         },
                     )
                     session.commit()
-                    load_tests_from_db.clear()
+                    refresh_catalog_version(conn)
                     st.rerun()
                 except exc.IntegrityError:
                     session.rollback()
@@ -206,7 +229,7 @@ def delete_category(category_id: int):
             try:
                 session.execute(delete_query, {"id": category_id})
                 session.commit()
-                load_tests_from_db.clear()
+                refresh_catalog_version(conn)
                 st.rerun()
             except Exception:
                 st.error(
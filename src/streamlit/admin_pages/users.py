@@ -7,7 +7,6 @@ import time
 st.set_page_config(page_title="RPWC|Users", layout="wide")
 
 conn = st.session_state["conn"]
-duck_conn = st.session_state["duck_conn"]
 
 if "users_upated" not in st.session_state:
     st.session_state.users_updated = False
@@ -215,89 +214,73 @@ with tab2:
     if "update_message" not in st.session_state:
         st.session_state.update_message = ""
 
-    def update_users(users_df, modified_df):
+    def update_users(users_df, editor_key):
         """
-        Updates users in the database based on differences between the original and modified dataframes.
-        Only updates: name, email, contact, user_type, and active status.
-        The dkl_code is used as the unique identifier for matching records.
+        Saves the edits made in the users data editor, using the editor's deltas
+        instead of comparing the whole table.
 
-        Args:
-            users_df (pd.DataFrame): Original users dataframe.
-            modified_df (pd.DataFrame): Modified users dataframe with edits to apply.
+        `st.data_editor` keeps what changed in session state under its key:
+        `edited_rows` maps a row position to the cells changed in it and
+        `deleted_rows` lists the positions of removed rows. Positions refer to
+        `users_df` as it was shown, i.e. after the search filter.
 
-        Notes:
-            - Rows missing in modified_df but present in users_df are marked as deleted (is_deleted=True, active=False).
-            - Only fields that differ between original and modified dataframes are updated.
+        All edited users are written with one UPDATE over unnested arrays and
+        all deleted users are soft-deleted with a second one, in a single
+        transaction, so saving costs the same whatever the size of the users table.
 
-        By the way:
-            Streamlit provides an easy way to detect added, deleted, or modified rows using
-            `st.data_editor` with a session key. This can sometimes save you from
-            doing the full comparison yourself:
-                st.data_editor(df, key="my_key", num_rows="dynamic")
-                st.session_state["my_key"]  # contains the edited data
-            I didn’t know this when I wrote this function 😅
-        """
-
-        duck_conn.register("original", users_df)
-        duck_conn.register("modified", modified_df)
+        Args:
+            users_df (pd.DataFrame): The users dataframe shown in the editor.
+            editor_key (str): The key of the `st.data_editor` widget.
 
-        deleted_users = duck_conn.sql(
-            """
-        SELECT dkl_code FROM original
-        WHERE dkl_code NOT IN (SELECT dkl_code FROM modified);
+        Notes:
+            - Deleted rows are marked as deleted (is_deleted=True, active=False).
+            - Only name, email, contact, user_type and active are editable; the
+              dkl_code identifies the user.
+            - Added rows are ignored (users are added from the "All Users" tab).
         """
-        ).fetchall()
-
-        print("----------- ORIGINAL DF IN DUCKDB-----------")
-        duck_conn.sql("select * from original")
-
-        print("----------- modified DF IN DUCKDB-----------")
-        duck_conn.sql("select * from modified")
-
-        modified_users = duck_conn.sql(
-            """
-            SELECT m.dkl_code, m.name, m.email, m.contact, m.user_type, m.active
-            FROM modified m
-            INNER JOIN original o ON m.dkl_code=o.dkl_code
-            WHERE 
-                m.name != o.name 
-                OR m.email != o.email 
-                OR m.contact != o.contact 
-                OR m.user_type != o.user_type 
-                OR m.active != o.active
-            """
-        ).fetchall()
-        print(modified_users)
+        editor_state = st.session_state[editor_key]
+        deleted_positions = set(editor_state["deleted_rows"])
+        deleted_codes = [
+            users_df.iloc[pos]["dkl_code"]
+            for pos in deleted_positions
+            if pos < len(users_df)
+        ]
+
+        edit_columns = ["name", "email", "contact", "user_type", "active"]
+        edits = {column: [] for column in ["dkl_code", *edit_columns]}
+        for pos, changes in editor_state["edited_rows"].items():
+            pos = int(pos)
+            if pos in deleted_positions or pos >= len(users_df):
+                continue
+            original = users_df.iloc[pos]
+            if all(original[column] == value for column, value in changes.items()):
+                continue
+            edits["dkl_code"].append(original["dkl_code"])
+            for column in edit_columns:
+                value = changes.get(column, original[column])
+                edits[column].append(bool(value) if column == "active" else value)
 
         with conn.session as session:
             try:
-                if deleted_users:
-                    deleted_codes = list(row[0] for row in deleted_users if row)
+                if deleted_codes:
                     delete_query = text(
                         "UPDATE users SET is_deleted=true, active=false WHERE dkl_code = ANY(:deleted_codes)"
                     )
                     session.execute(delete_query, {"deleted_codes": deleted_codes})
 
-                if modified_users:
+                if edits["dkl_code"]:
                     update_query = text(
                         """
-                        UPDATE users
-                        SET name=:name, email=:email, contact=:contact, user_type=:user_type, active=:active
-                        WHERE dkl_code=:dkl_code
+                        UPDATE users u
+                        SET name=e.name, email=e.email, contact=e.contact, user_type=e.user_type, active=e.active
+                        FROM unnest(
+                            CAST(:dkl_code AS TEXT[]), CAST(:name AS TEXT[]), CAST(:email AS TEXT[]),
+                            CAST(:contact AS TEXT[]), CAST(:user_type AS TEXT[]), CAST(:active AS BOOLEAN[])
+                        ) AS e(dkl_code, name, email, contact, user_type, active)
+                        WHERE u.dkl_code=e.dkl_code
                         """
                     )
-                    modified_user_data = [
-                        {
-                            "dkl_code": row[0],
-                            "name": row[1],
-                            "email": row[2],
-                            "contact": row[3],
-                            "user_type": row[4],
-                            "active": row[5],
-                        }
-                        for row in modified_users
-                    ]
-                    session.execute(update_query, modified_user_data)
+                    session.execute(update_query, edits)
 
                 session.commit()  # commit changes
                 st.session_state.editor_key += 1  # reset editor key
@@ -451,6 +434,8 @@ with tab2:
                             st.toast(f":red[**{col.title()}** can not be empty!]")
                             st.stop()
 
-                    update_users(users_df, modified_df)
+                    update_users(
+                        users_df, f"tab2_editor_{st.session_state['editor_key']}"
+                    )
 
     users_editor()
@@ -1,7 +1,7 @@
 import streamlit as st
 import time
-import duckdb
 from pathlib import Path
+from utils import duck_engine
 
 # st.title("RPWC")
 
@@ -9,8 +9,9 @@ from pathlib import Path
 if "conn" not in st.session_state:
     st.session_state["conn"] = st.connection("postgresql", type="sql")
 
+# a cursor on the process-wide DuckDB engine, released with the session
 if "duck_conn" not in st.session_state:
-    st.session_state["duck_conn"] = duckdb.connect()
+    st.session_state["duck_conn"] = duck_engine().cursor()
 
 if "show_delete_category_dialog" not in st.session_state:
     st.session_state["show_delete_category_dialog"] = True
@@ -1,24 +1,209 @@
 import streamlit as st
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
+import pandas as pd
 from sqlalchemy import text, exc
 
-from utils import fetch_categories_and_tests, categorize_selected_tests
+from utils import (
+    prepare_tests_df,
+    request_cache,
+    request_cache_store,
+    LIVE_REFRESH_INTERVAL,
+)
 
 conn = st.session_state["conn"]
 
 st.title("My Tasks")
 
 
-def requests_list(tab: str = None):
+STATUS_TABS = {
+    "All": None,
+    "Pending": "pending",
+    "In Progress": "in-progress",
+    "Completed": "completed",
+    "Cancelled": "cancelled",
+}
+
+
+def fetch_user_requests() -> pd.DataFrame:
+    """
+    Fetches the lab requests assigned to the currently logged-in user
+    (`st.user.email`), newest first. Runs once per render; every tab is drawn
+    from this one result.
+
+    Requests are read from the process-wide `request_cache`, which loads the
+    user's list once and then only fetches what changed since the last render
+    of any session, instead of re-querying the full list every time.
+
+    Returns:
+        pd.DataFrame: One row per request with the patient, appointment,
+        priority, status and `test_codes` columns the cards show.
+
+    Raises:
+        Displays a Streamlit error message and stops execution if the query fails.
+    """
+    if st.session_state.get("tasks_user", (None, None))[0] != st.user.email:
+        try:
+            user = conn.query(
+                "SELECT dkl_code FROM users WHERE email=:email",
+                params={"email": st.user.email},
+                ttl=0,
+            )
+        except Exception as e:
+            print(e)
+            st.error(
+                "Error fetching your tasks. Contact system admin for assistance if the issue persists"
+            )
+            st.stop()
+        st.session_state.tasks_user = (
+            st.user.email,
+            None if user.empty else user.iloc[0]["dkl_code"],
+        )
+
+    lab_requests = request_cache(conn).for_assignee(st.session_state.tasks_user[1])
+    if lab_requests is None:
+        st.error(
+            "Error fetching your tasks. Contact system admin for assistance if the issue persists"
+        )
+        st.stop()
+    return lab_requests
+
+
+def prepare_cards(lab_requests: pd.DataFrame) -> pd.DataFrame:
+    """
+    Precomputes everything a task card displays, for all requests at once.
+
+    Adds, with vectorized column operations rather than per card:
+        - patient: first name and surname, underscores replaced by spaces
+        - gender_initial, age (whole years from `dob`)
+        - collection: formatted collection date and time
+        - priority_badge
+        - status: lowercased `request_status`, used to split the tabs
+        - tests_by_category: {category: [test labels]} in the order the tests
+          were picked, resolved against the version-cached test catalog
+          (`prepare_tests_df`) in one merge instead of a lookup per card;
+          codes missing from the catalog are listed as-is under
+          "Uncategorized"
+    """
+    cards = lab_requests.copy()
+    if cards.empty:
+        return cards.assign(
+            patient=[],
+            gender_initial=[],
+            age=[],
+            collection=[],
+            priority_badge=[],
+            status=[],
+            tests_by_category=[],
+        )
+
+    cards["patient"] = (
+        cards["first_name"].fillna("").str.replace("_", " ")
+        + " "
+        + cards["surname"].fillna("").str.replace("_", " ")
+    )
+    cards["gender_initial"] = cards["gender"].fillna("").str[:1]
+
+    today = pd.Timestamp.today()
+    dob = pd.to_datetime(cards["dob"], errors="coerce")
+    had_birthday = (dob.dt.month < today.month) | (
+        (dob.dt.month == today.month) & (dob.dt.day <= today.day)
+    )
+    cards["age"] = (today.year - dob.dt.year - (~had_birthday).astype(int)).astype(
+        "Int64"
+    )
+
+    collection_date = pd.to_datetime(cards["collection_date"], errors="coerce")
+    collection_time = pd.to_datetime(
+        cards["collection_time"].astype(str), format="%H:%M:%S", errors="coerce"
+    )
+    cards["collection"] = (
+        collection_date.dt.strftime("%b %d, %Y").fillna("")
+        + " • "
+        + collection_time.dt.strftime("%I:%M %p").fillna("")
+    )
+
+    cards["priority_badge"] = (cards["priority"] == "Urgent").map(
+        {True: "🚨 :red[Urgent]", False: "📋 Routine"}
+    )
+    cards["status"] = cards["request_status"].str.strip().str.lower()
+
+    catalog = prepare_tests_df(conn)[["code", "name", "category"]]
+    picked = (
+        cards[["id", "test_codes"]]
+        .explode("test_codes")
+        .dropna()
+        .astype({"test_codes": int})
+        .merge(catalog, left_on="test_codes", right_on="code", how="left")
+    )
+    # codes missing from the catalog are listed as-is, as the bot does
+    missing = picked["code"].isna()
+    picked.loc[missing, "name"] = picked.loc[missing, "test_codes"].astype(str)
+    picked.loc[missing, "category"] = "Uncategorized"
+    tests_by_category = {}
+    for (request_id, category), labels in picked.groupby(
+        ["id", "category"], sort=False
+    )["name"]:
+        tests_by_category.setdefault(request_id, {})[category] = list(labels)
+    cards["tests_by_category"] = cards["id"].map(tests_by_category)
+
+    return cards
+
+
+def update_req_status(id: int, created_at, radio_key: str, old_status: str):
+    new_status = st.session_state[radio_key]
+    with conn.session as session:
+        try:
+            query = text(
+                "UPDATE requests SET request_status=:request_status WHERE id=:id AND created_at=:created_at"
+            )
+            session.execute(
+                query,
+                {
+                    "request_status": new_status,
+                    "id": id,
+                    "created_at": created_at,
+                },
+            )
+            session.commit()
+        except Exception as e:
+            print(e)
+            # put the selectbox back, the status didn't change
+            st.session_state[radio_key] = old_status
+            st.toast(":red['Error updating request status. Please try again']")
+            return
+
+    # the card moves tabs and its copy in "All" shows the old status, so the
+    # page is rerun from the cache, updated now rather than on the change
+    # event; the card's selectboxes are reset to the saved status
+    request_cache_store(conn).refresh()
+    for key in [k for k in st.session_state if k.startswith(f"status_radio_{id}_")]:
+        del st.session_state[key]
+    st.session_state.tasks_status_saved = True
+
+
+@st.fragment(run_every=LIVE_REFRESH_INTERVAL)
+def status_counters():
+    """
+    Shows how many of the user's requests are in each status.
+
+    A live fragment reading the request cache, which only queries after a
+    request change event, so a status change made on a card is counted here
+    within LIVE_REFRESH_INTERVAL seconds without rerunning the page.
+    """
+    counts = fetch_user_requests()["request_status"].str.strip().str.lower()
+    counts = counts.value_counts()
+    with st.container(border=False, horizontal=True, horizontal_alignment="left"):
+        for label, status in STATUS_TABS.items():
+            if status is not None:
+                st.markdown(f":gray-badge[**{label}: {counts.get(status, 0)}**]")
+
+
+def requests_list(cards: list[dict], tab: str = None):
     """
     Displays a list of lab requests assigned to the currently logged-in user
     with detailed patient, appointment, and test information.
 
     Features:
-        - Fetches lab requests assigned to the current user (`st.user.email`).
-        - Optional filtering by request status via the `tab` parameter
-          (e.g., 'pending', 'in-progress', 'completed').
+        - Renders the precomputed cards from `prepare_cards` for one tab.
         - Displays patient details: name, gender, age, phone, and location.
         - Shows collection date/time and priority (Routine or Urgent) with visual badges.
         - Displays categorized tests in a popover with color-coded badges.
@@ -26,125 +211,98 @@ def requests_list(tab: str = None):
           (status changes are saved to the database immediately).
 
     Parameters:
-        tab (str, optional): Filter requests by status. Defaults to None (all requests).
+        cards (list[dict]): The tab's cards, as records of `prepare_cards`.
+        tab (str, optional): The tab's status, used to keep widget keys
+            unique across tabs. Defaults to None (all requests).
     """
-    lab_requests = conn.query(
-        """
-        WITH user_info AS(
-            SELECT dkl_code FROM users WHERE email=:email
-        )
-        SELECT r.* 
-        FROM requests r
-        INNER JOIN user_info ui ON ui.dkl_code = r.assign_to
-        """,
-        params={"email": st.user.email},
-        ttl=0,
-    )
-    lab_requests_list = lab_requests.to_dict(orient="records")
-
     with st.container(
         border=False, horizontal=False, horizontal_alignment="left", height=450
     ):
-        if tab is None:
-            tab_list = lab_requests_list
+        for req in cards:
+            task_card(req, tab)
+
+
+@st.fragment
+def task_card(req: dict, tab: str = None):
+    """
+    Renders one task card. Runs as its own fragment, so opening the tests or
+    picking a status reruns only this card; once a new status is saved the
+    whole page is rerun, since the card changes tabs.
+
+    Parameters:
+        req (dict): The card, a record of `prepare_cards`.
+        tab (str, optional): The tab the card is in, see `requests_list`.
+    """
+    if st.session_state.pop("tasks_status_saved", False):
+        st.rerun(scope="app")
+
+    with st.container(border=True, horizontal=False):
+        st.write(
+            f":blue[**{req['patient']}** ({req['gender_initial']}, {req['age']})]"
+        )
+
+        st.markdown(f"""
+            :gray-badge[**☎️ {req["phone"]}**]
+            :gray-badge[**📍 {req["location"]}**]
+            :gray-badge[**⏰ {req["collection"]}**]
+            :gray-badge[**{req["priority_badge"]}**]
+        """)
+
+        # with st.expander("Tests"):
+
+        with st.container(
+            border=False,
+            horizontal=True,
+            horizontal_alignment="left",
+            vertical_alignment="center",
+        ):
+            with st.popover("🧪 Tests"):
+                categorized_tests = req["tests_by_category"]
+                if not isinstance(categorized_tests, dict):
+                    categorized_tests = {}
+                for k, v in categorized_tests.items():
+                    st.write(f"**:orange[{k}]**")
+                    st.markdown(f",".join([f":blue-badge[{req}]" for req in v]))
+
+            req_status = req["status"]
+
+            # with st.popover(f":{req_status_color[req_status]}[{req_status.title()}]", type='secondary'):
+            request_status_options = ["pending", "in-progress", "completed"]
+            radio_key = f"status_radio_{req['id']}_{tab}"
+            st.selectbox(
+                "Update Status",
+                key=radio_key,
+                options=request_status_options,
+                index=(
+                    request_status_options.index(req_status)
+                    if req_status in request_status_options
+                    else None
+                ),
+                format_func=lambda x: x.title(),
+                on_change=update_req_status,
+                args=(
+                    req["id"],
+                    req["created_at"].to_pydatetime(),
+                    radio_key,
+                    req_status,
+                ),
+                label_visibility="collapsed",
+                width=135,
+            )
+
+
+cards = prepare_cards(fetch_user_requests())
+cards_by_status = {
+    status: group.to_dict(orient="records")
+    for status, group in cards.groupby("status", sort=False)
+}
+
+status_counters()
+
+tabs = st.tabs(list(STATUS_TABS))
+for tab, (label, status) in zip(tabs, STATUS_TABS.items()):
+    with tab:
+        if status is None:
+            requests_list(cards.to_dict(orient="records"))
         else:
-            tab_list = [
-                req
-                for req in lab_requests_list
-                if req["request_status"].strip().lower() == tab.strip().lower()
-            ]
-
-        for req in tab_list:
-            with st.container(border=True, horizontal=False):
-                patient = f"{req['first_name'].replace('_', ' ')} {req['surname'].replace('_', ' ')}"
-                gender = req["gender"]
-                age = relativedelta(datetime.today(), req["dob"]).years
-                collection_date = req["collection_date"].strftime("%b %d, %Y")
-                collection_time = req["collection_time"].strftime("%I:%M %p")
-                if req["priority"] == "Urgent":
-                    req_priority = "🚨 :red[Urgent]"
-                else:
-                    req_priority = "📋 Routine"
-
-                st.write(f":blue[**{patient}** ({gender[0]}, {age})]")
-
-                st.markdown(f"""
-                    :gray-badge[**☎️ {req["phone"]}**]
-                    :gray-badge[**📍 {req["location"]}**]
-                    :gray-badge[**⏰ {collection_date} • {collection_time}**]
-                    :gray-badge[**{req_priority}**]
-                """)
-
-                # with st.expander("Tests"):
-
-                with st.container(
-                    border=False,
-                    horizontal=True,
-                    horizontal_alignment="left",
-                    vertical_alignment="center",
-                ):
-                    with st.popover("🧪 Tests"):
-                        categorized_tests = categorize_selected_tests(
-                            conn, req["selected_tests"]
-                        )
-                        for k, v in categorized_tests.items():
-                            st.write(f"**:orange[{k}]**")
-                            st.markdown(f",".join([f":blue-badge[{req}]" for req in v]))
-
-                    req_status = req["request_status"]
-                    req_status_color = {
-                        "pending": "orange",
-                        "in-progress": "blue",
-                        "completed": "green",
-                        "cancelled": "red",
-                    }
-
-                    def update_req_status(id: int, radio_key: str):
-                        new_status = st.session_state[radio_key]
-                        with conn.session as session:
-                            try:
-                                query = text(
-                                    "UPDATE requests SET request_status=:request_status WHERE id=:id"
-                                )
-                                session.execute(
-                                    query, {"request_status": new_status, "id": id}
-                                )
-                                session.commit()
-                            except Exception as e:
-                                print(e)
-                                st.toast(
-                                    ":red['Error updating request status. Please try again']"
-                                )
-
-                    # with st.popover(f":{req_status_color[req_status]}[{req_status.title()}]", type='secondary'):
-                    request_status_options = ["pending", "in-progress", "completed"]
-                    radio_key = f"status_radio_{req['id']}_{tab}"
-                    st.selectbox(
-                        "Update Status",
-                        key=radio_key,
-                        options=request_status_options,
-                        index=request_status_options.index(req_status),
-                        format_func=lambda x: x.title(),
-                        on_change=update_req_status,
-                        args=(req["id"], radio_key),
-                        label_visibility="collapsed",
-                        width=135,
-                    )
-
-
-tabs = st.tabs(["All", "Pending", "In Progress", "Completed", "Cancelled"])
-
-with tabs[0]:
-    requests_list()
-
-with tabs[1]:
-    requests_list(tab="Pending")
-
-with tabs[2]:
-    requests_list(tab="In-Progress")
-
-with tabs[3]:
-    requests_list(tab="Completed")
-
-with tabs[4]:
-    requests_list(tab="Cancelled")
+            requests_list(cards_by_status.get(status, []), tab=label)
@@ -1,94 +1,290 @@
 import streamlit as st
-import re
 import pandas as pd
+import duckdb
+import os
+import select
+import threading
+import time
+from datetime import timedelta
 
+import psycopg2
+from sqlalchemy import text
 
-@st.cache_data(ttl=0)
-def fetch_categories_and_tests(_conn):
+# bounds for the process-wide DuckDB engine, shared by every session
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "256MB")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 2))
+
+
+@st.cache_resource
+def duck_engine() -> duckdb.DuckDBPyConnection:
     """
-    Fetches all test categories and their associated tests from the database,
-    and returns a dictionary mapping each test to its category.
+    Creates the in-memory DuckDB database shared by every session of this
+    Streamlit process.
 
-    This function is cached to avoid querying the database repeatedly.
+    Sessions must not query it directly: each one takes its own cursor with
+    `duck_engine().cursor()` (see app.py). A cursor is a separate connection to
+    the same database, so sessions can query concurrently, and DataFrames a
+    session registers are only visible to its own cursor; unregister them
+    once done so they aren't kept alive between reruns.
 
-    Parameters:
-    -----------
-    conn : object
-        Database connection or wrapper that supports a `.query()` method returning a DataFrame.
+    Caching:
+        Created once per process with @st.cache_resource. Memory and threads
+        are capped for the whole process (DUCKDB_MEMORY_LIMIT, DUCKDB_THREADS)
+        rather than per session, so fifty open admin tabs cost one engine,
+        not fifty.
 
     Returns:
-    --------
-    test_category_map : dict
-        Dictionary where keys are individual test names (strings) and values
-        are their corresponding category names (strings).
-
-    Example:
-    --------
-    {
-        "PSA (Total) [4304]": "Cancer Tests",
-        "PBF (Peripheral Blood Film) [6971]": "Hematology",
-        ...
-    }
-    """
-    categories_tests = _conn.query(
-        "select category_name, available_tests from tests", ttl=0
+        duckdb.DuckDBPyConnection: The shared DuckDB connection.
+    """
+    return duckdb.connect(
+        config={
+            "memory_limit": DUCKDB_MEMORY_LIMIT,
+            "threads": DUCKDB_THREADS,
+        }
     )
 
-    test_category_map = {}
-    for _, row in categories_tests.iterrows():
-        category = row["category_name"]
-        for test in row["available_tests"]:
-            test_category_map[test] = category
 
-    return test_category_map
+CATALOG_CHANNEL = "catalog_channel"
+REQUESTS_CHANNEL = "requests_channel"
+LISTEN_RECONNECT_DELAY = 5
+# a listener that hears nothing for this long pings the server, so a
+# connection that died without closing is noticed and replaced
+LISTEN_PING_INTERVAL = float(os.getenv("LISTEN_PING_SECONDS", 30))
+# TCP keepalives for listener connections, which otherwise sit idle and would
+# block forever on a half-open socket; the settings in the app's connection
+# URL take precedence
+LISTEN_KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+}
+# how often live fragments check for request changes; a check without a
+# change is an in-memory comparison, not a query
+LIVE_REFRESH_INTERVAL = float(os.getenv("LIVE_REFRESH_SECONDS", 3))
+
+
+class ChannelListener:
+    """
+    Background thread that LISTENs on one Postgres channel and hands each
+    notification to `on_notify`, reconnecting after errors.
 
+    Subclasses set `channel` and keep whatever state they derive from the
+    notifications; sessions read that state, so one connection serves every
+    session of the process.
+    """
 
-def categorize_selected_tests(conn, selected_tests):
+    channel = None
+
+    def __init__(self, connect_args: dict):
+        self.connect_args = connect_args
+        self.connected = False
+        self._lock = threading.Lock()
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def on_connect(self, cur) -> None:
+        """Called after LISTEN, before any notification is handled."""
+
+    def on_notify(self, payload: str) -> None:
+        """Called with the payload of each notification."""
+
+    def on_disconnect(self) -> None:
+        """Called when the connection is lost."""
+
+    def _listen(self) -> None:
+        while True:
+            pg = None
+            try:
+                pg = psycopg2.connect(**self.connect_args)
+                pg.autocommit = True
+                with pg.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel};")
+                    self.on_connect(cur)
+                self.connected = True
+
+                while True:
+                    ready, _, _ = select.select([pg], [], [], LISTEN_PING_INTERVAL)
+                    if ready:
+                        pg.poll()
+                    else:
+                        # raises, and reconnects, if the connection is gone
+                        with pg.cursor() as cur:
+                            cur.execute("SELECT 1;")
+                    while pg.notifies:
+                        self.on_notify(pg.notifies.pop(0).payload)
+            except Exception as e:
+                print(e)
+                self.connected = False
+                self.on_disconnect()
+                if pg is not None:
+                    pg.close()
+                time.sleep(LISTEN_RECONNECT_DELAY)
+
+
+def listener_connect_args(conn) -> dict:
+    """
+    psycopg2 connection settings of the app's `postgresql` connection, with
+    TCP keepalives on (LISTEN_KEEPALIVES).
     """
-    Categorizes a list of selected tests into their corresponding categories.
+    url = conn.engine.url
+    connect_args = url.translate_connect_args(username="user", database="dbname")
+    return {**LISTEN_KEEPALIVES, **connect_args, **url.query}
 
-    Parameters:
-    -----------
-    conn : object
-        Database connection or wrapper that supports a `.query()` method.
-        Used internally to fetch the test-category mapping.
-    selected_tests : list of str
-        List of test names (as strings) to categorize.
 
-    Returns:
-    --------
-    categorized : dict
-        Dictionary where keys are category names (strings) and values are
-        lists of tests (strings) that fall under each category.
+class CatalogVersionListener(ChannelListener):
+    """
+    Process-wide copy of the test catalog version (see
+    migrations/0007_catalog_version.sql), kept current by a background thread
+    that LISTENs on catalog_channel.
 
-    Notes:
-    ------
-    - Tests not found in the mapping are labeled as "Uncategorized".
-    - Useful for summarizing requests, generating dashboards, or grouping tests
-      for analysis.
+    `version` is None while the thread isn't connected; callers then read the
+    version from the database instead, so a dropped listener never serves a
+    stale catalog.
+    """
 
-    Example:
-    --------
-    selected_tests = ["PSA (Total) [4304]", "PBF (Peripheral Blood Film) [6971]"]
-    categorized = categorize_selected_tests(conn, selected_tests)
-    # Output:
-    # {
-    #     "Cancer Tests": ["PSA (Total) [4304]"],
-    #     "Hematology": ["PBF (Peripheral Blood Film) [6971]"]
-    # }
+    channel = CATALOG_CHANNEL
+
+    def __init__(self, connect_args: dict):
+        self.version = None
+        super().__init__(connect_args)
+
+    def set(self, version: int) -> None:
+        with self._lock:
+            # notifications can arrive out of order across transactions
+            self.version = max(self.version or 0, version)
+
+    def on_connect(self, cur) -> None:
+        cur.execute("SELECT version FROM catalog_version;")
+        self.set(cur.fetchone()[0])
+
+    def on_notify(self, payload: str) -> None:
+        self.set(int(payload))
+
+    def on_disconnect(self) -> None:
+        self.version = None
+
+
+class RequestChangeListener(ChannelListener):
+    """
+    Counts the request change events published on requests_channel (see
+    migrations/0010_request_change_events.sql).
+
+    `version` moves on every event, and on every reconnect since events may
+    have been missed while disconnected, so a session that remembers the
+    version it last rendered knows whether anything changed since. It is None
+    while the thread isn't connected; callers then can't tell and re-query.
     """
-    test_category_map = fetch_categories_and_tests(conn)
 
-    categorized = {}
-    for test in selected_tests:
-        category = test_category_map.get(test, "Uncategorized")
-        categorized.setdefault(category, []).append(test)
+    channel = REQUESTS_CHANNEL
+
+    def __init__(self, connect_args: dict):
+        self._version = 0
+        super().__init__(connect_args)
+
+    @property
+    def version(self):
+        return self._version if self.connected else None
 
-    return categorized
+    def bump(self) -> None:
+        with self._lock:
+            self._version += 1
 
+    def on_connect(self, cur) -> None:
+        self.bump()
 
-@st.cache_data(ttl=60 * 10)
-def load_tests_from_db(_conn):
+    def on_notify(self, payload: str) -> None:
+        self.bump()
+
+
+@st.cache_resource
+def catalog_version_listener(_conn) -> CatalogVersionListener:
+    """
+    Starts the catalog version listener once per process, connecting with the
+    same settings as the app's `postgresql` connection.
+    """
+    return CatalogVersionListener(listener_connect_args(_conn))
+
+
+@st.cache_resource
+def request_change_listener(_conn) -> RequestChangeListener:
+    """
+    Starts the request change listener once per process, connecting with the
+    same settings as the app's `postgresql` connection.
+    """
+    return RequestChangeListener(listener_connect_args(_conn))
+
+
+def requests_version(conn):
+    """
+    Returns the process's count of request change events, or None when the
+    listener is disconnected and changes can't be detected.
+
+    Live fragments remember the version they last queried at and re-query only
+    when it moved (or when it is None), see `live_data`.
+    """
+    return request_change_listener(conn).version
+
+
+def live_data(conn, key: str, args: tuple, fetch):
+    """
+    Returns `fetch()`, re-running it only when the requests changed since this
+    session last called it with the same `args`.
+
+    Meant for fragments with `run_every=LIVE_REFRESH_INTERVAL`: between
+    request changes their timed reruns redraw from session state without
+    touching the database, and an admin sees a phlebotomist's status update
+    within one interval of its commit.
+
+    Args:
+        conn: The app's database connection.
+        key (str): Session state key to keep the result under.
+        args (tuple): What the result depends on besides the requests table,
+            e.g. the page's filters.
+        fetch (callable): Runs the queries and returns the result.
+    """
+    version = requests_version(conn)
+    cached = st.session_state.get(key)
+    if version is None or cached is None or cached[0] != (args, version):
+        st.session_state[key] = ((args, version), fetch())
+    return st.session_state[key][1]
+
+
+def catalog_version(conn) -> int:
+    """
+    Returns the current test catalog version, from the listener when it is
+    connected and from the database otherwise.
+
+    The catalog caches below are keyed by this version, so they are reloaded
+    exactly when the catalog changes.
+    """
+    listener = catalog_version_listener(conn)
+    if listener.version is not None:
+        return listener.version
+    return refresh_catalog_version(conn)
+
+
+def refresh_catalog_version(conn) -> int:
+    """
+    Reads the catalog version from the database and hands it to the listener.
+
+    Called right after this session edits the catalog, so the edit shows up on
+    the next rerun without waiting for its NOTIFY to come back.
+    """
+    try:
+        version = int(
+            conn.query("SELECT version FROM catalog_version;", ttl=0).iloc[0, 0]
+        )
+    except Exception as e:
+        print(e)
+        st.error(
+            "Error fetching tests from the db. Contact system admin if issue persists"
+        )
+        st.stop()
+    catalog_version_listener(conn).set(version)
+    return version
+
+
+def load_tests_from_db(conn):
     """
     Fetches the list of test categories and available tests from the database.
 
@@ -99,12 +295,11 @@ def load_tests_from_db(_conn):
         - available_tests
 
     Caching:
-        The results are cached using Streamlit's @st.cache_data decorator.
-        Cache duration (ttl): 10 minutes.
-        This reduces unnecessary database load and improves app performance.
+        The results are cached by catalog version (see `catalog_version`), so
+        they are only re-queried after the catalog actually changes.
 
     Parameters:
-        _conn: A database connection object that exposes a `.query()` method.
+        conn: A database connection object that exposes a `.query()` method.
 
     Returns:
         pandas.DataFrame: A DataFrame containing test category metadata.
@@ -112,6 +307,11 @@ def load_tests_from_db(_conn):
     Raises:
         Displays a Streamlit error message and stops execution if the query fails.
     """
+    return cached_tests(conn, catalog_version(conn))
+
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def cached_tests(_conn, version: int):
     try:
         tests_df = _conn.query(
             "SELECT id, category_name, category_description, available_tests FROM tests ORDER BY category_name ASC;",
@@ -168,29 +368,41 @@ def fetch_tests(conn, filter: str = None):
     return filtered_tests.to_dict(orient="records")
 
 
-@st.cache_data(ttl=60 * 2)
-def prepare_tests_df(_conn):
+def prepare_tests_df(conn):
     """
-    Fetches tests from DB and flattens into a DataFrame with:
-    - name
-    - code
+    Fetches the test catalog as a DataFrame with:
+    - code: integer test code, what requests store in `test_codes`
+    - name: display label e.g. "PSA (Total) [4304]"
     - category
-    """
-    raw_tests = fetch_tests(_conn)
+    - retired: no longer offered, but still shown on older requests
 
-    rows = []
-
-    for category in raw_tests:
-        cat_name = category["category_name"]
-        for test in category["available_tests"]:
-            # extract test code inside brackets e.g. [5050]
-            match = re.search(r"\[(\d+)\]", test)
-            code = match.group(1) if match else ""
+    Cached by catalog version, like `load_tests_from_db`.
+    """
+    return cached_catalog_df(conn, catalog_version(conn))
 
-            rows.append({"name": test, "code": code, "category": cat_name})
 
-    df = pd.DataFrame(rows)
-    return df
+@st.cache_data(max_entries=2, show_spinner=False)
+def cached_catalog_df(_conn, version: int):
+    try:
+        return _conn.query(
+            """
+            SELECT
+                c.code,
+                c.name || ' [' || c.code || ']' AS name,
+                COALESCE(t.category_name, 'Uncategorized') AS category,
+                c.retired
+            FROM test_catalog c
+            LEFT JOIN tests t ON t.id = c.category_id
+            ORDER BY category, c.name;
+            """,
+            ttl=0,
+        )
+    except Exception as e:
+        print(e)
+        st.error(
+            "Error fetching tests from the db. Contact system admin if issue persists"
+        )
+        st.stop()
 
 
 @st.fragment
@@ -209,6 +421,7 @@ def search_tests(df):
 
     Search Behavior:
         - Matches are case-insensitive.
+        - Retired tests are never offered.
         - A row is included in results if the query appears in:
             * df["name"]
             * df["code"] (converted to string)
@@ -218,8 +431,8 @@ def search_tests(df):
         search_key : int
             Used to force rerendering of search input components after
             adding or removing tests.
-        selected_tests : set[str]
-            Holds the current list of user-selected tests.
+        selected_tests : set[int]
+            Holds the codes of the user-selected tests.
 
     UI Flow:
         1. Displays a search input.
@@ -231,10 +444,12 @@ def search_tests(df):
 
     Parameters:
         df (pd.DataFrame):
-            DataFrame containing test information. Must include:
+            DataFrame containing test information, as returned by
+            `prepare_tests_df`. Must include:
             - "name": Test name
             - "code": Test code
             - "category": Test category
+            - "retired": Whether the test is still offered
 
     Returns:
         None
@@ -243,6 +458,8 @@ def search_tests(df):
     if "search_key" not in st.session_state:
         st.session_state.search_key = 0
 
+    labels = dict(zip(df["code"], df["name"]))
+
     q = st.text_input(
         "Search",
         placeholder="Find test using test code, name or category",
@@ -253,18 +470,22 @@ def search_tests(df):
     with st.container(border=False, horizontal=False, horizontal_alignment="center"):
         if q:
             results = df[
-                df["name"].str.lower().str.contains(q.lower())
-                | df["code"].astype(str).str.contains(q.lower())
-                | df["category"].str.lower().str.contains(q.lower())
+                ~df["retired"]
+                & (
+                    df["name"].str.lower().str.contains(q.lower(), regex=False)
+                    | df["code"].astype(str).str.contains(q.lower(), regex=False)
+                    | df["category"].str.lower().str.contains(q.lower(), regex=False)
+                )
             ]
 
-            options = results["name"].to_list()
+            options = results["code"].to_list()
             with st.container(
                 border=False, horizontal=True, horizontal_alignment="left"
             ):
                 selected = st.pills(
                     "results",
                     options=options,
+                    format_func=lambda code: labels[code],
                     selection_mode="multi",
                     label_visibility="collapsed",
                     key=f"pills{st.session_state.search_key}",
@@ -285,7 +506,9 @@ def search_tests(df):
             vertical_alignment="top",
         ):
             for idx, test in enumerate(st.session_state.selected_tests):
-                checkbox = st.checkbox(test, key=f"{test}{idx}", value=True)
+                checkbox = st.checkbox(
+                    labels.get(test, str(test)), key=f"{test}{idx}", value=True
+                )
                 if not checkbox:
                     st.session_state.selected_tests.remove(test)
                     st.rerun(scope="fragment")
@@ -398,3 +621,276 @@ def fetch_phlebotomists(_conn) -> pd.DataFrame:
         st.stop()
 
 
+
+@st.fragment(run_every=LIVE_REFRESH_INTERVAL)
+def live_rerun(conn, page: str, pause_key: str = None):
+    """
+    Reruns the whole page when requests changed since this session last
+    rendered it.
+
+    For pages whose live parts can't be a timed fragment themselves, e.g.
+    because they open dialogs from nested fragments, which a timed rerun of
+    an enclosing fragment would close. Its own timed reruns render nothing
+    and only compare versions in memory.
+
+    Args:
+        conn: The app's database connection.
+        page (str): Name of the page, to keep its seen version apart.
+        pause_key (str, optional): Session state key that, while true, holds
+            the rerun back, e.g. while a dialog is open.
+    """
+    key = f"live_rerun_{page}"
+    version = requests_version(conn)
+    if version is None or st.session_state.get(key) == version:
+        return
+    first_render = key not in st.session_state
+    if pause_key and st.session_state.get(pause_key):
+        return
+    st.session_state[key] = version
+    if not first_render:
+        st.rerun()
+
+
+# columns kept by the request cache, what the task cards and their filters use
+REQUEST_CACHE_COLUMNS = [
+    "id",
+    "created_at",
+    "updated_at",
+    "first_name",
+    "middle_name",
+    "surname",
+    "gender",
+    "dob",
+    "phone",
+    "location",
+    "assign_to",
+    "collection_date",
+    "collection_time",
+    "priority",
+    "request_status",
+    "test_codes",
+]
+# re-read changes this far behind the watermark, for rows committed late by
+# long transactions; merging a row twice is harmless
+REQUEST_CACHE_OVERLAP = timedelta(
+    seconds=float(os.getenv("REQUEST_CACHE_WATERMARK_OVERLAP_SECONDS", 300))
+)
+# an assignee's requests are dropped from the cache after this long unread
+REQUEST_CACHE_IDLE_SECONDS = float(os.getenv("REQUEST_CACHE_IDLE_SECONDS", 1800))
+# must match the retention in migrations/0009_request_changes.sql
+REQUEST_TOMBSTONE_RETENTION = timedelta(days=7)
+
+# end of the newest month detached into requests_archive (see
+# maintain_requests_partitions in migrations/0004_partition_requests.sql), or
+# NULL if none is: requests created before it have left the requests table
+ARCHIVED_UNTIL = r"""
+    SELECT (max(to_date(substring(tablename FROM 10), 'YYYY_MM')) + INTERVAL '1 month')::TIMESTAMP
+    FROM pg_tables
+    WHERE schemaname = 'requests_archive'
+      AND tablename ~ '^requests_\d{4}_\d{2}$'
+"""
+
+
+class RequestCache:
+    """
+    Process-wide cache of the requests of the phlebotomists currently using
+    the app, shared by every session and kept current incrementally (see
+    migrations/0009_request_changes.sql).
+
+    An assignee's requests are loaded the first time they are read, through
+    the (assign_to, created_at) index, and dropped again once nobody has read
+    them for REQUEST_CACHE_IDLE_SECONDS, so the cache holds the working set of
+    active users rather than the whole table. A refresh fetches only the rows
+    added or edited since the watermark, plus the tombstones of deleted ones,
+    and merges those of loaded assignees in place, so it costs O(changes)
+    rather than a re-query. Archiving a month leaves no tombstones, so rows
+    created before ARCHIVED_UNTIL are dropped once it moves.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = {}
+        # assign_to -> keys of their rows; an assignee is loaded iff present
+        self.by_assignee = {}
+        self.last_read = {}
+        self.watermark = None
+        self.archived_until = None
+        # requests_version at the last refresh
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _put(self, row: dict) -> None:
+        key = (row["id"], row["created_at"])
+        old = self.rows.get(key)
+        if old is not None and old["assign_to"] != row["assign_to"]:
+            self.by_assignee[old["assign_to"]].discard(key)
+        self.rows[key] = row
+        self.by_assignee[row["assign_to"]].add(key)
+
+    def _drop(self, key: tuple) -> None:
+        row = self.rows.pop(key, None)
+        if row is not None:
+            self.by_assignee[row["assign_to"]].discard(key)
+
+    def _merge(self, row: dict) -> None:
+        # a row reassigned to someone who isn't loaded leaves the cache
+        if row["assign_to"] in self.by_assignee:
+            self._put(row)
+        else:
+            self._drop((row["id"], row["created_at"]))
+
+    def _drop_archived(self, archived_until) -> None:
+        if archived_until is None or archived_until == self.archived_until:
+            return
+        for key in [key for key in self.rows if key[1] < archived_until]:
+            self._drop(key)
+        self.archived_until = archived_until
+
+    def _evict_idle(self) -> None:
+        idle_since = time.monotonic() - REQUEST_CACHE_IDLE_SECONDS
+        for assign_to, last_read in list(self.last_read.items()):
+            if last_read < idle_since:
+                for key in self.by_assignee.pop(assign_to, ()):
+                    self.rows.pop(key, None)
+                del self.last_read[assign_to]
+
+    def refresh(self, version=None) -> bool:
+        """
+        Merges the changes since the last refresh. Returns False if the
+        database couldn't be read; the cache then keeps its previous state.
+
+        `version` is the current `requests_version`: when it hasn't moved
+        since the last refresh nothing changed and the database isn't read.
+        """
+        columns = ", ".join(REQUEST_CACHE_COLUMNS)
+        with self._lock:
+            self._evict_idle()
+            if version is not None and version == self.version:
+                return True
+            if not self.by_assignee:
+                # nothing loaded, nothing to keep current
+                self.watermark = None
+                self.version = version
+                return True
+            try:
+                with self.conn.session as session:
+                    # read the clock first: anything committed after it is
+                    # picked up by this refresh or the next
+                    now, archived_until = session.execute(
+                        text(f"SELECT now()::TIMESTAMP, ({ARCHIVED_UNTIL});")
+                    ).one()
+                    full = (
+                        now - self.watermark
+                        > REQUEST_TOMBSTONE_RETENTION - REQUEST_CACHE_OVERLAP
+                    )
+                    if full:
+                        # too old for the tombstones, reload the loaded
+                        # assignees instead
+                        changed = session.execute(
+                            text(f"""
+                                SELECT {columns} FROM requests
+                                WHERE assign_to = ANY(:assignees);
+                                """),
+                            {"assignees": list(self.by_assignee)},
+                        )
+                        deleted = []
+                    else:
+                        since = self.watermark - REQUEST_CACHE_OVERLAP
+                        changed = session.execute(
+                            text(f"""
+                                SELECT {columns} FROM requests
+                                WHERE COALESCE(updated_at, created_at) > :since;
+                                """),
+                            {"since": since},
+                        )
+                        deleted = session.execute(
+                            text("""
+                                SELECT id, created_at FROM request_tombstones
+                                WHERE deleted_at > :since;
+                                """),
+                            {"since": since},
+                        ).all()
+                    changed = changed.mappings().all()
+            except Exception as e:
+                print(e)
+                return False
+
+            if full:
+                self.rows = {}
+                self.by_assignee = {assign_to: set() for assign_to in self.by_assignee}
+            for row in changed:
+                self._merge(dict(row))
+            for id, created_at in deleted:
+                self._drop((id, created_at))
+            self._drop_archived(archived_until)
+            self.watermark = now
+            self.version = version
+            return True
+
+    def _load(self, assign_to: str) -> bool:
+        """Loads one assignee's requests. Called with the lock held."""
+        columns = ", ".join(REQUEST_CACHE_COLUMNS)
+        try:
+            with self.conn.session as session:
+                now = session.execute(text("SELECT now()::TIMESTAMP;")).scalar()
+                rows = (
+                    session.execute(
+                        text(f"""
+                            SELECT {columns} FROM requests
+                            WHERE assign_to = :assign_to;
+                            """),
+                        {"assign_to": assign_to},
+                    )
+                    .mappings()
+                    .all()
+                )
+        except Exception as e:
+            print(e)
+            return False
+
+        self.by_assignee[assign_to] = set()
+        for row in rows:
+            self._put(dict(row))
+        # an older watermark already covers the new rows; deltas from it are
+        # merged again harmlessly
+        if self.watermark is None:
+            self.watermark = now
+        return True
+
+    def for_assignee(self, assign_to: str):
+        """
+        The requests assigned to `assign_to`, newest first, loading them on
+        first use. Returns None if they couldn't be loaded.
+        """
+        if assign_to is None:
+            return pd.DataFrame(columns=REQUEST_CACHE_COLUMNS)
+        with self._lock:
+            if assign_to not in self.by_assignee and not self._load(assign_to):
+                return None
+            self.last_read[assign_to] = time.monotonic()
+            rows = [self.rows[key] for key in self.by_assignee[assign_to]]
+        rows.sort(key=lambda row: (row["created_at"], row["id"]), reverse=True)
+        return pd.DataFrame(rows, columns=REQUEST_CACHE_COLUMNS)
+
+
+@st.cache_resource
+def request_cache_store(_conn) -> RequestCache:
+    """Creates the request cache once per process."""
+    return RequestCache(_conn)
+
+
+def request_cache(conn) -> RequestCache:
+    """
+    Returns the process-wide request cache, refreshed with the changes made
+    since any session last read it. While the request change listener is
+    connected, a render with no change since the last refresh skips the
+    database entirely.
+
+    A failed refresh serves the last known state; `for_assignee` returns None
+    when an assignee's requests can't be loaded at all.
+    """
+    cache = request_cache_store(conn)
+    cache.refresh(requests_version(conn))
+    return cache
+
+
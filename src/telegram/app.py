@@ -1,33 +1,125 @@
 import asyncio
+import multiprocessing
 import os
 from aiogram import Bot, Dispatcher, Router
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from psycopg2 import errors
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 
 import utils
+from outbound import OutboundQueue, GLOBAL_RATE
+from middlewares.user_context import UserContextMiddleware
+from middlewares.deduplication import UpdateDeduplicationMiddleware
 from routers.auth_router import auth_router
 from routers.private_router import private_router
 from routers.callbacks_router import callback_router
 
-
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
+# "polling" runs a single long-polling process, "webhook" runs
+# WEBHOOK_WORKERS aiohttp servers on consecutive ports starting at
+# WEBHOOK_PORT, meant to sit behind a local reverse proxy
+# (see webhook_proxy.conf)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 1))
 
-async def main() -> None:
-    bot = Bot(token=BOT_TOKEN)
+
+def create_dispatcher(bot: Bot, workers: int = 1, webhook: bool = False) -> Dispatcher:
     dp = Dispatcher()
 
+    if webhook:
+        # Telegram redelivers updates it didn't get a timely answer for and the
+        # proxy may retry on another worker; drop anything already handled
+        # before doing any other work
+        dp.update.outer_middleware(UpdateDeduplicationMiddleware())
+
+    # open the shared db pool before polling starts and drain it on shutdown
+    dp.startup.register(utils.init_db_pool)
+    dp.shutdown.register(utils.close_db_pool)
+
+    # reloads the cached test catalog when it changes
+    dp.startup.register(utils.start_catalog_watcher)
+    dp.shutdown.register(utils.stop_catalog_watcher)
+
+    # every outgoing message goes through the rate limited send queue, which
+    # handlers receive as `outbound`. Workers split the bot-wide rate limit.
+    outbound = OutboundQueue(bot, global_rate=GLOBAL_RATE / workers)
+    dp["outbound"] = outbound
+    dp.startup.register(outbound.start)
+    dp.shutdown.register(outbound.stop)
+
+    # resolve the caller (group membership + registered user) once per update
+    dp.update.outer_middleware(UserContextMiddleware())
+
     dp.include_router(auth_router)
     dp.include_router(private_router)
     dp.include_router(callback_router)
 
-    await dp.start_polling(bot)
+    return dp
+
+
+async def main() -> None:
+    bot = Bot(token=BOT_TOKEN)
+    dp = create_dispatcher(bot)
+
+    # switching back from webhook mode; polling fails while a webhook is set
+    await bot.delete_webhook()
+
+    # chat_member updates aren't delivered unless asked for explicitly; they
+    # keep the group membership cache current
+    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+
+
+async def set_webhook(bot: Bot, dispatcher: Dispatcher) -> None:
+    """Points Telegram at the reverse proxy. Only the first worker does this."""
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+        max_connections=max(40, WEBHOOK_WORKERS * 10),
+    )
+
+
+def run_webhook_worker(port: int) -> None:
+    bot = Bot(token=BOT_TOKEN)
+    dp = create_dispatcher(bot, workers=WEBHOOK_WORKERS, webhook=True)
+
+    if port == WEBHOOK_PORT:
+        dp.startup.register(set_webhook)
+
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(
+        app, path=WEBHOOK_PATH
+    )
+    setup_application(app, dp, bot=bot)
+
+    print(f"Webhook worker listening on {WEBHOOK_HOST}:{port}")
+    web.run_app(app, host=WEBHOOK_HOST, port=port, print=None)
+
+
+def run_webhook() -> None:
+    workers = [
+        multiprocessing.Process(target=run_webhook_worker, args=(WEBHOOK_PORT + i,))
+        for i in range(WEBHOOK_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 
 if __name__ == "__main__":
-    print("Bot Active")
-    asyncio.run(main())
+    print(f"Bot Active ({BOT_MODE})")
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
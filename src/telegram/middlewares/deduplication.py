@@ -0,0 +1,127 @@
+import os
+from datetime import timedelta
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+from cachetools import TTLCache
+
+import utils
+
+# prune the shared table every this many recorded updates
+PRUNE_EVERY = 1000
+# seconds before the claim of an update that was never marked done lapses
+CLAIM_TIMEOUT = float(os.getenv("UPDATE_CLAIM_TIMEOUT", 60))
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that drops updates that were already handled.
+
+    Telegram redelivers a webhook update when it doesn't get a timely 200 and
+    the reverse proxy may retry it on another worker, so update_ids are
+    claimed in the shared `processed_updates` table (see
+    src/utils/migrations/0000_bot_notifications.sql) and marked done once the
+    handler returns. A failed update gives up its claim, and the claim of a
+    worker that died mid-update expires after `claim_timeout`, so a
+    redelivery of either is handled again. A small in-process cache answers
+    repeats of handled updates that land on the same worker without a
+    round-trip.
+    """
+
+    def __init__(
+        self,
+        retention: timedelta = timedelta(days=2),
+        claim_timeout: timedelta = timedelta(seconds=CLAIM_TIMEOUT),
+    ):
+        self.retention = retention
+        self.claim_timeout = claim_timeout
+        self.seen = TTLCache(maxsize=10_000, ttl=60 * 10)
+        self.recorded = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        update_id = event.update_id
+        if update_id in self.seen:
+            return None
+
+        try:
+            # a new update, or one whose claim was left by a dead worker
+            claimed = await utils.fetchval(
+                """
+                INSERT INTO processed_updates AS p (update_id) VALUES ($1)
+                ON CONFLICT (update_id) DO UPDATE SET received_at = now()
+                WHERE NOT p.done AND p.received_at < now() - $2::interval
+                RETURNING update_id
+                """,
+                update_id,
+                self.claim_timeout,
+            )
+        except Exception as e:
+            # better to risk handling an update twice than to drop it
+            print(e)
+            claimed = update_id
+
+        if claimed is None:
+            return None
+
+        self.recorded += 1
+        if self.recorded % PRUNE_EVERY == 0:
+            await self.prune()
+
+        try:
+            result = await handler(event, data)
+        except BaseException:
+            await self.release(update_id)
+            raise
+
+        self.seen[update_id] = True
+        try:
+            await utils.execute(
+                "UPDATE processed_updates SET done = true WHERE update_id = $1",
+                update_id,
+            )
+        except Exception as e:
+            # the claim expires and a redelivery would be handled again
+            print(e)
+        return result
+
+    async def release(self, update_id: int) -> None:
+        """Gives up the claim on an update that failed, so it can be retried."""
+        try:
+            await utils.execute(
+                "DELETE FROM processed_updates WHERE update_id = $1 AND NOT done",
+                update_id,
+            )
+        except Exception as e:
+            print(e)
+
+    async def prune(self) -> int:
+        """
+        Deletes updates older than the retention and returns how many went.
+        Returns 0 if the prune failed; the next one will catch up.
+        """
+        try:
+            # without the cast $1 is inferred as a timestamp and asyncpg
+            # refuses the timedelta
+            result = await utils.execute(
+                "DELETE FROM processed_updates WHERE received_at < now() - $1::interval",
+                self.retention,
+            )
+            # a prune that deletes nothing while expired rows remain is broken
+            expired_left = await utils.fetchval(
+                "SELECT EXISTS (SELECT 1 FROM processed_updates WHERE received_at < now() - $1::interval)",
+                self.retention,
+            )
+        except Exception as e:
+            print(e)
+            return 0
+
+        if expired_left:
+            print("processed_updates prune left expired rows behind")
+        # "DELETE <count>"
+        return int(result.split()[-1])
@@ -0,0 +1,43 @@
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import utils
+from routers.auth_router import user_is_group_member
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """
+    Outer update middleware that resolves the caller once per update.
+
+    Injects into handler data:
+        - is_group_member: whether the sender belongs to the RPWC group
+        - user_context: the caller's utils.UserContext, or None if the
+          Telegram account isn't registered
+
+    Updates coming from group chats (registration, join/leave events) are
+    passed through untouched; only private chats and button presses need the
+    caller resolved.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        from_user = data.get("event_from_user")
+        chat = data.get("event_chat")
+
+        if from_user is not None and (chat is None or chat.type == "private"):
+            data["is_group_member"] = await user_is_group_member(
+                from_user.id, data["bot"]
+            )
+            try:
+                data["user_context"] = await utils.get_user_context(from_user.id)
+            except Exception as e:
+                print(e)
+                data["user_context"] = None
+
+        return await handler(event, data)
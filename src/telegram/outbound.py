@@ -0,0 +1,358 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+# priority lanes, lower goes first
+PRIORITY_URGENT = 0  # urgent assignment notifications
+PRIORITY_NORMAL = 1  # routine notifications and direct replies
+PRIORITY_BULK = 2  # list output
+
+# Telegram allows ~30 msg/s per bot, ~1 msg/s per private chat and
+# 20 msg/min per group
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", 30))
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", 1))
+CHAT_BURST = float(os.getenv("TG_CHAT_BURST", 3))
+GROUP_RATE = float(os.getenv("TG_GROUP_RATE", 20 / 60))
+MAX_CONCURRENT_SENDS = int(os.getenv("TG_MAX_CONCURRENT_SENDS", 8))
+MAX_RETRIES = int(os.getenv("TG_SEND_MAX_RETRIES", 3))
+# how often buckets of chats that have gone quiet are dropped
+BUCKET_SWEEP_INTERVAL = 60
+
+MAX_MESSAGE_LENGTH = 4096
+BATCH_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second up to `capacity`. A bucket
+    can also be blocked outright for a while after Telegram answers with 429.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """True once the bucket is back to a fresh one: full and not blocked."""
+        if now < self.blocked_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def block(self, seconds: float) -> None:
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+
+
+@dataclass(order=True)
+class OutboundMessage:
+    priority: int
+    seq: int
+    chat_id: int = field(compare=False)
+    text: str = field(compare=False)
+    kwargs: dict = field(compare=False, default_factory=dict)
+    future: asyncio.Future = field(compare=False, default=None)
+    attempts: int = field(compare=False, default=0)
+
+    def batchable_with(self, other: "OutboundMessage") -> bool:
+        # only plain messages without keyboards can be merged into one
+        return (
+            not self.kwargs.get("reply_markup")
+            and not other.kwargs.get("reply_markup")
+            and self.kwargs.get("parse_mode") == other.kwargs.get("parse_mode")
+        )
+
+
+class OutboundQueue:
+    """
+    Central scheduler for every outgoing Telegram message.
+
+    Messages are queued per chat and released by a single dispatcher loop that
+    respects a global token bucket and a per-chat one, picks the most urgent
+    message among the chats that are allowed to send, and merges queued plain
+    messages for the same chat and priority into one send. A 429 pauses the
+    affected chat and, since Telegram's flood limit is bot-wide, every other
+    chat for `retry_after` seconds; the message is re-queued in its original
+    position.
+
+    Usage:
+        outbound = OutboundQueue(bot)
+        await outbound.start()
+        await outbound.send(chat_id, "text", priority=PRIORITY_URGENT)
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: float = CHAT_BURST,
+        group_rate: float = GROUP_RATE,
+        max_concurrent_sends: int = MAX_CONCURRENT_SENDS,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, max(global_rate, 1))
+        self._buckets: dict[int, TokenBucket] = {}
+        self._chats: dict[int, list[OutboundMessage]] = {}
+        self._busy: set[int] = set()
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(max_concurrent_sends)
+        self._wakeup = asyncio.Event()
+        self._runner: asyncio.Task | None = None
+        # in-flight sends, referenced so they aren't garbage collected mid-send
+        self._deliveries: set[asyncio.Task] = set()
+        self._last_sweep = time.monotonic()
+
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "batched": 0,
+            "rate_limited": 0,
+            "retried": 0,
+            "failed": 0,
+        }
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self, drain_timeout: float = 10) -> None:
+        """
+        Waits up to `drain_timeout` seconds for queued messages and in-flight
+        sends, then stops; whatever is left is cancelled.
+        """
+        deadline = time.monotonic() + drain_timeout
+        while (self._chats or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+        if self._deliveries:
+            _, pending = await asyncio.wait(
+                self._deliveries, timeout=max(deadline - time.monotonic(), 0)
+            )
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for queued in self._chats.values():
+            for message in queued:
+                if not message.future.done():
+                    message.future.cancel()
+        self._chats.clear()
+
+    def submit(
+        self,
+        chat_id: int,
+        text: str,
+        priority: int = PRIORITY_NORMAL,
+        log_failures: bool = True,
+        **kwargs,
+    ) -> asyncio.Future:
+        """
+        Queues a message and returns a future resolving to the sent Message.
+        Failures are logged by default, so fire-and-forget callers can ignore
+        the future.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if log_failures:
+            future.add_done_callback(_log_failure)
+        message = OutboundMessage(
+            priority=priority,
+            seq=next(self._seq),
+            chat_id=chat_id,
+            text=text,
+            kwargs=kwargs,
+            future=future,
+        )
+        self._enqueue(message)
+        self.stats["queued"] += 1
+        return future
+
+    async def send(
+        self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs
+    ):
+        """Queues a message and waits until it has been delivered."""
+        return await self.submit(chat_id, text, priority, log_failures=False, **kwargs)
+
+    def _enqueue(self, message: OutboundMessage) -> None:
+        heapq.heappush(self._chats.setdefault(message.chat_id, []), message)
+        self._wakeup.set()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self._buckets:
+            if chat_id < 0:
+                self._buckets[chat_id] = TokenBucket(self.group_rate, 1)
+            else:
+                self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self._buckets[chat_id]
+
+    def _sweep_buckets(self, now: float) -> None:
+        """
+        Drops the buckets of chats with nothing queued or in flight whose
+        bucket has refilled; a new one would behave the same, so nothing is
+        lost and the map doesn't grow with every chat ever seen.
+        """
+        self._last_sweep = now
+        for chat_id in list(self._buckets):
+            if chat_id in self._chats or chat_id in self._busy:
+                continue
+            if self._buckets[chat_id].idle(now):
+                del self._buckets[chat_id]
+
+    def _next_chat(self, now: float) -> tuple[int | None, float | None]:
+        """
+        Returns the chat whose head message should go next, or (None, wait)
+        where wait is how long until some chat may send again.
+        """
+        best = None
+        wait = None
+        for chat_id, queued in self._chats.items():
+            if chat_id in self._busy:
+                continue
+            chat_wait = self._bucket(chat_id).wait_time(now)
+            if chat_wait > 0:
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            if best is None or queued[0] < self._chats[best][0]:
+                best = chat_id
+        return best, wait
+
+    def _pop_batch(self, chat_id: int) -> list[OutboundMessage]:
+        queued = self._chats[chat_id]
+        batch = [heapq.heappop(queued)]
+        length = len(batch[0].text)
+
+        while queued:
+            candidate = queued[0]
+            if candidate.priority != batch[0].priority:
+                break
+            if not batch[-1].batchable_with(candidate):
+                break
+            length += len(BATCH_SEPARATOR) + len(candidate.text)
+            if length > MAX_MESSAGE_LENGTH:
+                break
+            batch.append(heapq.heappop(queued))
+
+        if not queued:
+            del self._chats[chat_id]
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now - self._last_sweep >= BUCKET_SWEEP_INTERVAL:
+                self._sweep_buckets(now)
+            chat_id, wait = self._next_chat(now)
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            await self._slots.acquire()
+            self._global.take()
+            self._bucket(chat_id).take()
+            batch = self._pop_batch(chat_id)
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, batch))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    async def _deliver(self, chat_id: int, batch: list[OutboundMessage]) -> None:
+        head = batch[0]
+        text = BATCH_SEPARATOR.join(message.text for message in batch)
+        try:
+            sent = await self.bot.send_message(
+                chat_id=chat_id, text=text, **head.kwargs
+            )
+            self.stats["sent"] += 1
+            self.stats["batched"] += len(batch) - 1
+            for message in batch:
+                if not message.future.done():
+                    message.future.set_result(sent)
+
+        except TelegramRetryAfter as e:
+            self.stats["rate_limited"] += 1
+            self._bucket(chat_id).block(e.retry_after)
+            # the flood limit is per bot, so hold every chat back too
+            self._global.block(e.retry_after)
+            self._retry(batch, e)
+
+        except (TelegramNetworkError, TelegramServerError) as e:
+            # transient; back off exponentially before trying again
+            self._bucket(chat_id).block(2**head.attempts)
+            self._retry(batch, e)
+
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            for message in batch:
+                if not message.future.done():
+                    message.future.set_exception(e)
+
+        finally:
+            self._busy.discard(chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _retry(self, batch: list[OutboundMessage], error: Exception) -> None:
+        for message in batch:
+            message.attempts += 1
+            if message.attempts > self.max_retries:
+                self.stats["failed"] += 1
+                if not message.future.done():
+                    message.future.set_exception(error)
+                continue
+            self.stats["retried"] += 1
+            self._enqueue(message)
+
+
+def _log_failure(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Failed to deliver Telegram message: {future.exception()}")
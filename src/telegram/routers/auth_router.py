@@ -1,27 +1,45 @@
 import asyncio
 import os
-from aiogram import Bot, Dispatcher, Router
+from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import Command, CommandObject
-from aiogram.types import Message
+from aiogram.types import Message, ChatMemberUpdated
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from psycopg2 import errors
+from asyncpg import exceptions
+from cachetools import TTLCache
 import utils
+from outbound import OutboundQueue
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GROUP_ID = int(os.getenv("TELEGRAM_GROUP_ID"))
 
+MEMBER_STATUSES = ("member", "creator", "administrator")
+
+# membership answers are kept in memory so repeat taps skip get_chat_member.
+# non-members are cached for a shorter time so someone who just joined isn't
+# locked out for long if the join update is missed
+membership_cache = TTLCache(
+    maxsize=1024, ttl=int(os.getenv("MEMBERSHIP_CACHE_TTL", 60 * 10))
+)
+non_member_cache = TTLCache(
+    maxsize=1024, ttl=int(os.getenv("MEMBERSHIP_NEGATIVE_CACHE_TTL", 60))
+)
+
 auth_router = Router()
 
 
 @auth_router.message(Command("register"))
-async def register_new_user(message: Message, command: CommandObject):
+async def register_new_user(
+    message: Message, command: CommandObject, outbound: OutboundQueue
+):
     if message.chat.type != "group":
-        await message.answer("Unauthorized! This command is only available from group")
+        await outbound.send(
+            message.chat.id, "Unauthorized! This command is only available from group"
+        )
         return
 
     if message.chat.id != GROUP_ID:
-        await message.answer("Unauthorized! This is a private bot")
+        await outbound.send(message.chat.id, "Unauthorized! This is a private bot")
         return
 
     sender_id = message.from_user.id
@@ -29,105 +47,141 @@ async def register_new_user(message: Message, command: CommandObject):
     args = command.args
 
     if args is None:
-        await message.answer(
+        await outbound.send(
+            message.chat.id,
             f"Hello {sender_name}, \nPlease provide your email to register your account",
             parse_mode="markdown",
         )
         return
 
     try:
-        with utils.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT * FROM users WHERE email=%s", (args,))
-                email_valid = cur.fetchone()
-
-                # user tries registering an email not in the system
-                if not email_valid:
-                    await message.answer(
-                        f"""Hello {sender_name}, 
-                        \nThe email you entered does not exist in our system. 
-                        \nPlease provide the correct email as follows: /register <email>
-                        """
-                    )
-                    return
-
-                # user tries register an email that is already linked to a telegram account
-                if email_valid[9]:
-                    ## case 1: same user but from a different device(same chat id)
-                    if email_valid[9] == sender_id:
-                        await message.answer(
-                            f"""Hello {sender_name}, 
-                            \nYou are already registered. You can continue using the bot privately"""
-                        )
-                        return
-                    else:
-                        ## case 2: DIFFERENT USER trying to steal the account (block!)
-                        await message.answer(
-                            f"""Hello {sender_name}, 
-                            \nThis email is already linked to another Telegram account.  
-                            \nIf this wasn't you, contact admin."""
-                        )
-                        return
-
-                cur.execute(
-                    "UPDATE users SET telegram_chat_id=%s WHERE email=%s",
-                    (sender_id, args),
+        # no connection is held across the replies below; they may have to
+        # wait on the group's send rate limit
+        email_valid = await utils.fetchrow(
+            "SELECT telegram_chat_id FROM users WHERE email=$1", args
+        )
+
+        # user tries registering an email not in the system
+        if not email_valid:
+            await outbound.send(
+                message.chat.id,
+                f"""Hello {sender_name}, 
+                \nThe email you entered does not exist in our system. 
+                \nPlease provide the correct email as follows: /register <email>
+                """
+            )
+            return
+
+        # user tries register an email that is already linked to a telegram account
+        if email_valid["telegram_chat_id"]:
+            ## case 1: same user but from a different device(same chat id)
+            if email_valid["telegram_chat_id"] == sender_id:
+                await outbound.send(
+                    message.chat.id,
+                    f"""Hello {sender_name}, 
+                    \nYou are already registered. You can continue using the bot privately"""
                 )
-                conn.commit()
-                await message.answer(
+                return
+            else:
+                ## case 2: DIFFERENT USER trying to steal the account (block!)
+                await outbound.send(
+                    message.chat.id,
                     f"""Hello {sender_name}, 
-                    \nYour registration was successful.
-                    \nYou can now communicate with the bot privately to view and update your assignments"""
+                    \nThis email is already linked to another Telegram account.  
+                    \nIf this wasn't you, contact admin."""
                 )
+                return
+
+        await utils.execute(
+            "UPDATE users SET telegram_chat_id=$1 WHERE email=$2",
+            sender_id,
+            args,
+        )
+        utils.forget_user_context(sender_id)
+        await outbound.send(
+            message.chat.id,
+            f"""Hello {sender_name}, 
+            \nYour registration was successful.
+            \nYou can now communicate with the bot privately to view and update your assignments"""
+        )
 
     # user tries to register another email from the same telegram account
-    except errors.UniqueViolation as e:
-        await message.answer(
+    except exceptions.UniqueViolationError as e:
+        await outbound.send(
+            message.chat.id,
             f"""Hello {sender_name},
             \nYou already have a registered account.
             \nIf this wasn't you, contact admin"""
         )
     except Exception as e:
         print(e)
-        await message.answer(
+        await outbound.send(
+            message.chat.id,
             f"""Hello {sender_name},
             \nWe experienced an error while registering your account.
             \nPlease try again later or contact the admin for support"""
         )
 
 
+def remember_membership(user_id: int, is_member: bool) -> None:
+    if is_member:
+        non_member_cache.pop(user_id, None)
+        # with several webhook workers a leave or kick update reaches only one
+        # of them, and the others would let the user in until the TTL ran out
+        if utils.SINGLE_WORKER:
+            membership_cache[user_id] = True
+    else:
+        membership_cache.pop(user_id, None)
+        non_member_cache[user_id] = False
+
+
+@auth_router.chat_member(F.chat.id == GROUP_ID)
+async def track_group_membership(event: ChatMemberUpdated) -> None:
+    """
+    Keeps the membership cache in sync with joins, leaves, kicks and bans in
+    the group. Requires the bot to be a group admin and `chat_member` to be in
+    the polling allowed_updates.
+    """
+    remember_membership(
+        event.new_chat_member.user.id,
+        event.new_chat_member.status in MEMBER_STATUSES,
+    )
+
+
+@auth_router.message(F.chat.id == GROUP_ID, F.new_chat_members)
+async def group_members_joined(message: Message) -> None:
+    for member in message.new_chat_members:
+        remember_membership(member.id, True)
+
+
+@auth_router.message(F.chat.id == GROUP_ID, F.left_chat_member)
+async def group_member_left(message: Message) -> None:
+    remember_membership(message.left_chat_member.id, False)
+
+
 async def user_is_group_member(user_id, bot: Bot) -> bool:
     """
     Checks if a user is a member of the specified Telegram group.
 
+    Answers from the membership cache when possible and only calls
+    `get_chat_member` on a miss. API errors are not cached, and neither are
+    members when running several webhook workers (see utils.SINGLE_WORKER).
+
     :param user-id: The user_id to check.
     :param bot: The Bot instance (injected by aiogram).
     :param group_id: The target group ID (passed in the filter arguments).
     :return: True if the user is a member, False otherwise.
     """
+    if user_id in membership_cache:
+        return True
+    if user_id in non_member_cache:
+        return False
 
     try:
         chat_member = await bot.get_chat_member(GROUP_ID, user_id)
-        return chat_member.status in ["member", "creator", "administrator"]
+        is_member = chat_member.status in MEMBER_STATUSES
+        remember_membership(user_id, is_member)
+        return is_member
     except Exception as e:
         print(e)
         return False
-
-
-def user_is_in_db(user_id: int) -> bool:
-    """
-    Checks if the user exists in the custom database.
-
-    :param message: The incoming message object.
-    :return: True if the user is found in the database, False otherwise.
-    """
-
-    try:
-        with utils.get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT 1 FROM users WHERE telegram_chat_id=%s", (user_id,))
-                user_exists = cur.fetchone()
-                return user_exists is not None
-
-    except Exception as e:
-        print(e)
@@ -1,3 +1,4 @@
+import html
 import os
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import Command, CommandObject
@@ -7,121 +8,294 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.formatting import Spoiler, Text
-from psycopg2 import errors
 
 import utils
-from routers.auth_router import user_is_group_member, user_is_in_db
+from outbound import OutboundQueue
+from utils import UserContext
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GROUP_ID = int(os.getenv("TELEGRAM_GROUP_ID"))
 
+TASKS_PAGE_SIZE = int(os.getenv("TASKS_PAGE_SIZE", 5))
+
+# task list command -> (request_status filter, list title)
+TASK_LISTS = {
+    "tasks": (None, "All tasks"),
+    "pending": ("pending", "Pending tasks"),
+    "in_progress": ("in-progress", "In-progress tasks"),
+    "completed": ("completed", "Completed tasks"),
+}
+
 callback_router = Router()
 
 
+# `created` is the task's created_at as a cursor (see utils.to_cursor); with it
+# the lookup only touches the task's own month partition
 class TaskDetailsCallbackData(CallbackData, prefix="task_details"):
     task_id: int
+    created: int
 
 
 class TaskStatusCallbackData(CallbackData, prefix="task_status"):
     status: str
     task_id: int
+    created: int
+
+
+class TaskPageCallbackData(CallbackData, prefix="task_page"):
+    task_list: str
+    direction: str
+    cursor: int
+    cursor_id: int
+    page: int
+
+
+async def build_tasks_page(
+    user_context: UserContext,
+    task_list: str,
+    page: int = 1,
+    after: tuple | None = None,
+    before: tuple | None = None,
+):
+    """
+    Renders one page of a user's task list as a single message.
+
+    Each task gets a numbered "View" button and the last row holds prev/next
+    buttons that carry the keyset cursor of the page edges, so navigating only
+    ever fetches one page from the db.
+
+    :return: (text, reply_markup), or (None, None) if the page is empty.
+    """
+    request_status, title = TASK_LISTS[task_list]
+    tasks, has_more = await utils.fetch_tasks_page(
+        user_context.dkl_code, request_status, TASKS_PAGE_SIZE, after, before
+    )
+    if not tasks:
+        return None, None
+
+    if after is not None:
+        has_prev, has_next = True, has_more
+    elif before is not None:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = False, has_more
+
+    lines = [f"📋 <b>{title}</b> · page {page}\n"]
+    builder = InlineKeyboardBuilder()
+    for idx, task in enumerate(tasks, start=1):
+        patient = html.escape(
+            f"{task['first_name']} {task['surname']}".replace("_", " ")
+        )
+        appointment_date = task["collection_date"].strftime("%b %d, %Y")
+        appointment_time = task["collection_time"].strftime("%I:%M %p")
+        lines.append(
+            f"<b>{idx}.</b> 👤 <b>{patient}</b>\n"
+            f"📍 {html.escape(task['location'] or '')} · ⚠️ {task['priority']}\n"
+            f"📅 {appointment_date} • {appointment_time} · "
+            f"📌 {task['request_status'].title()}\n"
+        )
+        builder.button(
+            text=f"👁 {idx}",
+            callback_data=TaskDetailsCallbackData(
+                task_id=task["id"], created=utils.to_cursor(task["created_at"])
+            ).pack(),
+        )
+    builder.adjust(len(tasks))
+
+    nav_buttons = []
+    if has_prev:
+        first = tasks[0]
+        nav_buttons.append(
+            InlineKeyboardButton(
+                text="⬅ Prev",
+                callback_data=TaskPageCallbackData(
+                    task_list=task_list,
+                    direction="prev",
+                    cursor=utils.to_cursor(first["created_at"]),
+                    cursor_id=first["id"],
+                    page=page - 1,
+                ).pack(),
+            )
+        )
+    if has_next:
+        last = tasks[-1]
+        nav_buttons.append(
+            InlineKeyboardButton(
+                text="Next ➡",
+                callback_data=TaskPageCallbackData(
+                    task_list=task_list,
+                    direction="next",
+                    cursor=utils.to_cursor(last["created_at"]),
+                    cursor_id=last["id"],
+                    page=page + 1,
+                ).pack(),
+            )
+        )
+    if nav_buttons:
+        builder.row(*nav_buttons)
+
+    return "\n".join(lines), builder.as_markup()
+
+
+@callback_router.callback_query(TaskPageCallbackData.filter())
+async def navigate_tasks_page(
+    callback_query: CallbackQuery,
+    callback_data: TaskPageCallbackData,
+    is_group_member: bool = False,
+    user_context: UserContext | None = None,
+) -> None:
+    if not is_group_member:
+        await callback_query.answer(
+            "You must mem a registered member of RPWC-DKL to interact with this bot"
+        )
+        return
+
+    if user_context is None:
+        await callback_query.answer(
+            "Unauthorized! You must be registered in our system"
+        )
+        return
+
+    if not user_context.active:
+        await callback_query.answer(
+            "Your account is deactivated. Contact an admin for assistance"
+        )
+        return
+
+    cursor = (utils.from_cursor(callback_data.cursor), callback_data.cursor_id)
+    try:
+        if callback_data.direction == "next":
+            text, markup = await build_tasks_page(
+                user_context, callback_data.task_list, callback_data.page, after=cursor
+            )
+        else:
+            text, markup = await build_tasks_page(
+                user_context,
+                callback_data.task_list,
+                max(callback_data.page, 1),
+                before=cursor,
+            )
+
+        if text is None:
+            await callback_query.answer("No more tasks")
+            return
+
+        # edit the list in place instead of sending a new message per page
+        await callback_query.message.edit_text(
+            text, parse_mode="HTML", reply_markup=markup
+        )
+        await callback_query.answer()
+    except Exception as e:
+        print(e)
+        await callback_query.answer("Error fetching tasks. Please try again later")
 
 
 @callback_router.callback_query(TaskDetailsCallbackData.filter())
 async def show_task_details(
-    callback_query: CallbackQuery, callback_data: TaskDetailsCallbackData, bot: Bot
+    callback_query: CallbackQuery,
+    callback_data: TaskDetailsCallbackData,
+    outbound: OutboundQueue,
+    is_group_member: bool = False,
+    user_context: UserContext | None = None,
 ):
-    chat_id = callback_query.from_user.id
     task_id = callback_data.task_id
+    created_at = utils.from_cursor(callback_data.created)
 
-    if not await user_is_group_member(chat_id, bot):
+    if not is_group_member:
         await callback_query.answer(
             "You must mem a registered member of RPWC-DKL to interact with this bot"
         )
         return
 
-    if not user_is_in_db(chat_id):
+    if user_context is None:
         await callback_query.answer(
             "Unauthorized! You must be registered in our system"
         )
         return
 
+    if not user_context.active:
+        await callback_query.answer(
+            "Your account is deactivated. Contact an admin for assistance"
+        )
+        return
+
     await callback_query.answer("Fetching task details...")
     # print(callback_data)
 
     try:
-        with utils.get_connection() as conn:
-            with conn.cursor() as cur:
-                # Fetch full task details
-                cur.execute("SELECT * FROM requests WHERE id=%s", (task_id,))
-                task = cur.fetchone()
-
-                if not task:
-                    await callback_query.message.answer("❌ Task not found.")
-                    return
-
-                # Build detailed message
-                patient = f"{task[1]} {task[2].replace('_', ' ')}"
-                urgency = task[12]
-                appointment_date = task[13].strftime("%b %d, %Y")
-                appointment_time = task[14].strftime("%I:%M %p")
-                status = task[-1].title()
-                location = task[8]
-                # tests = ", ".join(task[10]) if task[10] else "N/A"
-
-                # categorize tests
-                raw_tests = task[10]
-                categorized_tests = utils.categorize_selected_tests(raw_tests)
-
-                tests_html = ""
-                for cat, tests in categorized_tests.items():
-                    tests_html += f"<b>{cat}</b>\n"
-                    for t in tests:
-                        tests_html += f"• <i>{t}</i>\n"
-                    tests_html += f"\n"
-                text = (
-                    f"👤 <b>Patient:</b>\n"
-                    f"{patient}\n\n"
-                    f"📍<b>Location:</b>\n"
-                    f"{location}\n\n"
-                    f"⚠️ <b>Urgency:</b>\n"
-                    f"{urgency}\n\n"
-                    f"📅 <b>Appointment:</b>\n"
-                    f"{appointment_date} • {appointment_time}\n\n"
-                    f"🧪 <b>Tests:</b>\n"
-                    f"{tests_html}\n\n"
-                    f"📌 <b>Status:</b>"
-                    f"{status}"
-                )
-
-                builder = InlineKeyboardBuilder()
-                builder.row(
-                    InlineKeyboardButton(
-                        text="Completed",
-                        callback_data=TaskStatusCallbackData(
-                            status="completed", task_id=task_id
-                        ).pack(),
-                    ),
-                    InlineKeyboardButton(
-                        text="Pending",
-                        callback_data=TaskStatusCallbackData(
-                            status="pending", task_id=task_id
-                        ).pack(),
-                    ),
-                    InlineKeyboardButton(
-                        text="In progress",
-                        callback_data=TaskStatusCallbackData(
-                            status="in-progress", task_id=task_id
-                        ).pack(),
-                    ),
-                )
-
-                await bot.send_message(
-                    chat_id=callback_query.from_user.id,
-                    text=text,
-                    parse_mode="HTML",
-                    reply_markup=builder.as_markup(),
-                )
+        # Fetch full task details
+        task = await utils.fetchrow(
+            "SELECT * FROM requests WHERE id=$1 AND assign_to=$2 AND created_at=$3",
+            task_id,
+            user_context.dkl_code,
+            created_at,
+        )
+
+        if not task:
+            await outbound.send(callback_query.from_user.id, "❌ Task not found.")
+            return
+
+        # Build detailed message
+        patient = f"{task['first_name']} {task['surname'].replace('_', ' ')}"
+        urgency = task["priority"]
+        appointment_date = task["collection_date"].strftime("%b %d, %Y")
+        appointment_time = task["collection_time"].strftime("%I:%M %p")
+        status = task["request_status"].title()
+        location = task["location"]
+        # tests = ", ".join(task[10]) if task[10] else "N/A"
+
+        # categorize tests
+        categorized_tests = await utils.categorize_tests(task["test_codes"] or [])
+
+        tests_html = ""
+        for cat, tests in categorized_tests.items():
+            tests_html += f"<b>{cat}</b>\n"
+            for t in tests:
+                tests_html += f"• <i>{t}</i>\n"
+            tests_html += f"\n"
+        text = (
+            f"👤 <b>Patient:</b>\n"
+            f"{patient}\n\n"
+            f"📍<b>Location:</b>\n"
+            f"{location}\n\n"
+            f"⚠️ <b>Urgency:</b>\n"
+            f"{urgency}\n\n"
+            f"📅 <b>Appointment:</b>\n"
+            f"{appointment_date} • {appointment_time}\n\n"
+            f"🧪 <b>Tests:</b>\n"
+            f"{tests_html}\n\n"
+            f"📌 <b>Status:</b>"
+            f"{status}"
+        )
+
+        builder = InlineKeyboardBuilder()
+        builder.row(
+            InlineKeyboardButton(
+                text="Completed",
+                callback_data=TaskStatusCallbackData(
+                    status="completed", task_id=task_id, created=callback_data.created
+                ).pack(),
+            ),
+            InlineKeyboardButton(
+                text="Pending",
+                callback_data=TaskStatusCallbackData(
+                    status="pending", task_id=task_id, created=callback_data.created
+                ).pack(),
+            ),
+            InlineKeyboardButton(
+                text="In progress",
+                callback_data=TaskStatusCallbackData(
+                    status="in-progress", task_id=task_id, created=callback_data.created
+                ).pack(),
+            ),
+        )
+
+        await outbound.send(
+            callback_query.from_user.id,
+            text,
+            parse_mode="HTML",
+            reply_markup=builder.as_markup(),
+        )
 
     except Exception as e:
         print(e)
@@ -132,47 +306,63 @@ async def show_task_details(
 
 @callback_router.callback_query(TaskStatusCallbackData.filter())
 async def update_task_status(
-    callback_query: CallbackQuery, callback_data: TaskStatusCallbackData, bot: Bot
+    callback_query: CallbackQuery,
+    callback_data: TaskStatusCallbackData,
+    outbound: OutboundQueue,
+    is_group_member: bool = False,
+    user_context: UserContext | None = None,
 ) -> None:
-    chat_id = callback_query.from_user.id
     task_id = callback_data.task_id
     task_status = callback_data.status
+    created_at = utils.from_cursor(callback_data.created)
 
-    if not await user_is_group_member(chat_id, bot):
+    if not is_group_member:
         await callback_query.answer(
             "You must mem a registered member of RPWC-DKL to interact with this bot"
         )
         return
 
-    if not user_is_in_db(chat_id):
+    if user_context is None:
         await callback_query.answer(
             "Unauthorized! You must be registered in our system"
         )
         return
 
+    if not user_context.active:
+        await callback_query.answer(
+            "Your account is deactivated. Contact an admin for assistance"
+        )
+        return
+
     await callback_query.answer("Updating task status...")
 
-    with utils.get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                WITH current_tg_user AS(
-                    SELECT dkl_code 
-                    FROM users 
-                    WHERE telegram_chat_id=%s
-                )
-                UPDATE requests 
-                SET request_status=%s, 
-                    updated_at=now() 
-                FROM current_tg_user
-                WHERE 
-                    requests.assign_to=current_tg_user.dkl_code AND 
-                    requests.id=%s;
-                """,
-                (chat_id, task_status, task_id),
-            )
-            conn.commit()
-            await bot.send_message(
-                chat_id=callback_query.from_user.id,
-                text=f"Task {task_id} status updated to {task_status}",
-            )
+    try:
+        result = await utils.execute(
+            """
+            UPDATE requests 
+            SET request_status=$1
+            WHERE id=$2 AND assign_to=$3 AND created_at=$4;
+            """,
+            task_status,
+            task_id,
+            user_context.dkl_code,
+            created_at,
+        )
+
+        # "UPDATE 0": deleted, reassigned, or a stale button
+        if result == "UPDATE 0":
+            await outbound.send(callback_query.from_user.id, "❌ Task not found.")
+            return
+
+        await outbound.send(
+            callback_query.from_user.id,
+            f"Task {task_id} status updated to {task_status}",
+        )
+
+    except Exception as e:
+        print(e)
+        # the callback was already answered above, so reply in the chat
+        await outbound.send(
+            callback_query.from_user.id,
+            "Error updating task status. Please try again later",
+        )
@@ -8,11 +8,11 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.utils.formatting import Spoiler, Text
-from psycopg2 import errors
 
 import utils
-from routers.callbacks_router import TaskDetailsCallbackData
-from routers.auth_router import user_is_group_member, user_is_in_db
+from outbound import OutboundQueue, PRIORITY_BULK
+from utils import UserContext
+from routers.callbacks_router import build_tasks_page
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 GROUP_ID = int(os.getenv("TELEGRAM_GROUP_ID"))
@@ -22,21 +22,36 @@ private_router.message.filter(F.chat.type == "private")
 
 
 @private_router.message(Command("start"))
-async def private_start_command(message: Message, bot: Bot) -> None:
+async def private_start_command(
+    message: Message,
+    outbound: OutboundQueue,
+    is_group_member: bool = False,
+    user_context: UserContext | None = None,
+) -> None:
     user_name = message.chat.first_name
-    user_id = message.chat.id
 
-    if not await user_is_group_member(user_id, bot):
-        await message.answer(
-            "You must mem a registered member of RPWC-DKL to interact with this bot"
+    if not is_group_member:
+        await outbound.send(
+            message.chat.id,
+            "You must mem a registered member of RPWC-DKL to interact with this bot",
         )
         return
 
-    if not user_is_in_db(user_id):
-        await message.answer("Unauthorized! You must be registered in our system")
+    if user_context is None:
+        await outbound.send(
+            message.chat.id, "Unauthorized! You must be registered in our system"
+        )
         return
 
-    await message.answer(
+    if not user_context.active:
+        await outbound.send(
+            message.chat.id,
+            "Your account is deactivated. Contact an admin for assistance",
+        )
+        return
+
+    await outbound.send(
+        message.chat.id,
         f"""
         👋 Hello {user_name}
         
@@ -56,8 +71,9 @@ Type **/help** anytime to see a full list of available commands
 
 
 @private_router.message(Command("help"))
-async def private_help(message: Message) -> None:
-    await message.answer(
+async def private_help(message: Message, outbound: OutboundQueue) -> None:
+    await outbound.send(
+        message.chat.id,
         """
         *RPWC DKL Assistant Bot*
         
@@ -78,97 +94,51 @@ If something doesn’t work or you believe there’s an error, contact the admin
 
 
 @private_router.message(Command("tasks", "pending", "completed", "in_progress"))
-async def all_user_tasks(message: Message, bot: Bot, command: CommandObject) -> None:
-    user_name = message.chat.first_name
-    user_id = message.chat.id
+async def all_user_tasks(
+    message: Message,
+    command: CommandObject,
+    outbound: OutboundQueue,
+    is_group_member: bool = False,
+    user_context: UserContext | None = None,
+) -> None:
+    if not is_group_member:
+        await outbound.send(
+            message.chat.id,
+            "You must be a registered member of RPWC-DKL to interact with this bot",
+        )
+        return
 
-    if not await user_is_group_member(user_id, bot):
-        await message.answer(
-            "You must be a registered member of RPWC-DKL to interact with this bot"
+    if user_context is None:
+        await outbound.send(
+            message.chat.id, "Unauthorized! You must be registered in our system"
         )
         return
 
-    if not user_is_in_db(user_id):
-        await message.answer("Unauthorized! You must be registered in our system")
+    if not user_context.active:
+        await outbound.send(
+            message.chat.id,
+            "Your account is deactivated. Contact an admin for assistance",
+        )
         return
     try:
-        with utils.get_connection() as conn:
-            with conn.cursor() as cur:
-                task_status = command.command
-
-                if task_status.strip() == "in_progress":
-                    query = f"""
-                        SELECT r.* FROM requests r
-                        JOIN users u ON u.dkl_code=r.assign_to
-                        WHERE u.telegram_chat_id=%s AND request_status='in-progress'
-                        ORDER BY r.created_at DESC;
-                    """
-                elif task_status.strip() == "pending":
-                    query = f"""
-                        SELECT r.* FROM requests r
-                        JOIN users u ON u.dkl_code=r.assign_to
-                        WHERE u.telegram_chat_id=%s AND request_status='pending'
-                        ORDER BY r.created_at DESC;
-                    """
-                elif task_status.strip() == "completed":
-                    query = f"""
-                        SELECT r.* FROM requests r
-                        JOIN users u ON u.dkl_code=r.assign_to
-                        WHERE u.telegram_chat_id=%s AND request_status='completed'
-                        ORDER BY r.created_at DESC;
-                    """
-                else:
-                    query = f"""
-                        SELECT r.* FROM requests r
-                        JOIN users u ON u.dkl_code=r.assign_to
-                        WHERE u.telegram_chat_id=%s
-                        ORDER BY r.created_at DESC;
-                    """
-                cur.execute(query, (user_id,))
-
-                tasks = cur.fetchall()
-                if not tasks:
-                    await message.answer("You don't have any tasks")
-                    return
-
-                # await message.answer("Here are your tasks, most recent first")
-
-                for task in tasks:
-                    task_id = task[0]
-                    patient = f"{task[1]} {task[2]}"
-                    location = task[8]
-                    urgency = task[12]
-                    appointment_date = task[13].strftime("%b %d, %Y")
-                    appointment_time = task[14].strftime("%I:%M %p")
-                    status = task[-1].title()
-
-                    # Build keyboard
-                    builder = InlineKeyboardBuilder()
-                    task_callback_data = TaskDetailsCallbackData(task_id=task_id).pack()
-                    builder.button(text="👁 View", callback_data=task_callback_data)
-
-                    # # Status buttons (row 2)
-                    # builder.row(
-                    #     InlineKeyboardButton(text="✔ Completed", callback_data=f"status_completed_{task_id}"),
-                    #     InlineKeyboardButton(text="⏳ Pending", callback_data=f"status_pending_{task_id}"),
-                    #     InlineKeyboardButton(text="🔧 In Progress", callback_data=f"status_progress_{task_id}")
-                    # )
-
-                    preview = (
-                        # f"🧾 *Task #{task_id}*\n"
-                        f"👤 *{patient}*\n"
-                        f"📍 *{location}*\n"
-                        f"⚠️ *Urgency:* {urgency}\n"
-                        f"📅 *Appointment:* {appointment_date} • {appointment_time}\n"
-                        f"📌 *Status:* {status}"
-                    )
-
-                    await message.answer(
-                        preview, parse_mode="Markdown", reply_markup=builder.as_markup()
-                    )
+        # the whole list is one message; next/prev buttons page through it
+        # in place (see callbacks_router.navigate_tasks_page)
+        text, markup = await build_tasks_page(user_context, command.command.strip())
+        if text is None:
+            await outbound.send(message.chat.id, "You don't have any tasks")
+            return
+
+        await outbound.send(
+            message.chat.id,
+            text,
+            priority=PRIORITY_BULK,
+            parse_mode="HTML",
+            reply_markup=markup,
+        )
 
     except Exception as e:
         print(e)
-        await message.answer(
-            "Error fetching your assigned tasks. Please try again later or contact the admin"
+        await outbound.send(
+            message.chat.id,
+            "Error fetching your assigned tasks. Please try again later or contact the admin",
         )
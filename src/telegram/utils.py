@@ -1,67 +1,394 @@
+import asyncio
 import os
-from cachetools import cached, TTLCache
-import psycopg2
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+import asyncpg
+from cachetools import TTLCache
 
 
 DB_CONFIG = {
-    "dbname": os.getenv("DB"),
+    "database": os.getenv("DB"),
     "user": os.getenv("DB_USER"),
     "password": os.getenv("DB_PASSWORD"),
     "host": os.getenv("DB_HOST", "localhost"),
-    "port": os.getenv("DB_PORT", 5432),
+    "port": int(os.getenv("DB_PORT", 5432)),
+}
+
+# pool sizing; min_size connections are opened up front so the first burst of
+# updates after a restart doesn't pay for the TCP + auth handshakes
+POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+    "max_inactive_connection_lifetime": float(
+        os.getenv("DB_POOL_MAX_IDLE_SECONDS", 300)
+    ),
+    "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", 10)),
+}
+ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 5))
+
+
+_pool: asyncpg.Pool | None = None
+
+pool_stats = {
+    "acquired": 0,
+    "released": 0,
+    "timeouts": 0,
+    "in_use": 0,
+    "peak_in_use": 0,
+    "total_wait_seconds": 0.0,
 }
 
 
-def get_connection():
+async def init_db_pool() -> asyncpg.Pool:
+    """
+    Creates the shared connection pool. Registered as a dispatcher startup hook
+    so every router uses the same bounded set of connections.
+    """
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(**DB_CONFIG, **POOL_CONFIG)
+    return _pool
+
+
+async def close_db_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+@asynccontextmanager
+async def acquire(timeout: float = ACQUIRE_TIMEOUT):
+    """
+    Borrows a connection from the shared pool.
+
+    Raises asyncio.TimeoutError if no connection frees up within `timeout`
+    seconds, so a saturated pool fails fast instead of stalling the handler.
+    """
+    pool = await init_db_pool()
+
+    started = time.perf_counter()
     try:
-        return psycopg2.connect(**DB_CONFIG)
-    except Exception as e:
-        print(e)
+        conn = await pool.acquire(timeout=timeout)
+    except asyncio.TimeoutError:
+        pool_stats["timeouts"] += 1
+        raise
+    finally:
+        pool_stats["total_wait_seconds"] += time.perf_counter() - started
+
+    pool_stats["acquired"] += 1
+    pool_stats["in_use"] += 1
+    pool_stats["peak_in_use"] = max(pool_stats["peak_in_use"], pool_stats["in_use"])
+    try:
+        yield conn
+    finally:
+        pool_stats["in_use"] -= 1
+        pool_stats["released"] += 1
+        await pool.release(conn)
+
+
+async def fetch(query: str, *args) -> list[asyncpg.Record]:
+    async with acquire() as conn:
+        return await conn.fetch(query, *args)
+
+
+async def fetchrow(query: str, *args) -> asyncpg.Record | None:
+    async with acquire() as conn:
+        return await conn.fetchrow(query, *args)
+
+
+async def fetchval(query: str, *args):
+    async with acquire() as conn:
+        return await conn.fetchval(query, *args)
 
 
-def get_user_by_chat_id(chat_id: int) -> str | None:
-    db_conn = get_connection()
+async def execute(query: str, *args) -> str:
+    async with acquire() as conn:
+        return await conn.execute(query, *args)
 
+
+def get_pool_stats() -> dict:
+    """
+    Returns the pool usage counters together with the pool's current size.
+    """
+    stats = dict(pool_stats)
+    if _pool is not None:
+        stats["size"] = _pool.get_size()
+        stats["idle"] = _pool.get_idle_size()
+        stats["min_size"] = _pool.get_min_size()
+        stats["max_size"] = _pool.get_max_size()
+    return stats
+
+
+async def get_user_by_chat_id(chat_id: int) -> str | None:
     try:
-        with db_conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT name FROM users WHERE telegram_chat_id=%s", (chat_id,)
-                )
-                user = cur.fetchone()
-                if user:
-                    return user[0]
-                else:
-                    return None
+        return await fetchval(
+            "SELECT name FROM users WHERE telegram_chat_id=$1", chat_id
+        )
     except Exception as e:
         print(e)
 
 
-test_category_map_cache = TTLCache(maxsize=1, ttl=60 * 5)
+@dataclass(frozen=True)
+class UserContext:
+    """
+    The registered user behind a Telegram account, resolved once per update by
+    the user context middleware and handed to handlers as `user_context`.
+    """
+
+    dkl_code: str
+    user_type: str
+    active: bool
+
+
+# whether one process receives every update (polling, or a single webhook
+# worker). Otherwise an update that should invalidate an in-process cache
+# reaches only one worker, so answers an update can change aren't cached.
+SINGLE_WORKER = (
+    os.getenv("BOT_MODE", "polling") != "webhook"
+    or int(os.getenv("WEBHOOK_WORKERS", 1)) <= 1
+)
+
+user_context_cache = TTLCache(
+    maxsize=1024, ttl=int(os.getenv("USER_CACHE_TTL", 60 * 5))
+)
+unknown_user_cache = TTLCache(
+    maxsize=1024, ttl=int(os.getenv("USER_NEGATIVE_CACHE_TTL", 30))
+)
+
+
+async def get_user_context(chat_id: int) -> UserContext | None:
+    """
+    Returns the UserContext linked to a Telegram chat id, or None if the
+    account isn't registered. Both outcomes are cached, unregistered accounts
+    only with a single worker since registering clears the cache of just the
+    worker that handled it.
+    """
+    if chat_id in user_context_cache:
+        return user_context_cache[chat_id]
+    if chat_id in unknown_user_cache:
+        return None
+
+    user = await fetchrow(
+        """
+        SELECT dkl_code, user_type, active
+        FROM users
+        WHERE telegram_chat_id=$1 AND is_deleted=false
+        """,
+        chat_id,
+    )
+    if user is None:
+        if SINGLE_WORKER:
+            unknown_user_cache[chat_id] = True
+        return None
+
+    user_context = UserContext(
+        dkl_code=user["dkl_code"], user_type=user["user_type"], active=user["active"]
+    )
+    user_context_cache[chat_id] = user_context
+    return user_context
+
+
+def forget_user_context(chat_id: int) -> None:
+    user_context_cache.pop(chat_id, None)
+    unknown_user_cache.pop(chat_id, None)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_cursor(created_at: datetime) -> int:
+    """
+    Encodes a created_at timestamp as whole microseconds since the epoch so a
+    keyset cursor fits in Telegram's 64 byte callback data.
+    """
+    return (created_at - EPOCH) // timedelta(microseconds=1)
+
+
+def from_cursor(cursor: int) -> datetime:
+    return EPOCH + timedelta(microseconds=cursor)
+
+
+async def fetch_tasks_page(
+    dkl_code: str,
+    request_status: str | None,
+    page_size: int,
+    after: tuple[datetime, int] | None = None,
+    before: tuple[datetime, int] | None = None,
+) -> tuple[list[asyncpg.Record], bool]:
+    """
+    Fetches one page of a user's tasks, newest first, using keyset pagination
+    on (created_at, id).
+
+    :param after: (created_at, id) of the last task on the current page; returns
+        the page that follows it.
+    :param before: (created_at, id) of the first task on the current page;
+        returns the page that precedes it.
+    :return: the page of tasks and whether there are more tasks beyond it in the
+        direction of travel.
+    """
+    conditions = ["assign_to=$1"]
+    args = [dkl_code]
+
+    if request_status is not None:
+        args.append(request_status)
+        conditions.append(f"request_status=${len(args)}")
+
+    # the plain created_at bound repeats the row comparison so the planner
+    # can prune the month partitions on the far side of the cursor
+    order = "DESC"
+    if after is not None:
+        args.extend(after)
+        conditions.append(f"(created_at, id) < (${len(args) - 1}, ${len(args)})")
+        conditions.append(f"created_at <= ${len(args) - 1}")
+    elif before is not None:
+        # walk backwards from the top of the current page, then flip the rows
+        args.extend(before)
+        conditions.append(f"(created_at, id) > (${len(args) - 1}, ${len(args)})")
+        conditions.append(f"created_at >= ${len(args) - 1}")
+        order = "ASC"
+
+    args.append(page_size + 1)
+    query = f"""
+        SELECT id, first_name, surname, location, priority,
+               collection_date, collection_time, request_status, created_at
+        FROM requests
+        WHERE {" AND ".join(conditions)}
+        ORDER BY created_at {order}, id {order}
+        LIMIT ${len(args)};
+    """
+    tasks = await fetch(query, *args)
+
+    has_more = len(tasks) > page_size
+    tasks = tasks[:page_size]
+    if order == "ASC":
+        tasks.reverse()
+    return tasks, has_more
+
+
+CATALOG_CHANNEL = "catalog_channel"
+CATALOG_RECONNECT_DELAY = float(os.getenv("CATALOG_RECONNECT_DELAY", 5))
+# the LISTEN connection is pinged after this long without closing, so one that
+# died without the server closing it is noticed and replaced
+CATALOG_PING_INTERVAL = float(os.getenv("CATALOG_PING_INTERVAL", 30))
+CATALOG_PING_TIMEOUT = float(os.getenv("CATALOG_PING_TIMEOUT", 5))
+
+
+class TestCatalog:
+    """
+    In-memory test catalog, code -> (label, category), cached by catalog
+    version (see migrations/0007_catalog_version.sql). `watch()` keeps
+    `latest` current from catalog_channel; the catalog is reloaded only when
+    `latest` moves past the loaded version. While the listener is down,
+    `latest` is None and the version is checked in the database instead.
+    """
+
+    def __init__(self):
+        self.version: int | None = None
+        self.latest: int | None = None
+        self.tests: dict[int, tuple[str, str]] = {}
+        self._lock = asyncio.Lock()
+
+    async def current(self) -> dict[int, tuple[str, str]]:
+        latest = self.latest
+        if latest is None:
+            latest = await fetchval("SELECT version FROM catalog_version")
+        if self.version is not None and self.version >= latest:
+            return self.tests
+
+        async with self._lock:
+            if self.version is None or self.version < latest:
+                await self.load()
+        return self.tests
+
+    async def load(self) -> None:
+        # one statement, so the version matches the rows
+        rows = await fetch("""
+            SELECT
+                (SELECT version FROM catalog_version) AS version,
+                c.code,
+                c.name || ' [' || c.code || ']' AS label,
+                COALESCE(t.category_name, 'Uncategorized') AS category
+            FROM test_catalog c
+            LEFT JOIN tests t ON t.id = c.category_id
+            """)
+        self.tests = {row["code"]: (row["label"], row["category"]) for row in rows}
+        self.version = (
+            rows[0]["version"]
+            if rows
+            else await fetchval("SELECT version FROM catalog_version")
+        )
+
+    def on_change(self, connection, pid, channel, payload) -> None:
+        self.latest = max(self.latest or 0, int(payload))
+
+    async def watch(self) -> None:
+        """
+        Holds a dedicated LISTEN connection on catalog_channel, reconnecting if
+        it drops or stops answering pings. A ping also reads the version, so a
+        missed notification is caught up within CATALOG_PING_INTERVAL.
+        """
+        while True:
+            try:
+                conn = await asyncpg.connect(**DB_CONFIG)
+            except (OSError, asyncpg.PostgresError) as e:
+                print(f"Catalog LISTEN connection failed: {e}")
+                await asyncio.sleep(CATALOG_RECONNECT_DELAY)
+                continue
+
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda connection: closed.set())
+            try:
+                await conn.add_listener(CATALOG_CHANNEL, self.on_change)
+                self.latest = await conn.fetchval("SELECT version FROM catalog_version")
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), CATALOG_PING_INTERVAL)
+                    except asyncio.TimeoutError:
+                        version = await conn.fetchval(
+                            "SELECT version FROM catalog_version",
+                            timeout=CATALOG_PING_TIMEOUT,
+                        )
+                        self.latest = max(self.latest or 0, version)
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                print(f"Catalog LISTEN failed: {e!r}")
+            finally:
+                self.latest = None
+                # not close(), which would wait on a connection that may be dead
+                conn.terminate()
+            await asyncio.sleep(CATALOG_RECONNECT_DELAY)
 
 
-@cached(cache=test_category_map_cache)
-def fetch_categories_and_tests():
-    with get_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT category_name, available_tests FROM tests")
-            categories_tests = cur.fetchall()
+test_catalog = TestCatalog()
+_catalog_watcher: asyncio.Task | None = None
 
-    test_category_map = {}
-    for row in categories_tests:
-        category = row[0]
-        for test in row[1]:
-            test_category_map[test] = category
 
-    return test_category_map
+async def start_catalog_watcher() -> None:
+    global _catalog_watcher
+    if _catalog_watcher is None:
+        _catalog_watcher = asyncio.create_task(test_catalog.watch())
 
 
-def categorize_selected_tests(selected_tests):
-    test_category_map = fetch_categories_and_tests()
+async def stop_catalog_watcher() -> None:
+    global _catalog_watcher
+    if _catalog_watcher is not None:
+        _catalog_watcher.cancel()
+        _catalog_watcher = None
 
-    categorized = {}
-    for test in selected_tests:
-        category = test_category_map.get(test, "Uncategorized")
-        categorized.setdefault(category, []).append(test)
 
+async def categorize_tests(test_codes: list[int]) -> dict[str, list[str]]:
+    """
+    Groups a request's test codes by category, keeping the order they were
+    picked in, resolved against the cached test catalog. Codes missing from
+    the catalog are listed as-is under "Uncategorized", so nothing that was
+    ordered is hidden.
+    """
+    tests = await test_catalog.current()
+    categorized: dict[str, list[str]] = {}
+    for code in test_codes:
+        label, category = tests.get(code, (str(code), "Uncategorized"))
+        categorized.setdefault(category, []).append(label)
     return categorized
@@ -0,0 +1,144 @@
+"""
+Compares the memory cost of open Streamlit sessions under the old and the new
+DuckDB setup.
+
+    per-session   every session opens its own duckdb.connect() and leaves the
+                  DataFrames it registered behind (the old app.py / users.py)
+    shared        one engine for the process with the app's memory and thread
+                  caps, a cursor per session, views unregistered after use
+                  (utils.duck_engine)
+
+Each simulated session does what an admin tab does with DuckDB: diffs a users
+table the size of USERS_ROWS (what the Users page's edit check did) and runs the
+dashboard's aggregations over a Parquet snapshot of SNAPSHOT_ROWS requests.
+Sessions are kept open, like browser tabs nobody closes. Each mode runs in a
+fresh interpreter and reports the process's resident memory afterwards.
+
+No database is needed; the data is generated.
+
+Usage:
+    python duckdb_memory_benchmark.py [SESSIONS] [SNAPSHOT_ROWS]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import duckdb
+import pandas as pd
+
+SESSIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+SNAPSHOT_ROWS = int(sys.argv[2]) if len(sys.argv) > 2 else 500_000
+USERS_ROWS = 2_000
+
+# same defaults as src/streamlit/utils.py
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "256MB")
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", 2))
+
+
+DASHBOARD_QUERY = """
+    SELECT request_status, created_at::DATE AS day, count(*)
+    FROM read_parquet('{snapshot}/*/*.parquet', hive_partitioning = true)
+    GROUP BY ALL
+"""
+
+USERS_DIFF_QUERY = """
+    SELECT m.dkl_code FROM modified m
+    INNER JOIN original o ON m.dkl_code = o.dkl_code
+    WHERE m.name != o.name
+"""
+
+
+def rss_mb() -> float:
+    """Current resident memory of this process (Linux), in MB."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def write_snapshot(path: str) -> None:
+    duckdb.execute(f"""
+        COPY (
+            SELECT
+                i AS id,
+                TIMESTAMP '2024-01-01' + i * INTERVAL '1 minute' AS created_at,
+                (['pending', 'in-progress', 'completed', 'cancelled'])[i % 4 + 1] AS request_status,
+                [i % 97, i % 89 + 100] AS test_codes,
+                strftime(TIMESTAMP '2024-01-01' + i * INTERVAL '1 minute', '%Y-%m') AS month
+            FROM range({SNAPSHOT_ROWS}) AS t(i)
+        ) TO '{path}' (FORMAT PARQUET, PARTITION_BY (month));
+        """)
+
+
+def users_frames() -> tuple[pd.DataFrame, pd.DataFrame]:
+    original = pd.DataFrame(
+        {
+            "dkl_code": [f"DKL{n}" for n in range(USERS_ROWS)],
+            "name": [f"User {n}" for n in range(USERS_ROWS)],
+        }
+    )
+    modified = original.copy()
+    modified.loc[::50, "name"] = "Renamed"
+    return original, modified
+
+
+def run_mode(mode: str, snapshot: str) -> None:
+    baseline = rss_mb()
+    started = time.perf_counter()
+    sessions = []
+
+    engine = None
+    if mode == "shared":
+        engine = duckdb.connect(
+            config={"memory_limit": DUCKDB_MEMORY_LIMIT, "threads": DUCKDB_THREADS}
+        )
+
+    for _ in range(SESSIONS):
+        original, modified = users_frames()
+        duck_conn = engine.cursor() if engine else duckdb.connect()
+        duck_conn.register("original", original)
+        duck_conn.register("modified", modified)
+        duck_conn.sql(USERS_DIFF_QUERY).fetchall()
+        if engine:
+            duck_conn.unregister("original")
+            duck_conn.unregister("modified")
+        duck_conn.execute(DASHBOARD_QUERY.format(snapshot=snapshot)).df()
+        sessions.append(duck_conn)
+
+    print(
+        f"{mode:<12} {SESSIONS} sessions: "
+        f"{rss_mb() - baseline:8.1f} MB resident above baseline, "
+        f"{time.perf_counter() - started:6.2f}s"
+    )
+
+
+def main() -> None:
+    if len(sys.argv) > 3:
+        run_mode(sys.argv[3], sys.argv[4])
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = os.path.join(tmp, "requests")
+        write_snapshot(snapshot)
+        print(f"Snapshot of {SNAPSHOT_ROWS:,} requests written")
+
+        for mode in ("per-session", "shared"):
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    str(SESSIONS),
+                    str(SNAPSHOT_ROWS),
+                    mode,
+                    snapshot,
+                ],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
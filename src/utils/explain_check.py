@@ -0,0 +1,235 @@
+"""
+Checks that every hot request query is served by an index at scale.
+
+Seeds ROWS requests (one million by default) for a few hundred phlebotomists,
+ANALYZEs, then EXPLAINs each hot query and fails if its plan doesn't use one
+of the expected indexes (see the migrations). Indexes on the month partitions
+count as their parent index. Everything runs inside one transaction that is
+rolled back, so it is safe to point at a development database that has the
+schema and migrations applied.
+
+Usage:
+    python explain_check.py [ROWS]
+"""
+
+import json
+import sys
+from datetime import timedelta
+
+from migrate import connect
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+ASSIGNEES = 300
+PAGE_SIZE = 6
+
+
+SEED_USERS = """
+    INSERT INTO users (dkl_code, name, email, user_type)
+    SELECT 'explain' || n, 'Explain ' || n, 'explain' || n || '@example.com', 'phlebotomist'
+    FROM generate_series(1, %(assignees)s) AS n;
+"""
+
+SEED_PARTITIONS = """
+    SELECT create_requests_partition(month::DATE)
+    FROM generate_series(
+        TIMESTAMP '2023-01-01',
+        TIMESTAMP '2023-01-01' + %(rows)s * INTERVAL '1 minute',
+        INTERVAL '1 month'
+    ) AS month;
+"""
+
+# created_at increases with the physical row order, like real inserts do
+SEED_REQUESTS = """
+    INSERT INTO requests (
+        first_name, surname, test_codes, assign_to, priority,
+        request_status, created_at
+    )
+    SELECT
+        'First' || n,
+        'Last' || n,
+        ARRAY[n %% 97, n %% 89 + 100],
+        'explain' || (n %% %(assignees)s + 1),
+        CASE WHEN n %% 10 = 0 THEN 'Urgent' ELSE 'Routine' END,
+        (ARRAY['pending', 'in-progress', 'completed', 'cancelled'])[n %% 4 + 1],
+        TIMESTAMP '2023-01-01' + n * INTERVAL '1 minute'
+    FROM generate_series(1, %(rows)s) AS n;
+"""
+
+
+# (description, query, indexes any of which the plan must use)
+HOT_QUERIES = [
+    (
+        "bot task list filtered by status",
+        """
+        SELECT id, first_name, surname, created_at FROM requests
+        WHERE assign_to=%(assignee)s AND request_status='pending'
+        ORDER BY created_at DESC, id DESC LIMIT %(page)s
+        """,
+        {"requests_assign_to_status_created_idx"},
+    ),
+    (
+        "bot task list, next page",
+        """
+        SELECT id, first_name, surname, created_at FROM requests
+        WHERE assign_to=%(assignee)s AND request_status='pending'
+          AND (created_at, id) < (%(cursor)s, %(cursor_id)s)
+        ORDER BY created_at DESC, id DESC LIMIT %(page)s
+        """,
+        {"requests_assign_to_status_created_idx"},
+    ),
+    (
+        "bot /all_tasks list",
+        """
+        SELECT id, first_name, surname, created_at FROM requests
+        WHERE assign_to=%(assignee)s
+        ORDER BY created_at DESC, id DESC LIMIT %(page)s
+        """,
+        {"requests_assign_to_created_idx"},
+    ),
+    (
+        "task details / status update",
+        """
+        SELECT * FROM requests
+        WHERE id=%(task_id)s AND assign_to=%(assignee)s AND created_at=%(cursor)s
+        """,
+        {"requests_pkey"},
+    ),
+    (
+        "phlebotomist tasks page",
+        """
+        SELECT r.* FROM requests r
+        INNER JOIN users u ON u.dkl_code = r.assign_to
+        WHERE u.email=%(email)s
+        """,
+        {"requests_assign_to_created_idx", "requests_assign_to_status_created_idx"},
+    ),
+    (
+        "lab requests board",
+        "SELECT * FROM requests ORDER BY created_at DESC, id DESC LIMIT 50",
+        {"requests_created_idx"},
+    ),
+    (
+        "dashboard weekly range",
+        """
+        SELECT count(*) FROM requests
+        WHERE created_at >= %(week_start)s
+        """,
+        {"requests_created_idx", "requests_created_at_brin"},
+    ),
+    (
+        "dashboard monthly range",
+        """
+        SELECT request_status, count(*) FROM requests
+        WHERE created_at >= %(month_start)s AND created_at < %(month_end)s
+        GROUP BY request_status
+        """,
+        {"requests_created_idx", "requests_created_at_brin"},
+    ),
+    (
+        "requests including a test",
+        "SELECT id FROM requests WHERE test_codes @> ARRAY[5]",
+        {"requests_test_codes_gin"},
+    ),
+]
+
+
+def plan_indexes(plan: dict) -> set[str]:
+    """Collects every index name referenced anywhere in an EXPLAIN JSON plan."""
+    indexes = set()
+    if "Index Name" in plan:
+        indexes.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        indexes |= plan_indexes(child)
+    return indexes
+
+
+def plan_partitions(plan: dict) -> set[str]:
+    """Collects every table scanned anywhere in an EXPLAIN JSON plan."""
+    tables = set()
+    if "Relation Name" in plan:
+        tables.add(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables |= plan_partitions(child)
+    return tables
+
+
+def root_indexes(cur, indexes: set[str]) -> set[str]:
+    """Maps partition indexes to the partitioned index they were created from."""
+    if not indexes:
+        return set()
+    cur.execute(
+        "SELECT pg_partition_root(name::regclass)::text FROM unnest(%s) AS name;",
+        (list(indexes),),
+    )
+    return {row[0] for row in cur.fetchall() if row[0]} | indexes
+
+
+def main() -> None:
+    conn = connect()
+    failed = 0
+    try:
+        with conn.cursor() as cur:
+            # the seed shouldn't notify anyone or fill the outbox
+            cur.execute("ALTER TABLE requests DISABLE TRIGGER USER;")
+
+            print(f"Seeding {ROWS:,} requests...")
+            cur.execute(SEED_PARTITIONS, {"rows": ROWS})
+            cur.execute(SEED_USERS, {"assignees": ASSIGNEES})
+            cur.execute(SEED_REQUESTS, {"assignees": ASSIGNEES, "rows": ROWS})
+            cur.execute("ANALYZE users;")
+            cur.execute("ANALYZE requests;")
+
+            cur.execute(
+                """
+                SELECT id, created_at FROM requests
+                WHERE assign_to='explain1' AND request_status='pending'
+                ORDER BY created_at DESC, id DESC OFFSET %s LIMIT 1
+                """,
+                (PAGE_SIZE,),
+            )
+            cursor_id, cursor = cur.fetchone()
+            cur.execute("SELECT max(created_at) FROM requests;")
+            newest = cur.fetchone()[0]
+
+            params = {
+                "assignee": "explain1",
+                "email": "explain1@example.com",
+                "page": PAGE_SIZE + 1,
+                "cursor": cursor,
+                "cursor_id": cursor_id,
+                "task_id": cursor_id,
+                "week_start": newest - timedelta(days=7),
+                "month_start": newest - timedelta(days=60),
+                "month_end": newest - timedelta(days=30),
+            }
+
+            for description, query, expected in HOT_QUERIES:
+                cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+                plan = cur.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                used = root_indexes(cur, plan_indexes(plan[0]["Plan"]))
+                partitions = len(plan_partitions(plan[0]["Plan"]))
+
+                if used & expected:
+                    print(
+                        f"ok    {description}: {', '.join(sorted(used & expected))} "
+                        f"({partitions} partition(s))"
+                    )
+                else:
+                    failed += 1
+                    print(
+                        f"FAIL  {description}: expected one of {sorted(expected)}, "
+                        f"plan used {sorted(used) or 'no index'}"
+                    )
+    finally:
+        conn.rollback()
+        conn.close()
+
+    if failed:
+        sys.exit(f"{failed} hot quer{'y' if failed == 1 else 'ies'} not using an index")
+    print("All hot queries use their indexes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,346 @@
-import os
-import select
-import requests
-import psycopg2
+import asyncio
 import json
+import os
+import sys
+import time
+from pathlib import Path
 
+import asyncpg
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+# the db pool and the rate limited send queue are shared with the bot
+sys.path.append(str(Path(__file__).resolve().parents[1] / "telegram"))
+import utils
+from outbound import OutboundQueue, PRIORITY_NORMAL, PRIORITY_URGENT
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+CHANNEL = "new_requests_channel"
+DIRECTORY_CHANNEL = "users_directory_channel"
+
+# how many outbox rows are claimed at a time; they are all sent concurrently
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 50))
+# a claimed row is left alone by other notifiers for this long
+LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", 120))
+# retries back off exponentially from RETRY_BASE_SECONDS, and a row goes to
+# 'dead' after MAX_ATTEMPTS
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", 10))
+# drained even without a NOTIFY, to pick up retries and missed wake-ups
+POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 15))
+RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", 30))
+# keep-alive connections to api.telegram.org
+HTTP_CONNECTIONS = int(os.getenv("NOTIFIER_HTTP_CONNECTIONS", 10))
+STATS_INTERVAL = float(os.getenv("NOTIFIER_STATS_INTERVAL", 60))
+RECONNECT_DELAY = float(os.getenv("NOTIFIER_RECONNECT_DELAY", 5))
+
+
+stats = {
+    "claimed": 0,
+    "sent": 0,
+    "not_linked": 0,
+    "retried": 0,
+    "dead": 0,
+    "total_latency_seconds": 0.0,
+    "max_latency_seconds": 0.0,
+}
+
+
+class ChatDirectory:
+    """
+    In-memory dkl_code -> telegram_chat_id map, loaded once per LISTEN
+    connection and kept current from users_directory_channel (see
+    migrations/0000_bot_notifications.sql), so delivering a notification needs
+    no query.
+
+    Changes that arrive while the snapshot is loading are held back and
+    replayed on top of it; payloads carry the full new mapping, so replaying
+    one that the snapshot already includes is harmless.
+    """
+
+    def __init__(self):
+        self.chat_ids: dict[str, int] = {}
+        self.loaded = False
+        self.ready = asyncio.Event()
+        self._pending: list[dict] = []
+
+    async def load(self, conn: asyncpg.Connection) -> None:
+        self.loaded = False
+        rows = await conn.fetch(
+            "SELECT dkl_code, telegram_chat_id FROM users WHERE telegram_chat_id IS NOT NULL"
+        )
+        self.chat_ids = {row["dkl_code"]: row["telegram_chat_id"] for row in rows}
+        self.loaded = True
+
+        pending, self._pending = self._pending, []
+        for change in pending:
+            self.apply(change)
+        self.ready.set()
+        print(f"Loaded {len(self.chat_ids)} linked Telegram accounts")
+
+    def on_change(self, connection, pid, channel, payload) -> None:
+        change = json.loads(payload)
+        if not self.loaded:
+            self._pending.append(change)
+            return
+        self.apply(change)
+
+    def apply(self, change: dict) -> None:
+        if change.get("old_dkl_code"):
+            self.chat_ids.pop(change["old_dkl_code"], None)
+
+        dkl_code = change.get("dkl_code")
+        if not dkl_code:
+            return
+        if change.get("telegram_chat_id"):
+            self.chat_ids[dkl_code] = change["telegram_chat_id"]
+        else:
+            self.chat_ids.pop(dkl_code, None)
+
+    def get(self, dkl_code: str) -> int | None:
+        return self.chat_ids.get(dkl_code)
+
+
+directory = ChatDirectory()
+
+
+# task ids listed in a coalesced message before it is cut short
+MAX_LISTED_TASKS = 20
+
+
+def new_request_message(request_ids: list[int], urgent: int) -> str:
+    if len(request_ids) == 1:
+        return f"""
+        New Request Assigned.
+        \nTask ID: {request_ids[0]}
+        \nPriority: {"Urgent" if urgent else "Routine"}
+    """
+
+    task_ids = ", ".join(str(task_id) for task_id in request_ids[:MAX_LISTED_TASKS])
+    if len(request_ids) > MAX_LISTED_TASKS:
+        task_ids += f" and {len(request_ids) - MAX_LISTED_TASKS} more"
+    return f"""
+        You have {len(request_ids)} new requests ({urgent} urgent).
+        \nTask IDs: {task_ids}
+    """
+
+
+# Telegram errors that won't go away by retrying
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+CLAIM_QUERY = """
+    UPDATE notification_outbox
+    SET locked_until = now() + make_interval(secs => $2), attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM notification_outbox
+        WHERE status = 'pending'
+          AND next_attempt_at <= now()
+          AND (locked_until IS NULL OR locked_until < now())
+        ORDER BY (urgent > 0) DESC, id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, assign_to, request_ids, urgent, attempts,
+              extract(epoch FROM now()::timestamp - created_at) AS queued_seconds;
+"""
+
+
+async def claim_batch() -> list[asyncpg.Record]:
+    """
+    Leases up to BATCH_SIZE due rows. The lease is committed straight away,
+    so other notifiers skip these rows while they are being sent, and they
+    become claimable again if this process dies mid-batch.
+    """
+    return await utils.fetch(CLAIM_QUERY, BATCH_SIZE, LEASE_SECONDS)
+
 
+async def deliver(
+    row: asyncpg.Record, claimed_at: float, outbound: OutboundQueue
+) -> None:
+    chat_id = directory.get(row["assign_to"])
+    if not chat_id:
+        stats["not_linked"] += 1
+        print(f"{row['assign_to']} has not linked their Telegram account")
+        await utils.execute(
+            "UPDATE notification_outbox SET status='skipped', locked_until=NULL WHERE id=$1",
+            row["id"],
+        )
+        return
 
-def send_tg_new_request_message(chat_id: int, message: str) -> None:
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    requests.post(url, data={"chat_id": chat_id, "text": message})
-
-
-conn = psycopg2.connect(
-    dbname=os.getenv("DB"),
-    user=os.getenv("DB_USER"),
-    password=os.getenv("DB_PASSWORD"),
-    host=os.getenv("DB_HOST"),
-    port=os.getenv("DB_PORT"),
-)
-conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-cur = conn.cursor()
-cur.execute("LISTEN new_requests_channel;")
-print("Waiting for notifications on channel 'new_requests_channel'...")
-
-
-while True:
-    # wait for notifications
-    # if nothing changes, loop again
-    if select.select([conn], [], [], 5) == ([], [], []):
-        continue
-    else:
-        conn.poll()
-        while conn.notifies:
-            notify = conn.notifies.pop(0)
-            payload = json.loads(notify.payload)
-            print(payload)
-
-            # get notification details
-            task_id = payload.get("task_id")
-            priority = payload.get("priority")
-            assigned_to = payload.get("assigned_to")
-
-            # find assigned user's telegram chat id
-            cur.execute(
+    try:
+        await outbound.send(
+            chat_id,
+            new_request_message(row["request_ids"], row["urgent"]),
+            PRIORITY_URGENT if row["urgent"] else PRIORITY_NORMAL,
+        )
+
+    except Exception as e:
+        if isinstance(e, PERMANENT_ERRORS) or row["attempts"] >= MAX_ATTEMPTS:
+            stats["dead"] += 1
+            print(f"Giving up on outbox row {row['id']}: {e}")
+            await utils.execute(
+                """
+                UPDATE notification_outbox
+                SET status='dead', locked_until=NULL, last_error=$2
+                WHERE id=$1
+                """,
+                row["id"],
+                str(e),
+            )
+        else:
+            stats["retried"] += 1
+            backoff = RETRY_BASE_SECONDS * 2 ** (row["attempts"] - 1)
+            await utils.execute(
                 """
-                SELECT telegram_chat_id 
-                FROM users 
-                WHERE dkl_code=%s
+                UPDATE notification_outbox
+                SET locked_until=NULL, last_error=$2,
+                    next_attempt_at=now() + make_interval(secs => $3)
+                WHERE id=$1
                 """,
-                (assigned_to,),
+                row["id"],
+                str(e),
+                backoff,
             )
-            tg_chat_id = cur.fetchone()
-            if not tg_chat_id:
-                print("Assigned phlebotomist has not linked their Telegram account")
-            else:
-                chat_id = tg_chat_id[0]
-                message = f"""
-                    New Request Assigned. 
-                    \nTask ID: {task_id}
-                    \nPriority: {priority}
+        return
+
+    await utils.execute(
+        """
+        UPDATE notification_outbox
+        SET status='delivered', delivered_at=now(), locked_until=NULL, last_error=NULL
+        WHERE id=$1
+        """,
+        row["id"],
+    )
+
+    # measured from when the request was committed, so time spent waiting in
+    # the outbox (e.g. while no notifier was running) shows up here
+    latency = float(row["queued_seconds"]) + time.perf_counter() - claimed_at
+    stats["sent"] += 1
+    stats["total_latency_seconds"] += latency
+    stats["max_latency_seconds"] = max(stats["max_latency_seconds"], latency)
+
+
+async def drain(outbound: OutboundQueue, wakeup: asyncio.Event) -> None:
+    """
+    Claims and sends due outbox rows until none are left, then sleeps until a
+    NOTIFY wakes it up or POLL_INTERVAL passes.
+    """
+    # rows for unlinked accounts are skipped, so wait for the directory
+    await directory.ready.wait()
+
+    while True:
+        wakeup.clear()
+        try:
+            while rows := await claim_batch():
+                claimed_at = time.perf_counter()
+                stats["claimed"] += len(rows)
+                await asyncio.gather(
+                    *(deliver(row, claimed_at, outbound) for row in rows)
+                )
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            print(f"Outbox drain failed: {e}")
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def prune_outbox() -> None:
+    while True:
+        try:
+            await utils.execute(
                 """
-                send_tg_new_request_message(chat_id, message)
+                DELETE FROM notification_outbox
+                WHERE status IN ('delivered', 'skipped')
+                  AND created_at < now() - make_interval(days => $1)
+                """,
+                RETENTION_DAYS,
+            )
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            print(e)
+        await asyncio.sleep(60 * 60)
+
+
+async def report_stats(outbound: OutboundQueue) -> None:
+    started = time.perf_counter()
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        elapsed = time.perf_counter() - started
+        avg_latency = stats["total_latency_seconds"] / max(stats["sent"], 1)
+        print(
+            f"[notifier] claimed={stats['claimed']} sent={stats['sent']} "
+            f"not_linked={stats['not_linked']} retried={stats['retried']} "
+            f"dead={stats['dead']} "
+            f"throughput={stats['sent'] / elapsed:.2f}/s "
+            f"latency_avg={avg_latency:.3f}s latency_max={stats['max_latency_seconds']:.3f}s "
+            f"directory={len(directory.chat_ids)} outbound={outbound.stats}"
+        )
+
+
+async def listen(wakeup: asyncio.Event) -> None:
+    """
+    Holds a dedicated LISTEN connection (pooled connections can't keep a
+    LISTEN registered). New request notifications only wake the outbox
+    drain up. Reconnects if the connection drops, reloading the chat
+    directory since changes may have been missed in between.
+    """
+
+    def on_notification(connection, pid, channel, payload):
+        wakeup.set()
+
+    while True:
+        try:
+            conn = await asyncpg.connect(**utils.DB_CONFIG)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"LISTEN connection failed: {e}")
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+
+        closed = asyncio.Event()
+        conn.add_termination_listener(lambda connection: closed.set())
+        try:
+            # listen before loading so no directory change slips in between
+            await conn.add_listener(DIRECTORY_CHANNEL, directory.on_change)
+            await directory.load(conn)
+            await conn.add_listener(CHANNEL, on_notification)
+        except (OSError, asyncpg.PostgresError) as e:
+            print(f"LISTEN setup failed: {e}")
+            await conn.close()
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+        print(f"Waiting for notifications on channel '{CHANNEL}'...")
+
+        await closed.wait()
+        print("LISTEN connection lost, reconnecting")
+        await asyncio.sleep(RECONNECT_DELAY)
+        # catch up on anything committed while we weren't listening
+        wakeup.set()
+
+
+async def main() -> None:
+    await utils.init_db_pool()
+
+    # one aiohttp session for the whole process so sends reuse keep-alive
+    # connections instead of opening a new one per message
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(limit=HTTP_CONNECTIONS))
+    outbound = OutboundQueue(bot)
+    await outbound.start()
+
+    wakeup = asyncio.Event()
+    try:
+        await asyncio.gather(
+            listen(wakeup),
+            drain(outbound, wakeup),
+            prune_outbox(),
+            report_stats(outbound),
+        )
+    finally:
+        await outbound.stop()
+        await bot.session.close()
+        await utils.close_db_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
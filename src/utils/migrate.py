@@ -0,0 +1,136 @@
+"""
+Applies the versioned SQL migrations in src/utils/migrations.
+
+Migrations are named NNNN_description.sql and applied in version order, each
+one exactly once; applied versions are recorded in schema_migrations. A
+migration normally runs in a single transaction. One that starts with the line
+`-- migrate: no-transaction` (e.g. CREATE INDEX CONCURRENTLY) runs statement by
+statement in autocommit mode instead. If such a migration fails half way, it
+is not recorded and can simply be run again; drop any INVALID index it left
+behind first.
+
+Usage:
+    python migrate.py            apply pending migrations
+    python migrate.py --status   list migrations and whether they are applied
+"""
+
+import os
+import re
+import sys
+from pathlib import Path
+
+import psycopg2
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+# any constant works, it only has to be the same for every runner
+MIGRATION_LOCK_ID = 726_001
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DB"),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+    )
+
+
+def discover_migrations() -> list[tuple[int, str, Path]]:
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        match = re.match(r"(\d+)_(.+)\.sql$", path.name)
+        if not match:
+            continue
+        migrations.append((int(match.group(1)), match.group(2), path))
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise SystemExit("Duplicate migration version in " + str(MIGRATIONS_DIR))
+    return migrations
+
+
+def split_statements(sql: str) -> list[str]:
+    """
+    Splits a no-transaction migration into statements. Only meant for plain
+    DDL; don't put dollar-quoted function bodies in such a migration.
+    """
+    sql = re.sub(r"--[^\n]*", "", sql)
+    return [statement.strip() for statement in sql.split(";") if statement.strip()]
+
+
+def applied_versions(cur) -> set[int]:
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+    cur.execute("SELECT version FROM schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def apply_migration(conn, version: int, name: str, path: Path) -> None:
+    sql = path.read_text()
+    record = "INSERT INTO schema_migrations (version, name) VALUES (%s, %s);"
+
+    if sql.lstrip().startswith(NO_TRANSACTION):
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for statement in split_statements(sql):
+                cur.execute(statement)
+            cur.execute(record, (version, name))
+        return
+
+    conn.autocommit = False
+    with conn.cursor() as cur:
+        cur.execute(sql)
+        cur.execute(record, (version, name))
+    conn.commit()
+
+
+def main() -> None:
+    conn = connect()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        # only one runner at a time, e.g. when several services start together
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_ID,))
+        applied = applied_versions(cur)
+
+    try:
+        migrations = discover_migrations()
+
+        if "--status" in sys.argv:
+            for version, name, _ in migrations:
+                state = "applied" if version in applied else "pending"
+                print(f"{version:04d} {name}: {state}")
+            return
+
+        pending = [m for m in migrations if m[0] not in applied]
+        if not pending:
+            print("Database is up to date")
+            return
+
+        for version, name, path in pending:
+            print(f"Applying {version:04d} {name}...")
+            try:
+                apply_migration(conn, version, name, path)
+            except psycopg2.Error as e:
+                if not conn.autocommit:
+                    conn.rollback()
+                print(f"Migration {version:04d} failed: {e}")
+                sys.exit(1)
+        print(f"Applied {len(pending)} migration(s)")
+
+    finally:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_ID,))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+-- The bot's notification schema: the processed update log, the assignment
+-- outbox with the trigger that fills it, and the user directory trigger.
+--
+-- Version 0 so it runs before 0004 on a new database: 0004 recreates
+-- new_lab_request on the partitioned table and needs notify_new_request() and
+-- notification_outbox to exist. This migration was added after 0001-0010, so
+-- on a database where those were already applied it runs last. Such
+-- databases got these objects by hand, so every statement here is safe to
+-- run again over them, including recreating new_lab_request on the
+-- partitioned table.
+
+
+-- update_ids claimed by the webhook workers, used to drop redelivered updates.
+-- done is set once the update was handled; an update that isn't done is
+-- in progress, or was claimed by a worker that died, until the claim lapses.
+-- Rows older than a couple of days are pruned by the workers themselves.
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id BIGINT PRIMARY KEY,
+    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    done BOOLEAN NOT NULL DEFAULT false
+);
+
+ALTER TABLE processed_updates ADD COLUMN IF NOT EXISTS done BOOLEAN NOT NULL DEFAULT false;
+
+CREATE INDEX IF NOT EXISTS processed_updates_received_at_idx ON processed_updates (received_at);
+
+-- Transactional outbox for assignment notifications. notify_new_request()
+-- (below) writes one row per assignee per INSERT statement, in the same
+-- transaction as the requests, and live_updates.py drains the table, so
+-- notifications survive notifier restarts and several notifier instances can
+-- share the work.
+--
+-- status:
+--     pending   - waiting to be sent (or retried after next_attempt_at)
+--     delivered - sent to the assignee's Telegram chat
+--     skipped   - the assignee has not linked a Telegram account
+--     dead      - failed permanently or ran out of attempts, see last_error
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    assign_to VARCHAR NOT NULL,
+    request_ids INTEGER[] NOT NULL,
+    urgent INTEGER DEFAULT 0,
+    status VARCHAR(20)
+        CHECK (status IN ('pending', 'delivered', 'skipped', 'dead'))
+        DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP
+);
+
+-- the drain query only ever looks at pending rows
+CREATE INDEX IF NOT EXISTS notification_outbox_pending_idx
+ON notification_outbox (next_attempt_at, id)
+WHERE status = 'pending';
+
+-- Queues assignment notifications in notification_outbox as part of the
+-- inserting transaction: one row per assignee per INSERT statement, so a bulk
+-- load produces one message per phlebotomist rather than one per request.
+-- The NOTIFY only wakes the notifier up; if nobody is listening the rows wait
+-- in the outbox until one starts.
+CREATE OR REPLACE  FUNCTION notify_new_request()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO notification_outbox (assign_to, request_ids, urgent)
+    SELECT
+        assign_to,
+        array_agg(id ORDER BY id),
+        count(*) FILTER (WHERE priority = 'Urgent')
+    FROM new_requests
+    GROUP BY assign_to;
+
+    IF FOUND THEN
+        PERFORM pg_notify('new_requests_channel', '');
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS new_lab_request ON requests;
+
+CREATE TRIGGER new_lab_request
+AFTER INSERT ON requests
+REFERENCING NEW TABLE AS new_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_new_request();
+
+-- Tells the notifier (live_updates.py) when a user's dkl_code -> telegram_chat_id
+-- mapping changes, so it can keep its in-memory directory current.
+CREATE OR REPLACE FUNCTION notify_user_directory_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    payload JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        payload = json_build_object(
+            'op', TG_OP,
+            'old_dkl_code', OLD.dkl_code,
+            'dkl_code', NULL,
+            'telegram_chat_id', NULL
+        );
+    ELSE
+        payload = json_build_object(
+            'op', TG_OP,
+            'old_dkl_code', CASE WHEN TG_OP = 'UPDATE' THEN OLD.dkl_code END,
+            'dkl_code', NEW.dkl_code,
+            'telegram_chat_id', NEW.telegram_chat_id
+        );
+    END IF;
+    PERFORM pg_notify('users_directory_channel', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS user_directory_insert_delete ON users;
+
+CREATE TRIGGER user_directory_insert_delete
+AFTER INSERT OR DELETE ON users
+FOR EACH ROW
+EXECUTE FUNCTION notify_user_directory_change();
+
+DROP TRIGGER IF EXISTS user_directory_update ON users;
+
+CREATE TRIGGER user_directory_update
+AFTER UPDATE OF dkl_code, telegram_chat_id ON users
+FOR EACH ROW
+WHEN (OLD.dkl_code IS DISTINCT FROM NEW.dkl_code
+      OR OLD.telegram_chat_id IS DISTINCT FROM NEW.telegram_chat_id)
+EXECUTE FUNCTION notify_user_directory_change();
@@ -0,0 +1,29 @@
+-- migrate: no-transaction
+-- Indexes for the hot request queries. Built CONCURRENTLY so applying them
+-- doesn't block inserts on a live table (which is also why this migration
+-- runs outside a transaction).
+--
+-- update_task_status / show_task_details filter on id + assign_to; the primary
+-- key already pins the row, so they need nothing extra.
+
+-- bot task lists filtered by status (/pending, /in_progress, ...) with keyset
+-- pagination on (created_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_assign_to_status_created_idx
+ON requests (assign_to, request_status, created_at DESC, id DESC);
+
+-- bot /all_tasks list and the phlebotomist tasks page
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_assign_to_created_idx
+ON requests (assign_to, created_at DESC, id DESC);
+
+-- lab requests board, newest first
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_created_idx
+ON requests (created_at DESC, id DESC);
+
+-- dashboard date-range scans; rows are inserted in created_at order so a BRIN
+-- index stays tiny and lets big range aggregates skip most of the table
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_created_at_brin
+ON requests USING BRIN (created_at);
+
+-- "which requests include test X" lookups
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_selected_tests_gin
+ON requests USING GIN (selected_tests);
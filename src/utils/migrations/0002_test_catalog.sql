@@ -0,0 +1,159 @@
+-- Normalized test catalog: one row per test, keyed by the lab's integer test
+-- code (the number in "PSA (Total) [4304]"). Requests reference tests by code
+-- in requests.test_codes instead of copying the display strings, so renaming a
+-- test or moving it to another category doesn't orphan historical requests.
+--
+-- tests.available_tests stays the editing surface for the Tests admin page;
+-- a trigger keeps test_catalog in step with it. A test removed from its
+-- category is marked retired rather than deleted, so old requests still
+-- resolve it.
+
+CREATE TABLE test_catalog (
+    code INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    category_id INTEGER REFERENCES tests(id) ON DELETE SET NULL,
+    retired BOOLEAN DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX test_catalog_category_idx ON test_catalog (category_id);
+
+
+-- "PSA (Total) [4304]" -> (4304, 'PSA (Total)'); NULL if there's no code,
+-- which sync_test_catalog() refuses
+CREATE OR REPLACE FUNCTION parse_test_label(label TEXT, OUT code INTEGER, OUT name TEXT)
+AS $$
+    SELECT m[2]::INTEGER, m[1]
+    FROM regexp_match(label, '^\s*(.*?)\s*\[(\d+)\]\s*$') AS m;
+$$ LANGUAGE sql IMMUTABLE;
+
+
+CREATE OR REPLACE FUNCTION sync_test_catalog()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        -- the foreign key has already cleared category_id by now
+        UPDATE test_catalog c
+        SET retired = true, updated_at = now()
+        FROM unnest(OLD.available_tests) AS t(label), parse_test_label(t.label) AS p
+        WHERE c.code = p.code
+          AND (c.category_id IS NULL OR c.category_id = OLD.id);
+        RETURN NULL;
+    END IF;
+
+    -- a label without its code would never reach the catalog, so the test
+    -- couldn't be ordered; the Tests admin page checks this before saving
+    IF EXISTS (
+        SELECT 1
+        FROM unnest(NEW.available_tests) AS t(label), parse_test_label(t.label) AS p
+        WHERE p.code IS NULL
+    ) THEN
+        RAISE EXCEPTION 'test labels must end with their code, e.g. "PSA (Total) [4304]"'
+            USING ERRCODE = 'invalid_parameter_value';
+    END IF;
+
+    IF TG_OP = 'UPDATE' THEN
+        UPDATE test_catalog c
+        SET retired = true, updated_at = now()
+        FROM unnest(OLD.available_tests) AS t(label), parse_test_label(t.label) AS p
+        WHERE c.code = p.code
+          AND c.category_id = OLD.id
+          AND p.code NOT IN (
+              SELECT n.code
+              FROM unnest(NEW.available_tests) AS a(label), parse_test_label(a.label) AS n
+              WHERE n.code IS NOT NULL
+          );
+    END IF;
+
+    INSERT INTO test_catalog (code, name, category_id)
+    SELECT DISTINCT ON (p.code) p.code, p.name, NEW.id
+    FROM unnest(NEW.available_tests) AS t(label), parse_test_label(t.label) AS p
+    WHERE p.code IS NOT NULL
+    ON CONFLICT (code) DO UPDATE
+    SET name = EXCLUDED.name,
+        category_id = EXCLUDED.category_id,
+        retired = false,
+        updated_at = now();
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sync_test_catalog
+AFTER INSERT OR UPDATE OF available_tests OR DELETE ON tests
+FOR EACH ROW
+EXECUTE FUNCTION sync_test_catalog();
+
+
+-- Writers still sending display strings (e.g. dummy_requests.sql) get their
+-- codes filled in; the app itself writes test_codes directly.
+CREATE OR REPLACE FUNCTION set_request_test_codes()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.selected_tests IS NOT NULL AND (
+        TG_OP = 'INSERT' AND NEW.test_codes IS NULL
+        OR TG_OP = 'UPDATE' AND NEW.selected_tests IS DISTINCT FROM OLD.selected_tests
+    ) THEN
+        NEW.test_codes = ARRAY(
+            SELECT p.code
+            FROM unnest(NEW.selected_tests) WITH ORDINALITY AS t(label, ord),
+                 parse_test_label(t.label) AS p
+            WHERE p.code IS NOT NULL
+            ORDER BY t.ord
+        );
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+ALTER TABLE requests ADD COLUMN test_codes INTEGER[];
+ALTER TABLE requests ALTER COLUMN selected_tests DROP NOT NULL;
+
+
+-- backfill: the current catalog first, then tests that only survive in old
+-- requests (retired, no category), then the requests themselves
+INSERT INTO test_catalog (code, name, category_id)
+SELECT DISTINCT ON (p.code) p.code, p.name, t.id
+FROM tests t, unnest(t.available_tests) AS a(label), parse_test_label(a.label) AS p
+WHERE p.code IS NOT NULL
+ORDER BY p.code, t.id;
+
+INSERT INTO test_catalog (code, name, retired)
+SELECT DISTINCT ON (p.code) p.code, p.name, true
+FROM requests r, unnest(r.selected_tests) AS s(label), parse_test_label(s.label) AS p
+WHERE p.code IS NOT NULL
+ORDER BY p.code
+ON CONFLICT (code) DO NOTHING;
+
+UPDATE requests r
+SET test_codes = ARRAY(
+    SELECT p.code
+    FROM unnest(r.selected_tests) WITH ORDINALITY AS s(label, ord),
+         parse_test_label(s.label) AS p
+    WHERE p.code IS NOT NULL
+    ORDER BY s.ord
+)
+WHERE r.test_codes IS NULL;
+
+CREATE TRIGGER set_request_test_codes
+BEFORE INSERT OR UPDATE OF selected_tests ON requests
+FOR EACH ROW
+EXECUTE FUNCTION set_request_test_codes();
+
+
+-- one row per (request, test) with the test's current name and category, in
+-- the order the tests were picked
+CREATE VIEW request_test_details AS
+SELECT
+    r.id AS request_id,
+    t.ord,
+    c.code,
+    c.name,
+    c.name || ' [' || c.code || ']' AS label,
+    c.category_id,
+    COALESCE(cat.category_name, 'Uncategorized') AS category
+FROM requests r
+CROSS JOIN LATERAL unnest(r.test_codes) WITH ORDINALITY AS t(code, ord)
+JOIN test_catalog c ON c.code = t.code
+LEFT JOIN tests cat ON cat.id = c.category_id;
@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Requests now reference tests by code (0002), and new rows leave
+-- selected_tests empty, so the "requests including test X" index moves over.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS requests_test_codes_gin
+ON requests USING GIN (test_codes);
+
+DROP INDEX CONCURRENTLY IF EXISTS requests_selected_tests_gin;
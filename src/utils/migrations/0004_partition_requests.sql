@@ -0,0 +1,228 @@
+-- Range-partitions requests by created_at month.
+--
+-- Each month lives in requests_YYYY_MM; requests_default catches rows outside
+-- every partition (e.g. backdated imports) until create_requests_partition()
+-- moves them into their month. maintain_requests_partitions() creates the
+-- months ahead and detaches old months into the requests_archive schema; run
+-- it daily via partitions.py.
+--
+-- The primary key becomes (id, created_at), since a unique constraint on a
+-- partitioned table must include the partition key. ids still come from the
+-- same sequence, so they stay unique in practice. Point lookups should pass
+-- created_at too so the planner only touches one partition.
+--
+-- This migration rewrites the table and holds an exclusive lock on it while
+-- it runs; schedule it for a quiet moment.
+
+CREATE SCHEMA IF NOT EXISTS requests_archive;
+
+-- the old table's triggers, indexes and test lookup view go with it
+DROP VIEW request_test_details;
+DROP TRIGGER new_lab_request ON requests;
+DROP TRIGGER set_request_test_codes ON requests;
+ALTER TABLE requests RENAME TO requests_unpartitioned;
+ALTER TABLE requests_unpartitioned RENAME CONSTRAINT requests_pkey TO requests_unpartitioned_pkey;
+ALTER SEQUENCE requests_id_seq OWNED BY NONE;
+DROP INDEX requests_assign_to_status_created_idx;
+DROP INDEX requests_assign_to_created_idx;
+DROP INDEX requests_created_idx;
+DROP INDEX requests_created_at_brin;
+DROP INDEX requests_test_codes_gin;
+
+
+CREATE TABLE requests (
+    id INTEGER NOT NULL DEFAULT nextval('requests_id_seq'),
+
+    first_name VARCHAR(100),
+    surname VARCHAR(100),
+    middle_name VARCHAR(100),
+    dob DATE,
+    gender VARCHAR(20),
+    phone VARCHAR(15),
+    email VARCHAR(150),
+    location VARCHAR(150),
+
+    doctor_dkl_code VARCHAR REFERENCES users(dkl_code) NULL,
+
+    selected_tests TEXT[],
+    test_codes INTEGER[],
+
+    assign_to VARCHAR REFERENCES users(dkl_code) NOT NULL,
+    priority VARCHAR(20) CHECK (priority IN ('Urgent', 'Routine')) DEFAULT 'Routine',
+
+    collection_date DATE,
+    collection_time TIME,
+
+    request_status VARCHAR(20) CHECK(request_status IN ('pending', 'in-progress', 'completed', 'cancelled')) DEFAULT 'pending',
+
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE requests_id_seq OWNED BY requests.id;
+
+CREATE TABLE requests_default PARTITION OF requests DEFAULT;
+
+-- same access paths as 0001/0003, now per partition
+CREATE INDEX requests_assign_to_status_created_idx
+ON requests (assign_to, request_status, created_at DESC, id DESC);
+
+CREATE INDEX requests_assign_to_created_idx
+ON requests (assign_to, created_at DESC, id DESC);
+
+CREATE INDEX requests_created_idx
+ON requests (created_at DESC, id DESC);
+
+CREATE INDEX requests_created_at_brin
+ON requests USING BRIN (created_at);
+
+CREATE INDEX requests_test_codes_gin
+ON requests USING GIN (test_codes);
+
+
+-- Creates the partition for the month containing `month` if it doesn't exist,
+-- moving any of that month's rows out of requests_default first. Returns the
+-- partition name, or NULL if it already existed.
+CREATE OR REPLACE FUNCTION create_requests_partition(month DATE)
+RETURNS TEXT AS $$
+DECLARE
+    start_at TIMESTAMP := date_trunc('month', month);
+    end_at TIMESTAMP := date_trunc('month', month) + INTERVAL '1 month';
+    partition_name TEXT := 'requests_' || to_char(date_trunc('month', month), 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN NULL;
+    END IF;
+
+    EXECUTE format(
+        'CREATE TABLE %I (LIKE requests INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+        partition_name
+    );
+    EXECUTE format(
+        'WITH moved AS (
+            DELETE FROM requests_default
+            WHERE created_at >= %L AND created_at < %L
+            RETURNING *
+        )
+        INSERT INTO %I SELECT * FROM moved',
+        start_at, end_at, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE requests ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, start_at, end_at
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Creates this month's partition and the next `months_ahead`, and, when
+-- `retain_months` is given, detaches partitions that ended more than
+-- `retain_months` months ago into the requests_archive schema, notifying
+-- requests_channel if any was. Returns one line per action taken.
+CREATE OR REPLACE FUNCTION maintain_requests_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    retain_months INTEGER DEFAULT NULL
+)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    created TEXT;
+    old_partition RECORD;
+    archived BOOLEAN := false;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        created := create_requests_partition(
+            (date_trunc('month', now()) + make_interval(months => i))::DATE
+        );
+        IF created IS NOT NULL THEN
+            RETURN NEXT 'created ' || created;
+        END IF;
+    END LOOP;
+
+    IF retain_months IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR old_partition IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'requests'::regclass
+          AND c.relname ~ '^requests_\d{4}_\d{2}$'
+          AND to_date(substring(c.relname FROM 10), 'YYYY_MM') + INTERVAL '1 month'
+              <= date_trunc('month', now()) - make_interval(months => retain_months)
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE requests DETACH PARTITION %I', old_partition.relname);
+        EXECUTE format('ALTER TABLE %I SET SCHEMA requests_archive', old_partition.relname);
+        RETURN NEXT 'archived ' || old_partition.relname;
+        archived := true;
+    END LOOP;
+
+    -- detaching fires no DELETE trigger: tell requests_channel listeners
+    -- (0010) themselves, so caches of requests drop the archived rows
+    IF archived THEN
+        PERFORM pg_notify('requests_channel', 'ARCHIVE');
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- a partition for every month that has requests, plus the months ahead,
+-- then move the rows over
+SELECT create_requests_partition(month::DATE)
+FROM generate_series(
+    date_trunc('month', (SELECT min(created_at) FROM requests_unpartitioned)),
+    date_trunc('month', (SELECT max(created_at) FROM requests_unpartitioned)),
+    INTERVAL '1 month'
+) AS month;
+
+SELECT maintain_requests_partitions();
+
+INSERT INTO requests (
+    id, first_name, surname, middle_name, dob, gender, phone, email, location,
+    doctor_dkl_code, selected_tests, test_codes, assign_to, priority,
+    collection_date, collection_time, request_status, created_at, updated_at
+)
+SELECT
+    id, first_name, surname, middle_name, dob, gender, phone, email, location,
+    doctor_dkl_code, selected_tests, test_codes, assign_to, priority,
+    collection_date, collection_time, request_status,
+    COALESCE(created_at, CURRENT_TIMESTAMP), updated_at
+FROM requests_unpartitioned;
+
+DROP TABLE requests_unpartitioned;
+
+
+CREATE TRIGGER set_request_test_codes
+BEFORE INSERT OR UPDATE OF selected_tests ON requests
+FOR EACH ROW
+EXECUTE FUNCTION set_request_test_codes();
+
+CREATE TRIGGER new_lab_request
+AFTER INSERT ON requests
+REFERENCING NEW TABLE AS new_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_new_request();
+
+
+-- Resolves test codes to names and categories, in the order given. Replaces
+-- the request_test_details view: callers pass the row's test_codes, so the
+-- lookup never has to find the request again (which, without created_at,
+-- would mean probing every partition). Codes missing from the catalog are
+-- kept, named by their code, under 'Uncategorized'.
+CREATE OR REPLACE FUNCTION resolve_tests(codes INTEGER[])
+RETURNS TABLE (ord BIGINT, code INTEGER, name TEXT, label TEXT, category TEXT) AS $$
+    SELECT
+        t.ord,
+        t.code,
+        COALESCE(c.name, t.code::TEXT),
+        COALESCE(c.name || ' [' || c.code || ']', t.code::TEXT),
+        COALESCE(cat.category_name, 'Uncategorized')
+    FROM unnest(codes) WITH ORDINALITY AS t(code, ord)
+    LEFT JOIN test_catalog c ON c.code = t.code
+    LEFT JOIN tests cat ON cat.id = c.category_id
+    ORDER BY t.ord;
+$$ LANGUAGE sql STABLE;
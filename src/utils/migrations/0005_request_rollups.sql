@@ -0,0 +1,183 @@
+-- Daily rollups of requests for the dashboard, so a period's metrics read one
+-- row per day (and status / test / phlebotomist) instead of every request in
+-- it. They are kept current by statement-level triggers on requests, in the
+-- writing transaction: each statement's transition tables are folded into
+-- +1 / -1 deltas and upserted, so an UPDATE that doesn't touch a rolled-up
+-- column writes nothing.
+--
+-- Tests are rolled up by code only. Category counts join test_catalog when
+-- they are read (request_daily_categories), so moving a test to another
+-- category is reflected everywhere, as it is for resolve_tests().
+--
+-- Days are created_at::DATE. Archived partitions stay counted, the rollups
+-- are the long-term history. rebuild_request_rollups() (or rebuild_rollups.py)
+-- recomputes everything from requests and the months detached into
+-- requests_archive, so a rebuild keeps the archived history.
+
+CREATE TABLE request_daily_status (
+    day DATE NOT NULL,
+    request_status VARCHAR(20) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, request_status)
+);
+
+CREATE TABLE request_daily_tests (
+    day DATE NOT NULL,
+    test_code INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, test_code)
+);
+
+CREATE TABLE request_daily_assignees (
+    day DATE NOT NULL,
+    assign_to VARCHAR NOT NULL,
+    request_status VARCHAR(20) NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, assign_to, request_status)
+);
+
+CREATE INDEX request_daily_assignees_assign_to_idx
+ON request_daily_assignees (assign_to, day);
+
+
+CREATE VIEW request_daily_categories AS
+SELECT
+    d.day,
+    COALESCE(cat.category_name, 'Uncategorized') AS category,
+    sum(d.count)::INTEGER AS count
+FROM request_daily_tests d
+JOIN test_catalog c ON c.code = d.test_code
+LEFT JOIN tests cat ON cat.id = c.category_id
+GROUP BY d.day, COALESCE(cat.category_name, 'Uncategorized');
+
+
+-- Transition tables can't be shared between events, hence one trigger per
+-- event and the change set picked by TG_OP.
+CREATE OR REPLACE FUNCTION rollup_request_changes()
+RETURNS TRIGGER AS $$
+DECLARE
+    changes TEXT;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        changes := 'SELECT created_at, request_status, assign_to, test_codes, 1 AS delta FROM new_requests';
+    ELSIF TG_OP = 'DELETE' THEN
+        changes := 'SELECT created_at, request_status, assign_to, test_codes, -1 AS delta FROM old_requests';
+    ELSE
+        changes := 'SELECT created_at, request_status, assign_to, test_codes, 1 AS delta FROM new_requests
+                    UNION ALL
+                    SELECT created_at, request_status, assign_to, test_codes, -1 AS delta FROM old_requests';
+    END IF;
+
+    -- keys are upserted in order so concurrent writers lock rows in the same order
+    EXECUTE format($sql$
+        INSERT INTO request_daily_status AS r (day, request_status, count)
+        SELECT created_at::DATE, request_status, sum(delta)
+        FROM (%s) c
+        WHERE request_status IS NOT NULL
+        GROUP BY 1, 2
+        HAVING sum(delta) <> 0
+        ORDER BY 1, 2
+        ON CONFLICT (day, request_status) DO UPDATE SET count = r.count + EXCLUDED.count
+    $sql$, changes);
+
+    EXECUTE format($sql$
+        INSERT INTO request_daily_tests AS r (day, test_code, count)
+        SELECT c.created_at::DATE, t.code, sum(c.delta)
+        FROM (%s) c
+        CROSS JOIN LATERAL unnest(c.test_codes) AS t(code)
+        GROUP BY 1, 2
+        HAVING sum(c.delta) <> 0
+        ORDER BY 1, 2
+        ON CONFLICT (day, test_code) DO UPDATE SET count = r.count + EXCLUDED.count
+    $sql$, changes);
+
+    EXECUTE format($sql$
+        INSERT INTO request_daily_assignees AS r (day, assign_to, request_status, count)
+        SELECT created_at::DATE, assign_to, request_status, sum(delta)
+        FROM (%s) c
+        WHERE request_status IS NOT NULL
+        GROUP BY 1, 2, 3
+        HAVING sum(delta) <> 0
+        ORDER BY 1, 2, 3
+        ON CONFLICT (day, assign_to, request_status) DO UPDATE SET count = r.count + EXCLUDED.count
+    $sql$, changes);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER rollup_inserted_requests
+AFTER INSERT ON requests
+REFERENCING NEW TABLE AS new_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION rollup_request_changes();
+
+CREATE TRIGGER rollup_updated_requests
+AFTER UPDATE ON requests
+REFERENCING OLD TABLE AS old_requests NEW TABLE AS new_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION rollup_request_changes();
+
+CREATE TRIGGER rollup_deleted_requests
+AFTER DELETE ON requests
+REFERENCING OLD TABLE AS old_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION rollup_request_changes();
+
+
+-- Recomputes the rollups from requests and the archived months. Writes to
+-- requests wait until the calling transaction ends, so no change is counted
+-- twice or missed; archived months aren't written to. The dashboard keeps
+-- reading the old rollups until then (DELETE, not TRUNCATE).
+CREATE OR REPLACE FUNCTION rebuild_request_rollups()
+RETURNS VOID AS $$
+DECLARE
+    source TEXT := 'SELECT created_at, request_status, assign_to, test_codes FROM requests';
+    archived RECORD;
+BEGIN
+    LOCK TABLE requests IN SHARE ROW EXCLUSIVE MODE;
+
+    -- see maintain_requests_partitions() in 0004
+    FOR archived IN
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = 'requests_archive'
+          AND tablename ~ '^requests_\d{4}_\d{2}$'
+        ORDER BY tablename
+    LOOP
+        source := source || format(
+            ' UNION ALL SELECT created_at, request_status, assign_to, test_codes FROM requests_archive.%I',
+            archived.tablename
+        );
+    END LOOP;
+
+    DELETE FROM request_daily_status;
+    DELETE FROM request_daily_tests;
+    DELETE FROM request_daily_assignees;
+
+    EXECUTE format($sql$
+        INSERT INTO request_daily_status (day, request_status, count)
+        SELECT created_at::DATE, request_status, count(*)
+        FROM (%s) r
+        WHERE request_status IS NOT NULL
+        GROUP BY 1, 2
+    $sql$, source);
+
+    EXECUTE format($sql$
+        INSERT INTO request_daily_tests (day, test_code, count)
+        SELECT r.created_at::DATE, t.code, count(*)
+        FROM (%s) r
+        CROSS JOIN LATERAL unnest(r.test_codes) AS t(code)
+        GROUP BY 1, 2
+    $sql$, source);
+
+    EXECUTE format($sql$
+        INSERT INTO request_daily_assignees (day, assign_to, request_status, count)
+        SELECT created_at::DATE, assign_to, request_status, count(*)
+        FROM (%s) r
+        WHERE request_status IS NOT NULL
+        GROUP BY 1, 2, 3
+    $sql$, source);
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_request_rollups();
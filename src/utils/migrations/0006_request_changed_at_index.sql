@@ -0,0 +1,7 @@
+-- Lets snapshot_export.py find the requests added or edited since its last
+-- run without scanning every partition. Not CONCURRENTLY: that isn't
+-- supported on a partitioned table, so writes to each partition wait while
+-- its index builds.
+
+CREATE INDEX requests_changed_at_idx
+ON requests ((COALESCE(updated_at, created_at)));
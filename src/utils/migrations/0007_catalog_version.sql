@@ -0,0 +1,39 @@
+-- A version counter for the test catalog (tests + test_catalog), bumped by
+-- every statement that changes either table and broadcast on
+-- catalog_channel. The Streamlit app and the bot cache the catalog keyed by
+-- this version and reload it only when it moves, instead of re-querying on a
+-- timer.
+
+CREATE TABLE catalog_version (
+    id BOOLEAN PRIMARY KEY DEFAULT true CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO catalog_version DEFAULT VALUES;
+
+
+CREATE OR REPLACE FUNCTION bump_catalog_version()
+RETURNS TRIGGER AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    UPDATE catalog_version
+    SET version = version + 1, changed_at = now()
+    RETURNING version INTO new_version;
+
+    -- delivered on commit, so listeners never reload before the change is visible
+    PERFORM pg_notify('catalog_channel', new_version::TEXT);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER bump_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tests
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_catalog_version();
+
+CREATE TRIGGER bump_catalog_version
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON test_catalog
+FOR EACH STATEMENT
+EXECUTE FUNCTION bump_catalog_version();
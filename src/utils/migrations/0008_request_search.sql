@@ -0,0 +1,33 @@
+-- Trigram indexes behind the Lab Requests search. Patient names are stored
+-- with spaces encoded as underscores, so they are searched through
+-- request_patient_name(), which decodes and lowercases them and collapses
+-- runs of spaces (a missing middle name included), as the app does to the
+-- search text; the index is on the same expression so the planner can use it.
+-- Not CONCURRENTLY, see 0006.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- a plain SQL expression of immutable functions (not concat_ws, which is
+-- only stable), inlined by the planner, so queries calling it match the index
+-- expression
+CREATE OR REPLACE FUNCTION request_patient_name(
+    first_name TEXT, middle_name TEXT, surname TEXT
+)
+RETURNS TEXT AS $$
+    SELECT btrim(regexp_replace(
+        lower(replace(
+            COALESCE(first_name, '') || ' ' || COALESCE(middle_name, '') || ' ' || COALESCE(surname, ''),
+            '_', ' '
+        )),
+        '\s+', ' ', 'g'
+    ));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX requests_patient_name_trgm_idx
+ON requests USING GIN (request_patient_name(first_name, middle_name, surname) gin_trgm_ops);
+
+CREATE INDEX requests_phone_trgm_idx
+ON requests USING GIN (phone gin_trgm_ops);
+
+CREATE INDEX requests_location_trgm_idx
+ON requests USING GIN (lower(location) gin_trgm_ops);
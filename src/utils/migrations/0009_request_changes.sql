@@ -0,0 +1,57 @@
+-- Lets a client keep a copy of requests current by fetching only what changed
+-- since its last refresh (see RequestCache in src/streamlit/utils.py):
+--
+--   - every UPDATE stamps updated_at, whichever code path made it, so
+--     COALESCE(updated_at, created_at) > watermark finds every added or edited
+--     row through requests_changed_at_idx (0006)
+--   - every DELETE leaves a tombstone in request_tombstones
+--
+-- Tombstones are kept for REQUEST_TOMBSTONE_RETENTION; a client whose
+-- watermark is older than that reloads its rows instead.
+--
+-- The app no longer sets updated_at itself; this trigger is the one place it
+-- is written. Like the rollup (0005), catalog version (0007) and change event
+-- (0010) triggers, the tombstone trigger fires once per statement rather than
+-- per row, so a bulk delete costs one insert.
+
+CREATE OR REPLACE FUNCTION stamp_request_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER stamp_request_updated_at
+BEFORE UPDATE ON requests
+FOR EACH ROW
+EXECUTE FUNCTION stamp_request_updated_at();
+
+
+CREATE TABLE request_tombstones (
+    id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX request_tombstones_deleted_at_idx
+ON request_tombstones (deleted_at);
+
+
+CREATE OR REPLACE FUNCTION record_request_tombstones()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO request_tombstones (id, created_at)
+    SELECT id, created_at FROM old_requests;
+
+    -- REQUEST_TOMBSTONE_RETENTION
+    DELETE FROM request_tombstones WHERE deleted_at < now() - INTERVAL '7 days';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER record_request_tombstones
+AFTER DELETE ON requests
+REFERENCING OLD TABLE AS old_requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION record_request_tombstones();
@@ -0,0 +1,22 @@
+-- Publishes a change event on requests_channel for every statement that adds,
+-- edits or deletes requests, e.g. a phlebotomist updating a task's status from
+-- the bot. The Streamlit server LISTENs on it (RequestChangeListener in
+-- src/streamlit/utils.py) and its live fragments re-query only after an event.
+--
+-- The payload is just the operation: listeners only need to know that
+-- something changed. maintain_requests_partitions() (0004) sends ARCHIVE when
+-- it detaches months, which no trigger sees. Identical notifications in one transaction are folded
+-- into one, and all are delivered on commit.
+
+CREATE OR REPLACE FUNCTION notify_request_changes()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('requests_channel', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER notify_request_changes
+AFTER INSERT OR UPDATE OR DELETE ON requests
+FOR EACH STATEMENT
+EXECUTE FUNCTION notify_request_changes();
@@ -0,0 +1,133 @@
+"""
+Shows that the hot request queries stay flat as history grows.
+
+Inside one transaction that is rolled back, this seeds months of history in
+steps, going back from the current month (MONTHLY_ROWS requests per month by
+default). After each step it times the queries the app runs against recent
+data: the bot's task list, the lab requests board and the dashboard's current
+month. With partition pruning the timings should barely move between steps.
+An unpartitioned table would keep slowing down as it grows.
+
+Usage:
+    python partition_benchmark.py [MONTHLY_ROWS] [STEPS] [MONTHS_PER_STEP]
+"""
+
+import statistics
+import sys
+import time
+
+from migrate import connect
+
+MONTHLY_ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+STEPS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+MONTHS_PER_STEP = int(sys.argv[3]) if len(sys.argv) > 3 else 6
+ASSIGNEES = 300
+RUNS = 20
+
+
+SEED_USERS = """
+    INSERT INTO users (dkl_code, name, email, user_type)
+    SELECT 'bench' || n, 'Bench ' || n, 'bench' || n || '@example.com', 'phlebotomist'
+    FROM generate_series(1, %(assignees)s) AS n;
+"""
+
+# one month of requests, `months_back` months before the current one
+SEED_MONTH = """
+    SELECT create_requests_partition(
+        (date_trunc('month', now()) - make_interval(months => %(months_back)s))::DATE
+    );
+
+    INSERT INTO requests (
+        first_name, surname, test_codes, assign_to, priority, request_status, created_at
+    )
+    SELECT
+        'First' || n,
+        'Last' || n,
+        ARRAY[n %% 97, n %% 89 + 100],
+        'bench' || (n %% %(assignees)s + 1),
+        CASE WHEN n %% 10 = 0 THEN 'Urgent' ELSE 'Routine' END,
+        (ARRAY['pending', 'in-progress', 'completed', 'cancelled'])[n %% 4 + 1],
+        date_trunc('month', now()) - make_interval(months => %(months_back)s)
+            + n * (INTERVAL '28 days' / %(rows)s)
+    FROM generate_series(1, %(rows)s) AS n;
+"""
+
+QUERIES = {
+    "bot task list": """
+        SELECT id, first_name, surname, created_at FROM requests
+        WHERE assign_to='bench1' AND request_status='pending'
+        ORDER BY created_at DESC, id DESC LIMIT 6
+    """,
+    "bot task list, later page": """
+        SELECT id, first_name, surname, created_at FROM requests
+        WHERE assign_to='bench1' AND request_status='pending'
+          AND (created_at, id) < (date_trunc('month', now()), 0)
+          AND created_at <= date_trunc('month', now())
+        ORDER BY created_at DESC, id DESC LIMIT 6
+    """,
+    "lab requests board (3 months)": """
+        SELECT id, created_at FROM requests
+        WHERE created_at >= date_trunc('month', now()) - make_interval(months => 3)
+        ORDER BY created_at DESC LIMIT 50
+    """,
+    "dashboard this month": """
+        SELECT request_status, count(*) FROM requests
+        WHERE created_at >= date_trunc('month', now())
+          AND created_at < date_trunc('month', now()) + INTERVAL '1 month'
+        GROUP BY request_status
+    """,
+}
+
+
+def time_query(cur, query: str) -> float:
+    """Median wall time of RUNS executions, in milliseconds."""
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        cur.execute(query)
+        cur.fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> None:
+    conn = connect()
+    results = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE requests DISABLE TRIGGER USER;")
+            cur.execute(SEED_USERS, {"assignees": ASSIGNEES})
+
+            months = 0
+            for step in range(STEPS):
+                for _ in range(MONTHS_PER_STEP):
+                    cur.execute(
+                        SEED_MONTH,
+                        {
+                            "months_back": months,
+                            "rows": MONTHLY_ROWS,
+                            "assignees": ASSIGNEES,
+                        },
+                    )
+                    months += 1
+                cur.execute("ANALYZE requests;")
+
+                timings = {name: time_query(cur, q) for name, q in QUERIES.items()}
+                results.append((months * MONTHLY_ROWS, timings))
+                print(f"seeded {months} month(s), {months * MONTHLY_ROWS:,} requests")
+    finally:
+        conn.rollback()
+        conn.close()
+
+    width = max(len(name) for name in QUERIES)
+    print()
+    print(
+        f"{'median ms':<{width}}  " + "  ".join(f"{rows:>10,}" for rows, _ in results)
+    )
+    for name in QUERIES:
+        row = "  ".join(f"{timings[name]:>10.2f}" for _, timings in results)
+        print(f"{name:<{width}}  {row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Maintains the monthly partitions of the requests table (see
+migrations/0004_partition_requests.sql). Run it daily, e.g. from cron:
+
+    0 2 * * *  cd /path/to/src/utils && python partitions.py
+
+It creates the current month's partition and REQUESTS_MONTHS_AHEAD months
+ahead, moving any rows that landed in requests_default into them. When
+REQUESTS_RETAIN_MONTHS is set, partitions that ended more than that many months
+ago are detached into the requests_archive schema. They are no longer visible
+to the app, but they can be queried or dumped from there.
+"""
+
+import os
+
+from migrate import connect
+
+MONTHS_AHEAD = int(os.getenv("REQUESTS_MONTHS_AHEAD", 3))
+RETAIN_MONTHS = os.getenv("REQUESTS_RETAIN_MONTHS")
+
+
+def main() -> None:
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT maintain_requests_partitions(%s, %s);",
+                (MONTHS_AHEAD, int(RETAIN_MONTHS) if RETAIN_MONTHS else None),
+            )
+            actions = [row[0] for row in cur.fetchall()]
+
+            cur.execute("SELECT count(*) FROM requests_default;")
+            stray = cur.fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+
+    for action in actions:
+        print(action)
+    if not actions:
+        print("Partitions are up to date")
+    if stray:
+        print(f"{stray} request(s) in requests_default (outside every partition)")
+
+
+if __name__ == "__main__":
+    main()
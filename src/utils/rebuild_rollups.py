@@ -0,0 +1,43 @@
+"""
+Rebuilds the dashboard's daily rollups (see migrations/0005_request_rollups.sql)
+from the requests table and the months archived into requests_archive.
+
+The triggers keep the rollups current on their own. Run this after loading
+requests with triggers disabled, after restoring a backup, or if the counts
+ever look off. Writes to requests wait while it runs. The dashboard keeps
+showing the previous numbers until it commits.
+
+Usage:
+    python rebuild_rollups.py
+"""
+
+import time
+
+from migrate import connect
+
+
+def main() -> None:
+    conn = connect()
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT rebuild_request_rollups();")
+            cur.execute("""
+                SELECT
+                    (SELECT count(*) FROM request_daily_status),
+                    (SELECT count(*) FROM request_daily_tests),
+                    (SELECT count(*) FROM request_daily_assignees);
+                """)
+            status_rows, test_rows, assignee_rows = cur.fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(
+        f"Rebuilt rollups in {time.perf_counter() - started:.1f}s: "
+        f"{status_rows} status, {test_rows} test and {assignee_rows} phlebotomist rows"
+    )
+
+
+if __name__ == "__main__":
+    main()
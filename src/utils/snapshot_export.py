@@ -0,0 +1,232 @@
+"""
+Exports requests and the test catalog to Parquet for the dashboard, which
+aggregates them with DuckDB instead of scanning Postgres.
+
+Layout under SNAPSHOT_DIR (src/snapshots by default):
+
+    requests/month=YYYY-MM/data.parquet   one file per created_at month
+    tests/data.parquet                    test code, name, category, retired
+    state.json                            watermark and per-month row counts
+
+Runs are incremental. A month is rewritten when one of its requests was added
+or edited (COALESCE(updated_at, created_at)) after the last watermark, or when
+its row count no longer matches the daily rollups, which is how deletions show
+up. Everything is read from one REPEATABLE READ snapshot. The watermark lags
+by WATERMARK_OVERLAP so rows committed late by long transactions are still
+picked up. Rewriting a month twice is harmless. Files are replaced atomically,
+so the dashboard never reads a half written one.
+
+Archived months stay in the snapshot, as they stay in the rollups. A month
+whose partition partitions.py moved to requests_archive is exported from
+there, and a month that is gone from both but still counted by the rollups
+keeps its last files. So the dashboard's charts cover the same history as its
+rollup-based status totals.
+
+Only the columns the dashboard aggregates are exported; patient details stay
+in Postgres.
+
+Run it from cron every few minutes:
+
+    */5 * * * *  cd /path/to/src/utils && python snapshot_export.py
+
+Usage:
+    python snapshot_export.py           export what changed
+    python snapshot_export.py --full    rewrite every month
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+
+from migrate import connect
+
+SNAPSHOT_DIR = Path(
+    os.getenv("SNAPSHOT_DIR", Path(__file__).resolve().parents[1] / "snapshots")
+)
+WATERMARK_OVERLAP = timedelta(
+    seconds=float(os.getenv("SNAPSHOT_WATERMARK_OVERLAP_SECONDS", 300))
+)
+
+# Parquet column types. Every file gets the same schema whatever its rows
+# hold; left to pandas, a month whose test_codes are all NULL would be written
+# as INTEGER and break unnest(test_codes) over the whole glob. Timestamps stay
+# TIMESTAMP (no time zone), like the Postgres columns they come from.
+REQUEST_TYPES = {
+    "id": "INTEGER",
+    "created_at": "TIMESTAMP",
+    "updated_at": "TIMESTAMP",
+    "request_status": "VARCHAR",
+    "priority": "VARCHAR",
+    "assign_to": "VARCHAR",
+    "doctor_dkl_code": "VARCHAR",
+    "test_codes": "INTEGER[]",
+    "collection_date": "DATE",
+}
+TEST_TYPES = {
+    "code": "INTEGER",
+    "name": "VARCHAR",
+    "category": "VARCHAR",
+    "retired": "BOOLEAN",
+}
+REQUEST_COLUMNS = ", ".join(REQUEST_TYPES)
+
+
+def load_state() -> dict:
+    path = SNAPSHOT_DIR / "state.json"
+    if "--full" in sys.argv or not path.exists():
+        return {"watermark": None, "months": {}}
+    return json.loads(path.read_text())
+
+
+def save_state(state: dict) -> None:
+    path = SNAPSHOT_DIR / "state.json"
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2))
+    os.replace(tmp, path)
+
+
+def write_parquet(duck, df: pd.DataFrame, path: Path, types: dict[str, str]) -> None:
+    """
+    Writes df to path with the given column types, through a temporary file,
+    then swaps it in.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    columns = ", ".join(
+        f"{column}::{type} AS {column}" for column, type in types.items()
+    )
+    duck.register("snapshot_rows", df)
+    try:
+        duck.execute(
+            f"COPY (SELECT {columns} FROM snapshot_rows) TO '{tmp}' (FORMAT PARQUET)"
+        )
+    finally:
+        duck.unregister("snapshot_rows")
+    os.replace(tmp, path)
+
+
+def months_to_export(cur, state: dict) -> tuple[set[str], dict[str, int]]:
+    """
+    Returns the months to rewrite and the current row count of every month.
+    """
+    cur.execute("""
+        SELECT to_char(day, 'YYYY-MM') AS month, sum(count)::INTEGER
+        FROM request_daily_status
+        GROUP BY month;
+        """)
+    counts = dict(cur.fetchall())
+
+    if state["watermark"] is None:
+        return set(counts), counts
+
+    cur.execute(
+        """
+        SELECT DISTINCT to_char(created_at, 'YYYY-MM')
+        FROM requests
+        WHERE COALESCE(updated_at, created_at) > %s;
+        """,
+        (datetime.fromisoformat(state["watermark"]) - WATERMARK_OVERLAP,),
+    )
+    changed = {row[0] for row in cur.fetchall()}
+
+    # months that gained or lost rows without an edit, e.g. deletions
+    for month in set(counts) | set(state["months"]):
+        if counts.get(month, 0) != state["months"].get(month, 0):
+            changed.add(month)
+    return changed, counts
+
+
+def month_source(cur, month: str) -> str:
+    """
+    The table holding a month's requests: its archived partition once
+    partitions.py has detached it, requests otherwise.
+    """
+    archived = f"requests_archive.requests_{month.replace('-', '_')}"
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (archived,))
+    return archived if cur.fetchone()[0] else "requests"
+
+
+def export_month(cur, duck, month: str, counted: int) -> int:
+    start = datetime.strptime(month, "%Y-%m")
+    end = (start + timedelta(days=32)).replace(day=1)
+    cur.execute(
+        f"""
+        SELECT {REQUEST_COLUMNS} FROM {month_source(cur, month)}
+        WHERE created_at >= %s AND created_at < %s
+        ORDER BY created_at, id;
+        """,
+        (start, end),
+    )
+    columns = [column.name for column in cur.description]
+    df = pd.DataFrame(cur.fetchall(), columns=columns)
+
+    month_dir = SNAPSHOT_DIR / "requests" / f"month={month}"
+    if df.empty:
+        # still counted by the rollups: archived and since dropped, keep it
+        if counted:
+            print(f"{month}: no rows left in the database, keeping its snapshot")
+            return 0
+        shutil.rmtree(month_dir, ignore_errors=True)
+        return 0
+    write_parquet(duck, df, month_dir / "data.parquet", REQUEST_TYPES)
+    return len(df)
+
+
+def export_tests(cur, duck) -> int:
+    cur.execute("""
+        SELECT
+            c.code,
+            c.name,
+            COALESCE(t.category_name, 'Uncategorized') AS category,
+            c.retired
+        FROM test_catalog c
+        LEFT JOIN tests t ON t.id = c.category_id
+        ORDER BY c.code;
+        """)
+    columns = [column.name for column in cur.description]
+    df = pd.DataFrame(cur.fetchall(), columns=columns)
+    write_parquet(duck, df, SNAPSHOT_DIR / "tests" / "data.parquet", TEST_TYPES)
+    return len(df)
+
+
+def main() -> None:
+    started = time.perf_counter()
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    state = load_state()
+
+    conn = connect()
+    conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    duck = duckdb.connect()
+    try:
+        with conn.cursor() as cur:
+            # the snapshot is taken by the first query, so read the clock in it
+            cur.execute("SELECT now()::TIMESTAMP;")
+            watermark = cur.fetchone()[0]
+
+            months, counts = months_to_export(cur, state)
+            rows = 0
+            for month in sorted(months):
+                rows += export_month(cur, duck, month, counts.get(month, 0))
+            tests = export_tests(cur, duck)
+        conn.rollback()
+    finally:
+        conn.close()
+        duck.close()
+
+    save_state({"watermark": watermark.isoformat(), "months": counts})
+    print(
+        f"Exported {rows} request(s) in {len(months)} month(s) and {tests} test(s) "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()